@@ -31,7 +31,8 @@ class TshirtSettingAdmin(admin.ModelAdmin):
 
 @admin.register(PrintJob)
 class PrintJobAdmin(TranslationAdmin):
-    list_display = ("order_no", "kanji", "reading", "mode", "size", "body_color", "text_color", "created_at")
+    list_display = ("order_no", "kanji", "reading", "mode", "size", "body_color", "text_color", "status", "created_at")
+    list_filter = ("status",)
     search_fields = ("kanji", "reading", "meaning", "order_no")
 
 @admin.register(BadWord)
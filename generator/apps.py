@@ -8,3 +8,4 @@ class GeneratorConfig(AppConfig):
 
     def ready(self):
         import generator.translation  # ここでimportして確実に読み込ませる
+        import generator.meaning_cache  # KanjiMeaning の変更シグナルを登録
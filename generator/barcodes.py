@@ -0,0 +1,106 @@
+# generator/barcodes.py
+
+import os
+import threading
+from io import BytesIO
+import barcode
+import qrcode
+from barcode.writer import ImageWriter, SVGWriter
+from django.conf import settings
+from .render_cache import RenderCache
+
+# 描画結果が変わる修正をしたら上げる（ディスクキャッシュのキー・URLに含まれる）
+BARCODE_VERSION = 1
+
+# 注文完了ページのJANコード画像の描画オプション
+BARCODE_OPTIONS = {
+    'module_height': 15.0,
+    'font_size': 10,
+    'text_distance': 1,
+    'module_width': 1.5,
+    'write_text': False,
+}
+
+# 形式 -> (python-barcode の Writer, Content-Type)。SVGは拡大しても崩れずPillowも使わない
+BARCODE_FORMATS = {
+    'svg': (SVGWriter, 'image/svg+xml'),
+    'png': (ImageWriter, 'image/png'),
+}
+
+# メモリに持つ画像の数（JANコードは通常1種類なので少なくてよい）
+BARCODE_MEMORY_MAX = 32
+
+
+def render_barcode(code, options, image_format='png'):
+    buf = BytesIO()
+    writer = BARCODE_FORMATS[image_format][0]()
+    barcode.get('ean13', code, writer=writer).write(buf, options=dict(options))
+    return buf.getvalue()
+
+
+barcode_cache = RenderCache(
+    getattr(settings, 'BARCODE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'barcode')),
+    getattr(settings, 'KANJI_IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+    render_barcode,
+    version=BARCODE_VERSION,
+)
+
+_memory = {}
+_memory_lock = threading.Lock()
+
+
+def barcode_key(code, options=BARCODE_OPTIONS, image_format='png'):
+    return barcode_cache.key(code, options, image_format)
+
+
+def barcode_image(code, options=BARCODE_OPTIONS, image_format='png'):
+    # メモリ → ディスク → 描画 の順に探す
+    key = barcode_key(code, options, image_format)
+    data = _memory.get(key)
+    if data is None:
+        data = barcode_cache.get_or_render(code, options, image_format)
+        with _memory_lock:
+            if len(_memory) >= BARCODE_MEMORY_MAX:
+                _memory.clear()
+            _memory[key] = data
+    return data
+
+
+def invalidate_barcode(code, options=BARCODE_OPTIONS):
+    # JANコードを変更したときに古いコードの画像を捨てる
+    for image_format in BARCODE_FORMATS:
+        key = barcode_key(code, options, image_format)
+        with _memory_lock:
+            _memory.pop(key, None)
+        try:
+            os.remove(barcode_cache.path_for(key))
+        except OSError:
+            pass
+
+
+def qr_svg(data, border=4):
+    """QRコードをインラインで埋め込めるSVG文字列にする
+
+    qrcode の SvgPathImage はモジュール1つごとにパスを書くので、横に続く黒モジュールを
+    1本の矩形にまとめて半分以下の大きさにしている。大きさは表示側のCSSで決める。
+    """
+    qr = qrcode.QRCode(border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            path.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+    size = len(matrix)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(path)}"/></svg>'
+    )
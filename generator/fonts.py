@@ -0,0 +1,323 @@
+# generator/fonts.py
+
+import json
+import math
+import os
+import threading
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+from django.conf import settings
+
+
+FONT_CHOICES = {
+    "ZenOldMincho": "ZenOldMincho-Black.ttf",                 # Google Fonts例
+    "Kouzan": "衡山毛筆フォント.ttf",                          # 例：Kouzan font
+    "YujiMai": "YujiMai-Regular.ttf",                    # Google Fonts例
+}
+
+FONT_PATHS = {
+    "Kouzan": "static/fonts/Kouzan.ttf",
+    "ZenOldMincho": "static/fonts/ZenOldMincho-Black.ttf",
+    "YujiMai": "static/fonts/YujiMai-Regular.ttf",
+}
+
+DEFAULT_FONT_PATH = "static/fonts/ZenOldMincho-Black.ttf"
+
+
+def font_path_for(font_code):
+    # kanji_image 用: フォントコード -> static/fonts 以下の絶対パス（不明なコードは ZenOldMincho）
+    font_file = FONT_CHOICES.get(font_code, FONT_CHOICES["ZenOldMincho"])
+    return os.path.join(settings.BASE_DIR, 'static', 'fonts', font_file)
+
+
+# FreeTypeFontはTTFのパースが重いので (フォントパス, サイズ) ごとにプロセス内でLRUキャッシュする
+FONT_CACHE_SIZE = getattr(settings, 'FONT_CACHE_SIZE', 256)
+
+
+def resolve_font_path(font_path):
+    # 相対パス/シンボリックリンクの違いで同じフォントが別キーにならないよう正規化
+    return os.path.realpath(font_path)
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def _load_font(resolved_path, size):
+    return ImageFont.truetype(resolved_path, size)
+
+
+def get_font(font_path, size):
+    return _load_font(resolve_font_path(font_path), int(size))
+
+
+def font_cache_info():
+    # hits / misses / maxsize / currsize
+    return _load_font.cache_info()
+
+
+def clear_font_cache():
+    _load_font.cache_clear()
+
+
+# ---- フォントサイズ推定 ----
+# グリフの外接矩形はポイントサイズにほぼ比例するので、基準サイズで一度だけ測った寸法から
+# 収まるサイズを見積もり、境界付近だけ実測して二分探索と同じ結果を返す。
+
+REFERENCE_SIZE = 1024
+# 比例計算の誤差上限（1グリフあたり）: 丸め/ヒンティング分の固定px + サイズ比例分
+GLYPH_SLACK_PX = 3
+GLYPH_SLACK_RATIO = 0.01
+
+ROTATED_CHARS = ('ー', 'ｰ', '-')
+
+_measure_draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+
+def text_bbox(text, font):
+    return _measure_draw.textbbox((0, 0), text, font=font)
+
+
+def text_extent(text, font):
+    bbox = text_bbox(text, font)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+
+# ---- グリフ寸法テーブル ----
+# フォントごとに基準サイズでの外接矩形を 文字→[left, top, right, bottom] で持つ。
+# build_glyph_metrics コマンドで GLYPH_METRICS_DIR にJSONとして書き出しておけば起動後に読み込むだけで済み、
+# テーブルにない文字は初回に実測して追記する（メモリ上のみ）。
+
+GLYPH_METRICS_DIR = getattr(
+    settings, 'GLYPH_METRICS_DIR', os.path.join(settings.BASE_DIR, 'cache', 'glyph_metrics')
+)
+
+_glyph_tables = {}
+_glyph_tables_lock = threading.Lock()
+
+
+def default_glyph_charset():
+    # ひらがな・カタカナ・半角カナ・ASCII
+    ranges = [(0x3041, 0x3096), (0x309B, 0x309F), (0x30A1, 0x30FF), (0xFF61, 0xFF9F), (0x20, 0x7E)]
+    return ''.join(chr(c) for start, end in ranges for c in range(start, end + 1))
+
+
+def _font_signature(resolved_path):
+    # フォントファイルが差し替えられたら保存済みテーブルを使わない
+    stat = os.stat(resolved_path)
+    return {'font_bytes': stat.st_size, 'font_mtime': int(stat.st_mtime)}
+
+
+def glyph_metrics_file(font_path):
+    return os.path.join(GLYPH_METRICS_DIR, os.path.basename(resolve_font_path(font_path)) + '.json')
+
+
+def build_glyph_table(font_path, chars):
+    font = get_font(font_path, REFERENCE_SIZE)
+    return {ch: list(text_bbox(ch, font)) for ch in dict.fromkeys(chars)}
+
+
+def save_glyph_table(font_path, table):
+    resolved = resolve_font_path(font_path)
+    os.makedirs(GLYPH_METRICS_DIR, exist_ok=True)
+    data = dict(_font_signature(resolved), reference_size=REFERENCE_SIZE, glyphs=table)
+    path = glyph_metrics_file(resolved)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    with _glyph_tables_lock:
+        _glyph_tables[resolved] = dict(table)
+    return path
+
+
+def _load_glyph_table(resolved):
+    try:
+        with open(glyph_metrics_file(resolved), encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('reference_size') != REFERENCE_SIZE:
+        return {}
+    if any(data.get(k) != v for k, v in _font_signature(resolved).items()):
+        return {}
+    return {ch: list(bbox) for ch, bbox in data.get('glyphs', {}).items()}
+
+
+def glyph_table(font_path):
+    resolved = resolve_font_path(font_path)
+    table = _glyph_tables.get(resolved)
+    if table is None:
+        with _glyph_tables_lock:
+            table = _glyph_tables.get(resolved)
+            if table is None:
+                table = _glyph_tables[resolved] = _load_glyph_table(resolved)
+    return table
+
+
+def clear_glyph_tables():
+    with _glyph_tables_lock:
+        _glyph_tables.clear()
+    _reference_text_bbox.cache_clear()
+
+
+@lru_cache(maxsize=1024)
+def _reference_text_bbox(resolved_path, text):
+    return text_bbox(text, _load_font(resolved_path, REFERENCE_SIZE))
+
+
+def reference_bbox(font_path, text):
+    # 基準サイズでの外接矩形。1文字ならグリフ寸法テーブルから引く
+    resolved = resolve_font_path(font_path)
+    if len(text) != 1:
+        return _reference_text_bbox(resolved, text)
+    table = glyph_table(resolved)
+    bbox = table.get(text)
+    if bbox is None:
+        bbox = table[text] = list(text_bbox(text, _load_font(resolved, REFERENCE_SIZE)))
+    return bbox
+
+
+def reference_extent(font_path, text):
+    bbox = reference_bbox(font_path, text)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+
+def glyph_bbox(font_path, ch, size):
+    # 基準サイズの外接矩形を size に拡大縮小（実測と同じく外向きに丸める）
+    left, top, right, bottom = reference_bbox(font_path, ch)
+    scale = size / REFERENCE_SIZE
+    return (
+        math.floor(left * scale), math.floor(top * scale),
+        math.ceil(right * scale), math.ceil(bottom * scale),
+    )
+
+
+def _column_units(extents, text, rotate_bars):
+    units = []
+    for ch, (w, h) in zip(text, extents):
+        # 長音符は90度回転して描くので幅と高さを入れ替える
+        if rotate_bars and ch in ROTATED_CHARS:
+            w, h = h, w
+        units.append((w, h))
+    return units
+
+
+def measure_layout(text, font, vertical=False, rotate_bars=False, extra_ratio=0):
+    # 実測: 横書きは文字列全体、縦書きは1文字ずつ積み上げ
+    if not vertical:
+        return text_extent(text, font)
+    units = _column_units([text_extent(ch, font) for ch in text], text, rotate_bars)
+    width = max(w for w, h in units)
+    height = sum(h + math.ceil(h * extra_ratio) for w, h in units)
+    return width, height
+
+
+def _predict_layout(text, font_path, vertical, rotate_bars, extra_ratio):
+    # size -> (推定幅, 推定高さ, 幅の誤差上限, 高さの誤差上限) を返す関数
+    if not vertical:
+        ref_w, ref_h = reference_extent(font_path, text)
+        n = len(text)
+
+        def predict(size):
+            scale = size / REFERENCE_SIZE
+            slack = n * (GLYPH_SLACK_PX + size * GLYPH_SLACK_RATIO)
+            return ref_w * scale, ref_h * scale, slack, slack
+        return predict
+
+    units = _column_units([reference_extent(font_path, ch) for ch in text], text, rotate_bars)
+    ref_w = max(w for w, h in units)
+    ref_h = sum(h for w, h in units) * (1 + extra_ratio)
+    n = len(units)
+
+    def predict(size):
+        scale = size / REFERENCE_SIZE
+        slack = GLYPH_SLACK_PX + size * GLYPH_SLACK_RATIO
+        slack_h = n * (slack * (1 + extra_ratio) + (1 if extra_ratio else 0))
+        return ref_w * scale, ref_h * scale, slack, slack_h
+    return predict
+
+
+def _guess_size(predict, max_width, max_height, min_size, max_size):
+    # 見積もり寸法が収まる最大サイズ（見積もりはサイズに比例）
+    est_w, est_h, _, _ = predict(REFERENCE_SIZE)
+    limits = [max_size]
+    if est_w > 0:
+        limits.append(math.floor(max_width * REFERENCE_SIZE / est_w))
+    if est_h > 0:
+        limits.append(math.floor(max_height * REFERENCE_SIZE / est_h))
+    return max(min_size, min(limits))
+
+
+def solve_font_size(text, font_path, max_width, max_height, min_size, max_size,
+                    vertical=False, rotate_bars=False, extra_ratio=0):
+    """max_width x max_height に収まる最大フォントサイズ（従来の二分探索と同じ結果）"""
+    if not text:
+        return max_size if max_width >= 0 and max_height >= 0 else min_size
+    predict = _predict_layout(text, font_path, vertical, rotate_bars, extra_ratio)
+    extents = {}
+
+    def extent(size):
+        if size not in extents:
+            extents[size] = measure_layout(text, get_font(font_path, size), vertical, rotate_bars, extra_ratio)
+        return extents[size]
+
+    def measure(size):
+        w, h = extent(size)
+        return w <= max_width and h <= max_height
+
+    # 1回目の実測で見積もりとの差（丸め誤差の蓄積分）を補正してサイズを予測し、
+    # 「そのサイズで収まり、+1で収まらない」ことを確かめる
+    guess = _guess_size(predict, max_width, max_height, min_size, max_size)
+    real_w, real_h = extent(guess)
+    est_w, est_h, _, _ = predict(guess)
+    guess = _guess_size(
+        predict, max_width - (real_w - est_w), max_height - (real_h - est_h), min_size, max_size
+    )
+    if guess == min_size and not measure(guess):
+        return min_size
+    if measure(guess) and (guess == max_size or not measure(guess + 1)):
+        return guess
+
+    # 確定できなかった場合は見積もりで決まらない境界付近だけ実測して二分探索
+    def fits(size):
+        est_w, est_h, slack_w, slack_h = predict(size)
+        if est_w + slack_w <= max_width and est_h + slack_h <= max_height:
+            return True
+        if est_w - slack_w > max_width or est_h - slack_h > max_height:
+            return False
+        return measure(size)
+
+    best = min_size
+    left, right = min_size, max_size
+    while left <= right:
+        mid = (left + right) // 2
+        if fits(mid):
+            best = mid
+            left = mid + 1
+        else:
+            right = mid - 1
+    return best
+
+
+def get_font_size_for_text(text, font_path, max_width, max_height, min_font_size=16, max_font_size=120, vertical=False):
+    # 縦書きは長音符を回転させた寸法で1文字ずつ積み上げ
+    return solve_font_size(
+        text, font_path, max_width, max_height, min_font_size, max_font_size,
+        vertical=vertical, rotate_bars=vertical,
+    )
+
+
+def get_best_font_size(text, font_path, img_w, img_h, vertical=False, margin=120, min_size=50, max_size=1000):
+    # 上下左右margin px空けて収まる最大フォントサイズ
+    return solve_font_size(
+        text, font_path, img_w - 2*margin, img_h - 2*margin, min_size, max_size,
+        vertical=vertical,
+    )
+
+
+def get_best_font_size_tate(
+    text, font_path, img_w, img_h, margin=120, min_size=50, max_size=1000, extra_ratio=0.2
+):
+    # 文字ごとに高さのextra_ratio分の字間を足して積み上げる
+    return solve_font_size(
+        text, font_path, img_w - 2*margin, img_h - 2*margin, min_size, max_size,
+        vertical=True, rotate_bars=True, extra_ratio=extra_ratio,
+    )
@@ -0,0 +1,85 @@
+# generator/gpt_async.py
+
+import asyncio
+import threading
+import weakref
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+GPT_MODEL = "gpt-3.5-turbo"
+# 1回の問い合わせの待ち時間の上限（秒）と、失敗時の再試行回数
+GPT_ASYNC_TIMEOUT = getattr(settings, 'GPT_ASYNC_TIMEOUT', 30)
+GPT_ASYNC_MAX_RETRIES = getattr(settings, 'GPT_ASYNC_MAX_RETRIES', 2)
+
+# イベントループ -> AsyncOpenAI。中の httpx の接続プールを使い回して、問い合わせごとのTLS接続を省く
+# （接続はループをまたいで使えないのでループごとに持つ。ASGIサーバーではワーカーに1つ）
+_clients = weakref.WeakKeyDictionary()
+# 同期版（WSGI）のクライアントはプロセスに1つ（OpenAI はスレッド間で共有できる）
+_sync_client = None
+_sync_client_lock = threading.Lock()
+
+
+def async_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncOpenAI(
+            api_key=getattr(settings, 'OPENAI_API_KEY', None),
+            timeout=GPT_ASYNC_TIMEOUT,
+            max_retries=GPT_ASYNC_MAX_RETRIES,
+        )
+    return client
+
+
+def client():
+    global _sync_client
+    with _sync_client_lock:
+        if _sync_client is None:
+            _sync_client = OpenAI(
+                api_key=getattr(settings, 'OPENAI_API_KEY', None),
+                timeout=GPT_ASYNC_TIMEOUT,
+                max_retries=GPT_ASYNC_MAX_RETRIES,
+            )
+        return _sync_client
+
+
+async def achat(request):
+    # views の *_request() が返す (messages, max_tokens, temperature) で問い合わせ、本文を返す
+    messages, max_tokens, temperature = request
+    response = await async_client().chat.completions.create(
+        model=GPT_MODEL,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+    )
+    return response.choices[0].message.content or ''
+
+
+async def achat_stream(request):
+    # achat のストリーミング版。本文を届いた分ずつ返す
+    messages, max_tokens, temperature = request
+    stream = await async_client().chat.completions.create(
+        model=GPT_MODEL,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def chat_stream(request):
+    # achat_stream の同期版（WSGIのストリーミング用）
+    messages, max_tokens, temperature = request
+    stream = client().chat.completions.create(
+        model=GPT_MODEL,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
@@ -0,0 +1,61 @@
+# generator/json_stream.py
+
+import json
+
+
+class JsonArrayObjects:
+    """少しずつ届くJSON配列のテキストから、閉じたオブジェクトを順に取り出す
+
+    GPTのストリーミング応答（[{...}, {...}, ...]）を全部待たずに1候補ずつ扱うためのもの。
+    配列の前後の説明文やコードブロックの ``` は読み飛ばす。壊れたオブジェクトは捨てる。
+    """
+
+    def __init__(self):
+        self._buf = ''
+        self._pos = 0        # 次に読む位置
+        self._start = None   # 読んでいるオブジェクトの先頭位置
+        self._depth = 0      # 配列の中なら1、オブジェクトの中なら2以上
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text):
+        self._buf += text
+        found = []
+        buf = self._buf
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                if ch == '[':
+                    self._depth = 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                if self._depth == 1 and ch == '{':
+                    self._start = i
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 1 and ch == '}' and self._start is not None:
+                    try:
+                        obj = json.loads(buf[self._start:i + 1])
+                    except ValueError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        found.append(obj)
+                    self._start = None
+            i += 1
+        # 読み終わった部分は捨てて、バッファが応答全体の大きさにならないようにする
+        keep = self._start if self._start is not None else i
+        self._buf = buf[keep:]
+        self._pos = i - keep
+        if self._start is not None:
+            self._start = 0
+        return found
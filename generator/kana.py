@@ -0,0 +1,232 @@
+# generator/kana.py
+
+import re
+import unicodedata
+from django.conf import settings
+
+# これ以上の確からしさならGPTに聞かずにローカルの読みを使う
+KANA_ENGINE_MIN_CONFIDENCE = getattr(settings, 'KANA_ENGINE_MIN_CONFIDENCE', 0.8)
+
+# よくある名前の読み（言語別。'*' はどの言語でも使う）。表記ゆれはGPTの出力に合わせている
+NAME_READINGS = {
+    '*': {
+        'james': 'じぇーむず', 'john': 'じょん', 'robert': 'ろばーと', 'michael': 'まいける',
+        'william': 'うぃりあむ', 'david': 'でいびっど', 'richard': 'りちゃーど', 'joseph': 'じょせふ',
+        'thomas': 'とーます', 'charles': 'ちゃーるず', 'christopher': 'くりすとふぁー', 'daniel': 'だにえる',
+        'matthew': 'ましゅー', 'anthony': 'あんそにー', 'mark': 'まーく', 'paul': 'ぽーる',
+        'steven': 'すてぃーぶん', 'andrew': 'あんどりゅー', 'kevin': 'けびん', 'brian': 'ぶらいあん',
+        'george': 'じょーじ', 'edward': 'えどわーど', 'ryan': 'らいあん', 'jacob': 'じぇいこぶ',
+        'justin': 'じゃすてぃん', 'emily': 'えみりー', 'mary': 'めありー', 'patricia': 'ぱとりしあ',
+        'jennifer': 'じぇにふぁー', 'linda': 'りんだ', 'elizabeth': 'えりざべす', 'barbara': 'ばーばら',
+        'susan': 'すーざん', 'jessica': 'じぇしか', 'sarah': 'さら', 'karen': 'かれん',
+        'nancy': 'なんしー', 'lisa': 'りさ', 'emma': 'えま', 'olivia': 'おりびあ',
+        'sophia': 'そふぃあ', 'anna': 'あんな', 'alice': 'ありす', 'lucy': 'るーしー',
+        'grace': 'ぐれいす', 'hannah': 'はんな', 'chloe': 'くろえ', 'kate': 'けいと',
+    },
+    'fr': {
+        'jean': 'じゃん', 'pierre': 'ぴえーる', 'marie': 'まりー', 'louis': 'るい',
+        'camille': 'かみーゆ', 'julien': 'じゅりあん', 'nicolas': 'にこら', 'thomas': 'とま',
+    },
+    'de': {
+        'michael': 'みひゃえる', 'thomas': 'とーます', 'julia': 'ゆーりあ', 'lukas': 'るーかす',
+    },
+    'es': {
+        'jose': 'ほせ', 'juan': 'ふあん', 'jesus': 'へすす',
+    },
+}
+
+# 各言語の綴り → ローマ字（ヘボン式寄り）の書き換え。上から順に適用する
+# 大文字は書き換え済みの印（後の規則に触られないように）で、最後に小文字に戻す
+# アクセント記号は規則の後で外すので、先読みにはアクセント付きの母音も入れる（Lucía, García）
+SPELLING_RULES = {
+    'es': [
+        ('ñ', 'NY'), ('ch', 'CH'), ('ll', 'J'), ('qu(?=[eiéí])', 'K'), ('gu(?=[eiéí])', 'G'), ('gü', 'GW'),
+        ('c(?=[eiéí])', 'S'), ('g(?=[eiéí])', 'H'), ('j', 'H'), ('h', ''), ('z', 'S'), ('c', 'K'),
+        ('v', 'B'), ('x', 'KS'), ('y(?![aeiou])', 'I'),
+    ],
+    'it': [
+        ('gli', 'RI'), ('gn', 'NY'), ('ch(?=[eièéì])', 'K'), ('gh(?=[eièéì])', 'G'), ('sc(?=[eièéì])', 'SH'),
+        ('ci(?=[aouàòù])', 'CH'), ('gi(?=[aouàòù])', 'J'), ('c(?=[eièéì])', 'CH'), ('g(?=[eièéì])', 'J'),
+        ('c', 'K'), ('q', 'K'), ('h', ''), ('zz', 'TTS'), ('z', 'TS'), ('x', 'KS'), ('j', 'Y'),
+    ],
+    'de': [
+        ('^sp', 'SHP'), ('^st', 'SHT'), ('^ch(?=[rl])', 'K'), ('^ch', 'SH'), ('tsch', 'CH'), ('sch', 'SH'), ('chs', 'KS'), ('ch$', 'HI'), ('ch', 'H'), ('ck', 'K'),
+        ('ei', 'AI'), ('ie', 'I:'), ('eu|äu', 'OI'), ('ä', 'E'), ('ö', 'E'), ('ü', 'YU'), ('ß', 'S'),
+        ('ph', 'F'), ('th', 'T'), ('qu', 'KV'), ('v', 'F'), ('w', 'V'), ('z', 'TS'), ('j', 'Y'),
+        ('er$', 'A:'), ('h(?![aeiouAEIOU])', ''), ('c', 'K'), ('x', 'KS'), ('y', 'YU'),
+    ],
+    'nl': [
+        ('sch', 'SK'), ('ch', 'H'), ('ij', 'EI'), ('ui', 'AU'), ('oe', 'U'), ('ou', 'AU'), ('ie', 'I:'),
+        ('aa', 'A:'), ('ee', 'E:'), ('oo', 'O:'), ('uu', 'YU:'), ('eu', 'E:'), ('g', 'H'), ('j', 'Y'),
+        ('w', 'V'), ('v', 'F'), ('c(?=[eiy])', 'S'), ('c', 'K'), ('x', 'KS'),
+    ],
+    'sv': [
+        ('skj|stj|sj', 'SH'), ('tj|kj', 'SH'), ('sk(?=[eiyäö])', 'SH'), ('k(?=[eiyäö])', 'SH'),
+        ('g(?=[eiyäö])', 'Y'), ('ck', 'K'), ('jö', 'YO'), ('j', 'Y'), ('å', 'O'), ('ä', 'E'), ('ö', 'E'), ('y', 'YU'),
+        ('w', 'V'), ('c(?=[eiy])', 'S'), ('c', 'K'), ('x', 'KS'),
+    ],
+    'fr': [
+        ('eaux?$', 'O'), ('eau', 'O'), ('au', 'O'), ('oi', 'WA'), ('ou', 'U'), ('ill(?=e)', 'Y'), ('ch', 'SH'),
+        ('qu', 'K'), ('gn', 'NY'), ('ph', 'F'), ('th', 'T'), ('ç', 'S'), ('c(?=[eiy])', 'S'),
+        ('g(?=[eiy])', 'J'), ('h', ''), ('[ae]i', 'E'), ('[éèê]', 'E'), ('e$', ''), ('[sdtxz]$', ''),
+        ('(?<![aeiouAEIOU])u', 'YU'), ('c', 'K'), ('x', 'KS'), ('w', 'V'), ('y', 'I'),
+    ],
+    'en': [
+        ('ph', 'F'), ('th', 'S'), ('ck', 'K'), ('qu', 'KW'), ('wh', 'W'), ('ee|ea', 'I:'), ('oo', 'U:'),
+        ('ay|ai', 'EI'), ('igh', 'AI'), ('ow$', 'O:'), ('y$', 'I:'), ('e$', ''), ('c(?=[eiy])', 'S'),
+        ('g(?=[eiy])', 'J'), ('x', 'KS'), ('y(?![aeiou])', 'I'),
+    ],
+}
+
+# 綴りの規則だけでどれくらい正しく読めるか。英語・フランス語は綴りと発音がずれるので低め
+# （よくある名前は NAME_READINGS で拾い、それ以外はGPTに回る）
+# ドイツ語・スペイン語は名前の一覧で規則を確かめるまでGPTを優先する（KANA_ENGINE_MIN_CONFIDENCE 未満）
+SPELLING_CONFIDENCE = {
+    'es': 0.75, 'it': 0.9, 'de': 0.75, 'nl': 0.8, 'sv': 0.8, 'fr': 0.6, 'en': 0.5, 'ja': 0.7,
+}
+
+# ロシア語（キリル文字）はほぼ1文字ずつ対応する
+CYRILLIC = {
+    'а': 'a', 'б': 'b', 'в': 'b', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'j', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'r', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '', 'ы': 'i', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+CYRILLIC_CONFIDENCE = 0.9
+
+VOWELS = 'aiueo'
+VOWEL_KANA = dict(zip(VOWELS, 'あいうえお'))
+
+# ローマ字の音節（子音 + 母音）→ ひらがな
+SYLLABLES = {}
+for _consonant, _kana in {
+    'k': 'かきくけこ', 'g': 'がぎぐげご', 's': 'さしすせそ', 'z': 'ざじずぜぞ', 't': ['た', 'てぃ', 'とぅ', 'て', 'と'],
+    'd': ['だ', 'でぃ', 'どぅ', 'で', 'ど'], 'n': 'なにぬねの', 'h': 'はひふへほ', 'b': 'ばびぶべぼ', 'v': 'ばびぶべぼ',
+    'p': 'ぱぴぷぺぽ', 'm': 'まみむめも', 'r': 'らりるれろ', 'y': ['や', 'い', 'ゆ', 'いぇ', 'よ'],
+    'w': ['わ', 'うぃ', 'う', 'うぇ', 'うぉ'], 'f': ['ふぁ', 'ふぃ', 'ふ', 'ふぇ', 'ふぉ'],
+    'sh': ['しゃ', 'し', 'しゅ', 'しぇ', 'しょ'], 'ch': ['ちゃ', 'ち', 'ちゅ', 'ちぇ', 'ちょ'],
+    'j': ['じゃ', 'じ', 'じゅ', 'じぇ', 'じょ'], 'ts': ['つぁ', 'つぃ', 'つ', 'つぇ', 'つぉ'],
+    'kw': ['くぁ', 'くぃ', 'く', 'くぇ', 'くぉ'], 'gw': ['ぐぁ', 'ぐぃ', 'ぐ', 'ぐぇ', 'ぐぉ'],
+}.items():
+    SYLLABLES.update((_consonant + vowel, kana) for vowel, kana in zip(VOWELS, _kana))
+for _consonant, _kana in {'k': 'き', 'g': 'ぎ', 'n': 'に', 'h': 'ひ', 'b': 'び', 'p': 'ぴ', 'm': 'み', 'r': 'り'}.items():
+    SYLLABLES.update({
+        _consonant + 'ya': _kana + 'ゃ', _consonant + 'yu': _kana + 'ゅ', _consonant + 'yo': _kana + 'ょ',
+        _consonant + 'ye': _kana + 'ぇ',
+    })
+
+# 母音が続かない子音の読み（語末の t は「と」、sh は「しゅ」など外来語の慣習に合わせる）
+LONE_CONSONANTS = {
+    'ch': 'ち', 'sh': 'しゅ', 'ts': 'つ', 'k': 'く', 'g': 'ぐ', 's': 'す', 'z': 'ず', 't': 'と', 'd': 'ど',
+    'h': '', 'b': 'ぶ', 'v': 'ぶ', 'p': 'ぷ', 'm': 'む', 'r': 'る', 'y': 'い', 'w': 'う', 'f': 'ふ', 'j': 'じ',
+}
+# 重なると促音（っ）になる子音。r / m などは1つにまとめる
+GEMINATE = set('kgsztdpbfcj')
+
+SYLLABLE_KEYS = sorted(SYLLABLES, key=len, reverse=True)
+LONE_KEYS = sorted(LONE_CONSONANTS, key=len, reverse=True)
+
+
+def to_hiragana(text):
+    # カタカナ → ひらがな（長音「ー」はそのまま）
+    return ''.join(chr(ord(c) - 0x60) if 'ァ' <= c <= 'ヶ' else c for c in text)
+
+
+def strip_accents(text):
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+def romaji_to_hiragana(romaji):
+    """ヘボン式寄りのローマ字をひらがなにする。読めない文字があれば None"""
+    romaji = re.sub(r'c(?!h)', 'k', romaji).replace('q', 'k').replace('x', 'ks')
+    spelled = romaji  # 重なりの判定は l → r の前の綴りで（Carlos の rl を1つにしない）
+    romaji = romaji.replace('l', 'r')
+    out = []
+    i = 0
+    while i < len(romaji):
+        c = romaji[i]
+        rest = romaji[i:]
+        if c == ':':
+            out.append('ー')
+            i += 1
+        elif c in VOWEL_KANA:
+            out.append(VOWEL_KANA[c])
+            i += 1
+        elif c == 'n' and (len(rest) == 1 or rest[1] not in VOWELS + 'y'):
+            out.append('ん')
+            i += 1
+        elif c == 'm' and rest[1:2] in ('b', 'p'):
+            out.append('ん')
+            i += 1
+        elif rest[:3] == 'tch':
+            out.append('っ')
+            i += 1
+        elif len(rest) > 1 and spelled[i + 1] == spelled[i]:
+            if c in GEMINATE:
+                out.append('っ')
+            i += 1
+        else:
+            key = next((k for k in SYLLABLE_KEYS if rest.startswith(k)), None)
+            table = SYLLABLES
+            if key is None:
+                key = next((k for k in LONE_KEYS if rest.startswith(k)), None)
+                table = LONE_CONSONANTS
+            if key is None:
+                return None
+            out.append(table[key])
+            i += len(key)
+    return ''.join(out)
+
+
+def spell_to_romaji(word, lang):
+    # 日本語のときはローマ字で入力されたものとしてそのまま読む
+    rules = SPELLING_RULES.get(lang, [] if lang == 'ja' else SPELLING_RULES['en'])
+    for pattern, repl in rules:
+        word = re.sub(pattern, repl, word)
+    return strip_accents(word).lower()
+
+
+def word_reading(word, lang):
+    # 1語の読みを (読み, 確からしさ) で返す
+    seeded = NAME_READINGS.get(lang, {}).get(word) or NAME_READINGS['*'].get(word)
+    if seeded:
+        return seeded, 1.0
+    if all('぀' <= c <= 'ヿ' for c in word):
+        return to_hiragana(word), 1.0
+    if all(c in CYRILLIC for c in word):
+        word = re.sub(r'ий$|ый$', 'i:', word)
+        word = re.sub(r'^е', 'ye', word)
+        word = re.sub(r'(?<=[аеёиоуыэюя])й', 'i', word)
+        reading = romaji_to_hiragana(''.join(CYRILLIC.get(c, c) for c in word))
+        return (reading, CYRILLIC_CONFIDENCE) if reading else (None, 0.0)
+    romaji = spell_to_romaji(word, lang)
+    if not re.fullmatch(r'[a-z:]+', romaji):
+        return None, 0.0
+    reading = romaji_to_hiragana(romaji)
+    return (reading, SPELLING_CONFIDENCE.get(lang, SPELLING_CONFIDENCE['en'])) if reading else (None, 0.0)
+
+
+def local_reading(name, lang):
+    """名前のひらがなの読みを (読み, 確からしさ 0〜1) で返す。読めなければ (None, 0)
+
+    語ごとに、登録済みのよくある名前 → かな入力 → キリル文字 → 各言語の綴りの規則 の順に試し、
+    いちばん低い語の確からしさを名前全体の確からしさにする。
+    韓国語・タイ語・中国語（漢字）の名前は扱わない。
+    """
+    key = name.strip().lower()
+    seeded = NAME_READINGS.get(lang, {}).get(key) or NAME_READINGS['*'].get(key)
+    if seeded:
+        return seeded, 1.0
+    words = [w for w in re.split(r"[\s\-'・]+", key) if w]
+    if not words:
+        return None, 0.0
+    readings = [word_reading(word, lang) for word in words]
+    if any(reading is None for reading, confidence in readings):
+        return None, 0.0
+    return ''.join(reading for reading, confidence in readings), min(confidence for reading, confidence in readings)
+
+
+def confident_reading(name, lang):
+    # 十分に確かなときだけ読みを返す（それ以外は None でGPTに任せる）
+    reading, confidence = local_reading(name, lang)
+    return reading if confidence >= KANA_ENGINE_MIN_CONFIDENCE else None
@@ -0,0 +1,129 @@
+# generator/kanji_dictionary.py
+
+import json
+import xml.etree.ElementTree as ET
+from django.conf import settings
+from django.db import transaction
+from .meaning_cache import meaning_table
+from .models import KanjiMeaning
+
+# KANJIDIC の grade: 1-6 教育漢字, 8 その他の常用漢字, 9-10 人名用漢字
+JOYO_JINMEIYO_GRADES = set(range(1, 11))
+# 1文字に付ける意味の数（多すぎると候補カードに収まらない）
+MEANINGS_PER_KANJI = 3
+IMPORT_BATCH_SIZE = 500
+
+
+def meaning_text(meanings):
+    if isinstance(meanings, str):
+        meanings = [meanings]
+    meanings = [m.strip() for m in meanings if m and m.strip()]
+    return ', '.join(meanings[:MEANINGS_PER_KANJI])[:255]
+
+
+def read_kanjidic(path, langs):
+    """KANJIDIC2 形式の XML から (文字, grade, {言語コード: 意味}) を順に返す
+
+    ファイルが大きいので iterparse で1文字ずつ読み、読んだ要素は捨てる。
+    meaning の m_lang がないものは英語。grade のない文字（常用・人名用以外）は grade 0。
+    """
+    for event, elem in ET.iterparse(path):
+        if elem.tag != 'character':
+            continue
+        literal = elem.findtext('literal')
+        grade = elem.findtext('misc/grade')
+        found = {}
+        for meaning in elem.iterfind('reading_meaning/rmgroup/meaning'):
+            lang = meaning.get('m_lang', 'en')
+            if lang in langs and meaning.text:
+                found.setdefault(lang, []).append(meaning.text)
+        elem.clear()
+        if literal:
+            yield literal, int(grade) if grade and grade.isdigit() else 0, {
+                lang: meaning_text(meanings) for lang, meanings in found.items()
+            }
+
+
+def read_json(path, langs):
+    """JSON から (文字, grade, {言語コード: 意味}) を順に返す
+
+    {"樹": {"en": "tree", "ja": "木"}} のような文字→言語別の意味の辞書か、
+    [{"literal": "樹", "grade": 6, "meanings": {"en": ["tree", "wood"]}}] のような配列。
+    grade を書かなかった文字は選別済みとみなして grade では絞り込まない。
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [{'literal': char, 'meanings': meanings} for char, meanings in data.items()]
+    for entry in data:
+        meanings = entry.get('meanings') or {}
+        yield entry.get('literal'), entry.get('grade'), {
+            lang: meaning_text(value) for lang, value in meanings.items() if lang in langs
+        }
+
+
+DICTIONARY_READERS = {
+    'xml': read_kanjidic,
+    'json': read_json,
+}
+
+
+def import_batch(entries, overwrite=False):
+    """[(文字, {言語コード: 意味})] をまとめて保存し (作成数, 更新数) を返す
+
+    すでに入っている意味は、overwrite でなければそのまま（GPTで取得したものや管理画面での修正を残す）。
+    """
+    meanings = dict(entries)
+    existing = {m.char: m for m in KanjiMeaning.objects.filter(char__in=list(meanings))}
+    new_rows, updated, fields = [], [], set()
+    for char, values in meanings.items():
+        m = existing.get(char)
+        if m is None:
+            m = KanjiMeaning(char=char)
+            new_rows.append(m)
+        changed = False
+        for lang, value in values.items():
+            field = f"meaning_{lang.replace('-', '_')}"
+            if value and (overwrite or not getattr(m, field, '')):
+                setattr(m, field, value)
+                fields.add(field)
+                changed = True
+        if changed and char in existing:
+            updated.append(m)
+    with transaction.atomic():
+        KanjiMeaning.objects.bulk_create(new_rows, ignore_conflicts=True)
+        if updated:
+            KanjiMeaning.objects.bulk_update(updated, sorted(fields))
+    return len(new_rows), len(updated)
+
+
+def import_dictionary(path, file_format=None, grades=JOYO_JINMEIYO_GRADES, overwrite=False, batch_size=IMPORT_BATCH_SIZE):
+    """辞書ファイルの意味を KanjiMeaning（有効な全言語の meaning_* 列）に一括で取り込む
+
+    grades が None なら grade に関係なく全部。戻り値は (作成数, 更新数, 読み飛ばした数)。
+    """
+    file_format = file_format or path.rsplit('.', 1)[-1].lower()
+    langs = {code for code, label in settings.LANGUAGES}
+    created = updated = skipped = 0
+    batch = []
+
+    def flush():
+        nonlocal created, updated
+        c, u = import_batch(batch, overwrite)
+        created += c
+        updated += u
+        batch.clear()
+
+    for char, grade, meanings in DICTIONARY_READERS[file_format](path, langs):
+        meanings = {lang: value for lang, value in meanings.items() if value}
+        out_of_grades = grades is not None and grade is not None and grade not in grades
+        if not char or not meanings or len(char) > 10 or out_of_grades:
+            skipped += 1
+            continue
+        batch.append((char, meanings))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    meaning_table.invalidate()  # bulk_* はシグナルを送らないので自分で知らせる
+    return created, updated, skipped
@@ -0,0 +1,61 @@
+# generator/management/commands/build_glyph_metrics.py
+
+import json
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from generator.fonts import (
+    FONT_CHOICES, FONT_PATHS, build_glyph_table, default_glyph_charset, resolve_font_path, save_glyph_table,
+)
+from generator.models import KanjiAteji, KanjiMeaning
+
+
+class Command(BaseCommand):
+    help = "フォントごとのグリフ寸法テーブルを作り直す（フォントを追加・差し替えたときに実行）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--font', action='append', default=[],
+                            help="対象フォントコード（省略時は FONT_CHOICES / FONT_PATHS の全フォント）")
+        parser.add_argument('--chars-file', action='append', default=[],
+                            help="追加する文字の一覧ファイル（常用・人名用漢字リストなど、UTF-8）")
+
+    def handle(self, *args, **options):
+        chars = default_glyph_charset() + ''.join(self.database_chars())
+        for path in options['chars_file']:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    chars += ''.join(f.read().split())
+            except OSError as e:
+                raise CommandError(f"Cannot read {path}: {e}")
+
+        for font_path in self.font_paths(options['font']):
+            if not os.path.exists(font_path):
+                self.stderr.write(self.style.WARNING(f"skip (not found): {font_path}"))
+                continue
+            table = build_glyph_table(font_path, chars)
+            out = save_glyph_table(font_path, table)
+            self.stdout.write(self.style.SUCCESS(f"{len(table)} glyphs -> {out}"))
+
+    def font_paths(self, codes):
+        # kanji_image は FONT_CHOICES、print_preview は FONT_PATHS を使うので両方
+        paths = []
+        for code, filename in FONT_CHOICES.items():
+            if not codes or code in codes:
+                paths.append(os.path.join(settings.BASE_DIR, 'static', 'fonts', filename))
+        for code, path in FONT_PATHS.items():
+            if not codes or code in codes:
+                paths.append(path)
+        return list(dict.fromkeys(resolve_font_path(p) for p in paths))
+
+    def database_chars(self):
+        # 実際に使われている漢字（意味辞書・当て字候補）
+        for char in KanjiMeaning.objects.values_list('char', flat=True):
+            yield char
+        for candidates_json in KanjiAteji.objects.values_list('kanji_candidates_json', flat=True):
+            try:
+                candidates = json.loads(candidates_json)
+            except ValueError:
+                continue
+            for c in candidates:
+                if isinstance(c, dict):
+                    yield c.get('kanji', '')
@@ -0,0 +1,69 @@
+# generator/management/commands/kanji_image_cache.py
+
+import json
+from django.core.management.base import BaseCommand
+from generator.fonts import FONT_CHOICES
+from generator.models import KanjiAteji
+from generator.render_cache import kanji_image_cache
+from generator.rendering import normalize_preview_params, supported_image_formats
+
+
+class Command(BaseCommand):
+    help = "/kanji_image/ の描画キャッシュを操作する（warm: 登録済み当て字を事前描画 / purge: 全削除 / stats: 使用状況）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['warm', 'purge', 'stats', 'evict'])
+        parser.add_argument('--mode', action='append', choices=['yoko', 'tate'], default=[],
+                            help="warm 対象の表示モード（省略時は両方）")
+        parser.add_argument('--font', action='append', choices=list(FONT_CHOICES), default=[],
+                            help="warm 対象のフォント（省略時は全フォント）")
+        parser.add_argument('--body-color', action='append', default=[],
+                            help="warm 対象のボディカラー（省略時は white）")
+        parser.add_argument('--text-color', action='append', default=[],
+                            help="warm 対象のプリントカラー（省略時は black）")
+        parser.add_argument('--format', action='append', choices=supported_image_formats(), default=[],
+                            help="warm 対象の画像形式（省略時は対応している全形式）")
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'purge':
+            removed = kanji_image_cache.purge()
+            self.stdout.write(self.style.SUCCESS(f"removed {removed} files"))
+        elif action == 'evict':
+            removed = kanji_image_cache.evict()
+            self.stdout.write(self.style.SUCCESS(f"removed {removed} files"))
+        elif action == 'warm':
+            self.warm(
+                options['mode'] or ['yoko', 'tate'], options['font'] or list(FONT_CHOICES),
+                options['body_color'] or ['white'], options['text_color'] or ['black'],
+                options['format'] or supported_image_formats(),
+            )
+        for key, value in kanji_image_cache.stats().items():
+            self.stdout.write(f"{key}: {value}")
+
+    def warm(self, modes, fonts, body_colors, text_colors, image_formats):
+        kanji_list = []
+        for candidates_json in KanjiAteji.objects.values_list('kanji_candidates_json', flat=True):
+            try:
+                candidates = json.loads(candidates_json)
+            except ValueError:
+                continue
+            kanji_list.extend(c.get('kanji', '') for c in candidates if isinstance(c, dict))
+        kanji_list = [k for k in dict.fromkeys(kanji_list) if k]
+
+        combos = [
+            normalize_preview_params(mode, font, body_color, text_color) + (image_format,)
+            for mode in modes for font in fonts for body_color in body_colors for text_color in text_colors
+            for image_format in image_formats
+        ]
+        rendered = failed = 0
+        for kanji in kanji_list:
+            for params in combos:
+                try:
+                    # ビューと同じ正規化済みの引数で描画しないとキャッシュキーがずれる
+                    kanji_image_cache.get_or_render(kanji, *params)
+                    rendered += 1
+                except OSError as e:  # フォント未配置など
+                    failed += 1
+                    self.stderr.write(self.style.WARNING(f"{kanji} {' '.join(params)}: {e}"))
+        self.stdout.write(self.style.SUCCESS(f"warmed {rendered} images ({failed} failed)"))
@@ -0,0 +1,32 @@
+# generator/management/commands/load_kanji_dictionary.py
+
+from xml.etree.ElementTree import ParseError
+from django.core.management.base import BaseCommand, CommandError
+from generator.kanji_dictionary import DICTIONARY_READERS, IMPORT_BATCH_SIZE, JOYO_JINMEIYO_GRADES, import_dictionary
+
+
+class Command(BaseCommand):
+    help = ("漢字の意味をローカルの辞書ファイル（KANJIDIC2 の XML か JSON）から KanjiMeaning に一括で取り込む。"
+            "取り込んだ漢字はGPTに問い合わせなくなる")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="辞書ファイル（拡張子 .xml / .json で形式を決める）")
+        parser.add_argument('--format', choices=list(DICTIONARY_READERS), help="拡張子と違う形式のときに指定")
+        parser.add_argument('--all', action='store_true', help="常用・人名用漢字以外も取り込む")
+        parser.add_argument('--overwrite', action='store_true', help="すでに入っている意味も辞書の内容で上書きする")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help="1回の bulk_create / bulk_update の件数")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in DICTIONARY_READERS:
+            raise CommandError("path must end with .xml or .json (or use --format)")
+        try:
+            created, updated, skipped = import_dictionary(
+                path, file_format,
+                grades=None if options['all'] else JOYO_JINMEIYO_GRADES,
+                overwrite=options['overwrite'], batch_size=options['batch_size'],
+            )
+        except (OSError, ValueError, ParseError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"created {created}, updated {updated}, skipped {skipped}"))
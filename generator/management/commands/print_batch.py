@@ -0,0 +1,49 @@
+# generator/management/commands/print_batch.py
+
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from generator.models import Order
+from generator.print_batch import BATCH_WRITERS, BatchTooLarge, mark_printed, render_batch, unprinted_orders
+
+
+class Command(BaseCommand):
+    help = "複数の注文の印刷シートをまとめて描画し、1つの PDF（1注文1ページ）か ZIP に書き出す"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="出力ファイル（拡張子 .pdf / .zip で形式を決める）")
+        parser.add_argument('--day', help="この日（YYYY-MM-DD）の未印刷の注文をすべて対象にする")
+        parser.add_argument('--order', action='append', default=[], help="対象の注文ID（複数指定可）")
+        parser.add_argument('--mark-printed', action='store_true', help="書き出した注文を印刷済みにする")
+
+    def handle(self, *args, **options):
+        output = options['output']
+        image_format = output.rsplit('.', 1)[-1].lower()
+        if image_format not in BATCH_WRITERS:
+            raise CommandError("output must end with .pdf or .zip")
+        if options['order']:
+            try:
+                order_ids = [uuid.UUID(order_id) for order_id in options['order']]
+            except ValueError:
+                raise CommandError("--order must be an order ID (UUID)")
+            orders = list(Order.objects.filter(id__in=order_ids).order_by('created_at'))
+        elif options['day']:
+            day = parse_date(options['day'])
+            if day is None:
+                raise CommandError("--day must be YYYY-MM-DD")
+            orders = list(unprinted_orders(day))
+        else:
+            raise CommandError("--day or --order is required")
+        if not orders:
+            raise CommandError("No orders to print.")
+
+        try:
+            sheets = render_batch(orders)
+        except BatchTooLarge as e:
+            raise CommandError(str(e))
+        write, content_type = BATCH_WRITERS[image_format]
+        with open(output, 'wb') as out:
+            write(sheets, out)
+        if options['mark_printed']:
+            mark_printed([job for job, path in sheets])
+        self.stdout.write(self.style.SUCCESS(f"wrote {len(sheets)} sheets to {output}"))
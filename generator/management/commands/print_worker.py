@@ -0,0 +1,21 @@
+# generator/management/commands/print_worker.py
+
+from django.core.management.base import BaseCommand
+from generator.print_queue import run_worker
+
+
+class Command(BaseCommand):
+    help = "印刷ジョブ（PrintJob の queued）を順に描画するワーカー。Webサーバーとは別プロセスで常駐させる"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="キューが空のときのポーリング間隔（秒）")
+        parser.add_argument('--once', action='store_true',
+                            help="溜まっているジョブを処理したら終了する（cron 用）")
+
+    def handle(self, *args, **options):
+        try:
+            processed = run_worker(poll_interval=options['interval'], once=options['once'])
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(f"processed {processed} jobs"))
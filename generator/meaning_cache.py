@@ -0,0 +1,91 @@
+# generator/meaning_cache.py
+
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import KanjiMeaning
+
+# 他プロセスでの変更を確認する間隔（秒）。自プロセスでの変更はすぐ反映される
+KANJI_MEANING_CHECK_INTERVAL = getattr(settings, 'KANJI_MEANING_CHECK_INTERVAL', 1.0)
+# プロセス間で共有する版数ファイル（変更のたびに書き換わる）
+KANJI_MEANING_VERSION_FILE = getattr(
+    settings, 'KANJI_MEANING_VERSION_FILE', os.path.join(settings.BASE_DIR, 'cache', 'kanji_meaning_version'),
+)
+
+
+class MeaningTable:
+    """KanjiMeaning の全行（全言語の meaning_* 列）をプロセス内の辞書に持つ
+
+    行数が少なく読み取りがほとんどなので、一度に全部読み込んでメモリから引く。
+    変更があるとシグナルで版数を上げ、各プロセスは版数が変わっていたら読み直す。
+    """
+
+    def __init__(self, version_file, check_interval):
+        self.version_file = version_file
+        self.check_interval = check_interval
+        self._rows = None
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def read_version(self):
+        try:
+            with open(self.version_file, encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return ''
+
+    def bump_version(self):
+        # 連番＋pid＋時刻にして、複数プロセスが同時に上げても必ず前と違う値になるようにする
+        counter = self.read_version().split(' ')[0]
+        counter = int(counter) + 1 if counter.isdigit() else 1
+        os.makedirs(os.path.dirname(self.version_file), exist_ok=True)
+        tmp = f"{self.version_file}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(f"{counter} {os.getpid()} {time.time_ns()}")
+        os.replace(tmp, self.version_file)
+
+    def invalidate(self):
+        # 自プロセスはすぐ捨て、他プロセスにはコミット後に版数で知らせる
+        # （コミット前に読み直されると古い内容のまま版数だけ追いつくため）
+        self._rows = None
+        transaction.on_commit(self.bump_version)
+
+    def load(self):
+        fields = [f.name for f in KanjiMeaning._meta.fields if f.name.startswith('meaning_')]
+        return {row.pop('char'): row for row in KanjiMeaning.objects.values('char', *fields)}
+
+    def rows(self):
+        now = time.monotonic()
+        rows = self._rows
+        if rows is not None and now - self._checked < self.check_interval:
+            return rows
+        with self._lock:
+            # 読み込み中の変更を取りこぼさないよう、版数は読み込む前に取る
+            version = self.read_version()
+            if self._rows is None or version != self._version:
+                self._rows = self.load()
+                self._version = version
+            self._checked = now
+            return self._rows
+
+    def get(self, char, lang):
+        # 行がなければ None、行があって意味が空なら ''
+        row = self.rows().get(char)
+        if row is None:
+            return None
+        return row.get(f"meaning_{lang.replace('-', '_')}") or ''
+
+
+meaning_table = MeaningTable(KANJI_MEANING_VERSION_FILE, KANJI_MEANING_CHECK_INTERVAL)
+
+
+@receiver(post_save, sender=KanjiMeaning)
+@receiver(post_delete, sender=KanjiMeaning)
+def invalidate_meaning_table(sender, **kwargs):
+    # 管理画面での編集・削除もここを通る（bulk_create / bulk_update は呼び出し側で invalidate する）
+    meaning_table.invalidate()
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.3 on 2026-10-18 10:49
+
+from django.db import migrations, models
+
+
+def mark_existing_jobs_printed(apps, schema_editor):
+    # 以前のジョブはその場で描画・印刷済みなので、ワーカーに拾わせない
+    PrintJob = apps.get_model('generator', 'PrintJob')
+    PrintJob.objects.update(status='printed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generator', '0017_alter_order_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='preview_id',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('rendering', 'Rendering'), ('ready', 'Ready'), ('printed', 'Printed'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='printjob',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(mark_existing_jobs_printed, migrations.RunPython.noop),
+    ]
@@ -59,6 +59,20 @@ class TshirtSetting(models.Model):
 
 
 class PrintJob(models.Model):
+    # queued → rendering → ready → printed（描画に失敗したら failed）
+    STATUS_QUEUED = 'queued'
+    STATUS_RENDERING = 'rendering'
+    STATUS_READY = 'ready'
+    STATUS_PRINTED = 'printed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RENDERING, 'Rendering'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_PRINTED, 'Printed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
     order_no = models.CharField(max_length=64, unique=True)
     kanji = models.CharField(max_length=32)
     reading = models.CharField(max_length=64)
@@ -68,7 +82,12 @@ class PrintJob(models.Model):
     size = models.CharField(max_length=32)
     body_color = models.CharField(max_length=20)
     text_color = models.CharField(max_length=20)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    preview_id = models.CharField(max_length=64, blank=True)     # 描画済みシート（print_sheet_cache のキー）
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 class BadWord(models.Model):
@@ -76,3 +95,9 @@ class BadWord(models.Model):
     source = models.CharField(max_length=128, blank=True, default="internal")  # 取得元（手動/自動/AI等）
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+
+class LookupLock(models.Model):
+    # 同じGPT問い合わせを複数プロセスで重複させないためのロック（generator/singleflight.py）
+    key = models.CharField(max_length=64, primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,161 @@
+# generator/print_batch.py
+
+import struct
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image
+from .models import Order, PrintJob
+from .print_queue import enqueue_print_job, job_qrdata
+from .render_cache import print_sheet_cache
+from .rendering import PRINT_DPI
+
+# 1回のまとめ印刷で扱う注文数の上限
+PRINT_BATCH_MAX = getattr(settings, 'PRINT_BATCH_MAX', 200)
+# 同時に描画を依頼する数（実際の並列度は描画プロセスプールの大きさで決まる）
+PRINT_BATCH_THREADS = getattr(settings, 'PRINT_BATCH_THREADS', getattr(settings, 'RENDER_POOL_WORKERS', 2) or 1)
+
+
+class BatchTooLarge(ValueError):
+    """注文数が PRINT_BATCH_MAX を超えている（黙って一部だけ印刷しない）"""
+
+
+def unprinted_orders(day):
+    # その日の注文のうち、印刷済み（printed）になっていないもの
+    printed = PrintJob.objects.filter(status=PrintJob.STATUS_PRINTED).values_list('order_no', flat=True)
+    return Order.objects.filter(created_at__date=day).exclude(id__in=list(printed)).order_by('created_at')
+
+
+def render_batch(orders):
+    """注文ごとの印刷シートをまとめて描画し、[(PrintJob, シートのパス)] を注文順で返す
+
+    描画済みのシート（ワーカーや以前のバッチの分）はそのまま使う。
+    注文が PRINT_BATCH_MAX を超えるときは何もせずに BatchTooLarge。
+    """
+    if len(orders) > PRINT_BATCH_MAX:
+        raise BatchTooLarge(
+            f"{len(orders)} orders were selected, but a batch can hold at most {PRINT_BATCH_MAX}. "
+            "Print them in smaller batches of order IDs."
+        )
+    jobs = [enqueue_print_job(order) for order in orders]
+
+    def render(job):
+        return print_sheet_cache.ensure(job_qrdata(job), 'png')
+
+    # スレッドでは描画だけ（DB接続をスレッドごとに作らないよう、更新は呼び出し元で行う）
+    with ThreadPoolExecutor(max_workers=PRINT_BATCH_THREADS) as executor:
+        preview_ids = list(executor.map(render, jobs))
+    # ワーカーが取った（rendering の）ジョブはワーカーに任せて触らない
+    for job, preview_id in zip(jobs, preview_ids):
+        PrintJob.objects.filter(
+            pk=job.pk, status__in=[PrintJob.STATUS_QUEUED, PrintJob.STATUS_READY, PrintJob.STATUS_FAILED],
+        ).update(status=PrintJob.STATUS_READY, preview_id=preview_id, error='', updated_at=timezone.now())
+    return [(job, print_sheet_cache.path_for(preview_id)) for job, preview_id in zip(jobs, preview_ids)]
+
+
+def mark_printed(jobs):
+    return PrintJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+        status=PrintJob.STATUS_PRINTED, updated_at=timezone.now(),
+    )
+
+
+def sheet_filename(index, job):
+    return f"{index:03d}_{job.order_no}.png"
+
+
+def write_zip(sheets, out):
+    # PNGはすでに圧縮済みなので無圧縮で詰める
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as zf:
+        for index, (job, path) in enumerate(sheets, 1):
+            zf.write(path, sheet_filename(index, job))
+
+
+def _png_image_stream(path):
+    """PNGのIDATをそのまま PDF の FlateDecode ストリームとして使う（デコード・再圧縮しない）
+
+    8bit RGB / グレースケールのインターレースなしPNGだけ。それ以外は None。
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        return None
+    pos, idat, header = 8, [], None
+    while pos < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        if chunk_type == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif chunk_type == b'IDAT':
+            idat.append(chunk)
+        elif chunk_type == b'IEND':
+            break
+        pos += 12 + length
+    if header is None:
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = header
+    colors = {0: 1, 2: 3}.get(color_type)
+    if bit_depth != 8 or colors is None or interlace:
+        return None
+    params = f"/DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent 8 /Columns {width} >>"
+    return width, height, colors, params, b''.join(idat)
+
+
+def _pillow_image_stream(path):
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        return img.width, img.height, 3, '', zlib.compress(img.tobytes())
+
+
+def write_pdf(sheets, out, dpi=PRINT_DPI):
+    """シート1枚を1ページにした PDF を out（バイナリのファイルオブジェクト）に書く
+
+    PillowのPDF出力はRGBをJPEGで再圧縮し、全ページを同時にメモリに持つので使わない。
+    ここでは1ページずつファイルから読んで書き出す。
+    """
+    offsets = []
+
+    def write_obj(body, stream=None):
+        offsets.append(out.tell() - start)
+        out.write(f"{len(offsets)} 0 obj\n".encode())
+        out.write(body.encode('latin-1'))
+        if stream is not None:
+            out.write(b"\nstream\n")
+            out.write(stream)
+            out.write(b"\nendstream")
+        out.write(b"\nendobj\n")
+
+    start = out.tell()
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    page_count = len(sheets)
+    # 1: カタログ, 2: ページツリー, 以降ページごとに (ページ, 画像, 描画命令)
+    page_ids = [3 + i * 3 for i in range(page_count)]
+    write_obj("<< /Type /Catalog /Pages 2 0 R >>")
+    write_obj(f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {page_count} >>")
+    for page_id, (job, path) in zip(page_ids, sheets):
+        width, height, colors, params, stream = _png_image_stream(path) or _pillow_image_stream(path)
+        page_w, page_h = width * 72 / dpi, height * 72 / dpi
+        write_obj(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w:.2f} {page_h:.2f}] "
+            f"/Resources << /XObject << /Im0 {page_id + 1} 0 R >> >> /Contents {page_id + 2} 0 R >>"
+        )
+        color_space = '/DeviceRGB' if colors == 3 else '/DeviceGray'
+        write_obj(
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace {color_space} "
+            f"/BitsPerComponent 8 /Filter /FlateDecode {params} /Length {len(stream)} >>",
+            stream,
+        )
+        content = f"q {page_w:.2f} 0 0 {page_h:.2f} 0 0 cm /Im0 Do Q".encode()
+        write_obj(f"<< /Length {len(content)} >>", content)
+    xref = out.tell() - start
+    out.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+
+BATCH_WRITERS = {
+    'pdf': (write_pdf, 'application/pdf'),
+    'zip': (write_zip, 'application/zip'),
+}
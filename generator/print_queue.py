@@ -0,0 +1,124 @@
+# generator/print_queue.py
+
+import logging
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import PrintJob
+from .render_cache import print_sheet_cache
+
+logger = logging.getLogger(__name__)
+
+# rendering のまま更新されないジョブ（ワーカーが落ちた等）を何秒で queued に戻すか
+PRINT_JOB_STALE_AFTER = getattr(settings, 'PRINT_JOB_STALE_AFTER', 120)
+# 失敗したジョブを自動でやり直す回数
+PRINT_JOB_MAX_ATTEMPTS = getattr(settings, 'PRINT_JOB_MAX_ATTEMPTS', 3)
+
+# PrintJob に写す注文内容（PrintJob / Order 共通のフィールド）
+PRINT_FIELDS = ('kanji', 'reading', 'meaning', 'mode', 'font', 'size', 'body_color', 'text_color')
+# そのうちシートに描かれるもの。reading / meaning は表示言語で変わるが描かないので、
+# 注文時と印刷時で言語が違っても描き直さない
+SHEET_FIELDS = ('kanji', 'mode', 'font', 'size', 'body_color', 'text_color')
+
+
+def job_qrdata(job):
+    # render_print_sheet に渡す内容（これがシートのキャッシュキーになる）
+    qrdata = {"order_no": job.order_no}
+    qrdata.update((field, getattr(job, field)) for field in SHEET_FIELDS)
+    return qrdata
+
+
+def sheet_exists(job):
+    return bool(job.preview_id) and os.path.exists(print_sheet_cache.path_for(job.preview_id))
+
+
+def enqueue_print_job(order):
+    """注文の印刷シートを描画待ちにする（描画はワーカーが行う）
+
+    内容が変わっておらず描画済みのシートが残っていれば、そのまま使う。
+    """
+    values = {field: getattr(order, field) for field in PRINT_FIELDS}
+    job, created = PrintJob.objects.get_or_create(order_no=str(order.id), defaults=values)
+    if created:
+        return job
+    changed = any(getattr(job, field) != values[field] for field in SHEET_FIELDS)
+    if not changed and job.status in (PrintJob.STATUS_QUEUED, PrintJob.STATUS_RENDERING):
+        return job
+    if not changed and job.status in (PrintJob.STATUS_READY, PrintJob.STATUS_PRINTED) and sheet_exists(job):
+        return job
+    for field, value in values.items():
+        setattr(job, field, value)
+    job.status = PrintJob.STATUS_QUEUED
+    job.preview_id = ''
+    job.error = ''
+    job.attempts = 0
+    job.save()
+    return job
+
+
+def requeue_stale_jobs():
+    limit = timezone.now() - timedelta(seconds=PRINT_JOB_STALE_AFTER)
+    stale = PrintJob.objects.filter(status=PrintJob.STATUS_RENDERING, updated_at__lt=limit)
+    requeued = stale.filter(attempts__lt=PRINT_JOB_MAX_ATTEMPTS).update(
+        status=PrintJob.STATUS_QUEUED, updated_at=timezone.now(),
+    )
+    # 回数を使い切ったもの（描画のたびにワーカーごと落ちるシート）は何度も取らない
+    stale.update(status=PrintJob.STATUS_FAILED, error='worker died', updated_at=timezone.now())
+    return requeued
+
+
+def claim_next_job():
+    # 複数ワーカーでも1件を1人だけが取るよう、status を条件に UPDATE できた方が担当する
+    while True:
+        job = PrintJob.objects.filter(status=PrintJob.STATUS_QUEUED).order_by('updated_at', 'pk').first()
+        if job is None:
+            return None
+        claimed = PrintJob.objects.filter(pk=job.pk, status=PrintJob.STATUS_QUEUED).update(
+            status=PrintJob.STATUS_RENDERING, attempts=F('attempts') + 1, updated_at=timezone.now(),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def render_job(job):
+    try:
+        preview_id = print_sheet_cache.ensure(job_qrdata(job), 'png')
+    except Exception as e:
+        logger.exception("print job %s failed", job.order_no)
+        retry = job.attempts < PRINT_JOB_MAX_ATTEMPTS
+        PrintJob.objects.filter(pk=job.pk, status=PrintJob.STATUS_RENDERING).update(
+            status=PrintJob.STATUS_QUEUED if retry else PrintJob.STATUS_FAILED,
+            error=str(e), updated_at=timezone.now(),
+        )
+        return False
+    # 描画中に内容が変わって queued に戻されていたら上書きしない
+    PrintJob.objects.filter(pk=job.pk, status=PrintJob.STATUS_RENDERING).update(
+        status=PrintJob.STATUS_READY, preview_id=preview_id, error='', updated_at=timezone.now(),
+    )
+    return True
+
+
+def process_next_job():
+    job = claim_next_job()
+    if job is None:
+        return None
+    render_job(job)
+    return job
+
+
+def run_worker(poll_interval=1.0, once=False):
+    # 外部のブローカーは使わず、PrintJob テーブルをキューとしてポーリングする
+    processed = 0
+    while True:
+        requeue_stale_jobs()
+        job = process_next_job()
+        if job is not None:
+            processed += 1
+            continue
+        if once:
+            return processed
+        time.sleep(poll_interval)
@@ -0,0 +1,153 @@
+# generator/render_cache.py
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from functools import partial
+from django.conf import settings
+from .rendering import RENDERER_VERSION, render_kanji_bytes, render_kanji_sprite_bytes, render_print_bytes
+from .render_service import render_service
+
+
+class RenderCache:
+    """描画結果の画像を入力のハッシュをファイル名にしてローカルディスクに保存する
+
+    総容量が max_bytes を超えたら最終アクセスの古いものから削除する。
+    """
+
+    # 書き込みのたびにディレクトリを走査しないよう、容量チェックはこの回数ごと
+    EVICT_CHECK_INTERVAL = 50
+
+    def __init__(self, directory, max_bytes, render, version=RENDERER_VERSION):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.render = render
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def key(self, *params):
+        raw = json.dumps([self.version, *params], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        # 形式（PNG/WebP/AVIF）はキーに含まれるので拡張子は付けない
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # LRU用に最終アクセスを更新
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 同時に同じキーを書いても壊れないよう一時ファイルから置き換え
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._writes += 1
+            check = self._writes % self.EVICT_CHECK_INTERVAL == 0
+        if check:
+            self.evict()
+
+    def get_or_render(self, *params):
+        key = self.key(*params)
+        data = self.get(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if data is None:
+            data = self.render(*params)
+            self.put(key, data)
+        return data
+
+    def ensure(self, *params):
+        # 描画済みか確かめるだけでファイルは読まない（大きな画像をファイルのまま返す用）
+        key = self.key(*params)
+        if os.path.exists(self.path_for(key)):
+            with self._lock:
+                self.hits += 1
+            return key
+        with self._lock:
+            self.misses += 1
+        self.put(key, self.render(*params))
+        return key
+
+    def _entries(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):  # 書き込み途中
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def evict(self, max_bytes=None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    def purge(self):
+        return self.evict(max_bytes=0)
+
+    def stats(self):
+        entries = list(self._entries())
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'directory': self.directory,
+        }
+
+
+kanji_image_cache = RenderCache(
+    getattr(settings, 'KANJI_IMAGE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'kanji_image')),
+    getattr(settings, 'KANJI_IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+    partial(render_service.run, render_kanji_bytes),  # キャッシュミス時だけプロセスプールで描画
+)
+
+kanji_sprite_cache = RenderCache(
+    getattr(settings, 'KANJI_SPRITE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'kanji_sprite')),
+    getattr(settings, 'KANJI_IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+    partial(render_service.run, render_kanji_sprite_bytes),
+)
+
+# 印刷用A4シート。ビューは id（キャッシュキー）だけ返し、画像はファイルのまま配信する
+print_sheet_cache = RenderCache(
+    getattr(settings, 'PRINT_SHEET_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'print_sheet')),
+    getattr(settings, 'PRINT_SHEET_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+    partial(render_service.run, render_print_bytes),
+)
@@ -0,0 +1,101 @@
+# generator/render_service.py
+
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+
+
+class RenderUnavailable(Exception):
+    """描画を受け付けられない（混雑・タイムアウト）。ビューでは503として返す"""
+
+
+class RenderBusy(RenderUnavailable):
+    pass
+
+
+class RenderTimeout(RenderUnavailable):
+    pass
+
+
+def _init_worker():
+    # spawn 起動のワーカーでも settings / アプリを読めるように
+    import django
+    django.setup()
+
+
+class RenderService:
+    """Pillowの描画をWSGIワーカーの外（プロセスプール）で実行する
+
+    - 同時に受け付ける描画数は max_pending まで。超えたら queue_timeout 秒だけ待ち、空かなければ RenderBusy
+    - 1件の描画が timeout 秒を超えたら RenderTimeout（ワーカー側の処理はそのまま最後まで走る）
+      受付の枠は描画が本当に終わるまで返さず、以降の描画は新しいプールで受ける
+    - workers=0 ならプールを使わずその場で描画する（開発・テスト用）
+    """
+
+    def __init__(self, workers, max_pending, timeout, queue_timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            return self._executor
+
+    def _reset_executor(self, old, cancel_futures=True):
+        with self._lock:
+            if self._executor is old:
+                self._executor = None
+        old.shutdown(wait=False, cancel_futures=cancel_futures)
+
+    def _release_slot(self, future):
+        self._slots.release()
+
+    def run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise RenderBusy("The renderer is busy. Please try again.")
+        try:
+            executor = self._get_executor()
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._reset_executor(executor)
+            raise RenderUnavailable("The renderer restarted. Please try again.")
+        except BaseException:
+            self._slots.release()
+            raise
+        # 枠はワーカーでの処理が終わった（またはキャンセルされた）ときに返す
+        future.add_done_callback(self._release_slot)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            if not future.cancel():
+                # 走り出した描画は止められない。居座るワーカーを避けて以降は新しいプールで受ける
+                # （古いプールに並んでいる分はそのまま古いプールで描画する）
+                self._reset_executor(executor, cancel_futures=False)
+            raise RenderTimeout("Rendering timed out. Please try again.")
+        except (BrokenProcessPool, CancelledError):
+            # ワーカーが落ちた（OOM等）ら次回のために作り直す
+            self._reset_executor(executor)
+            raise RenderUnavailable("The renderer restarted. Please try again.")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+render_service = RenderService(
+    workers=getattr(settings, 'RENDER_POOL_WORKERS', 2),
+    max_pending=getattr(settings, 'RENDER_POOL_MAX_PENDING', 16),
+    timeout=getattr(settings, 'RENDER_TIMEOUT', 30),
+    queue_timeout=getattr(settings, 'RENDER_QUEUE_TIMEOUT', 2),
+)
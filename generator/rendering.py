@@ -0,0 +1,376 @@
+# generator/rendering.py
+
+from io import BytesIO
+import math
+import os
+import threading
+from functools import lru_cache
+from PIL import Image, ImageChops, ImageColor, ImageDraw, features
+from django.conf import settings
+from .fonts import (
+    DEFAULT_FONT_PATH, FONT_CHOICES, FONT_PATHS, font_path_for, get_font, glyph_bbox,
+    get_best_font_size, get_best_font_size_tate, get_font_size_for_text,
+)
+
+
+# 描画結果が変わる修正をしたら上げる（画像キャッシュのキーに含まれる）
+# 3: 縦書きの1文字ごとの寸法をグリフ寸法テーブルから取るようにした（位置が±1px変わる）
+RENDERER_VERSION = 3
+
+PREVIEW_SIZE = (300, 300)
+# 文字マスク（300x300 L = 約90KB）をいくつメモリに持つか
+PREVIEW_MASK_CACHE_SIZE = getattr(settings, 'PREVIEW_MASK_CACHE_SIZE', 128)
+
+# プレビュー画像の出力形式: 形式名 -> (Pillowのフォーマット, Content-Type)
+IMAGE_FORMATS = {
+    'avif': ('AVIF', 'image/avif'),
+    'webp': ('WEBP', 'image/webp'),
+    'png': ('PNG', 'image/png'),
+}
+# Acceptヘッダーで選ぶ優先順（Pillowが書き出せない形式は飛ばす。最後は必ずPNG）
+PREVIEW_IMAGE_FORMATS = getattr(settings, 'PREVIEW_IMAGE_FORMATS', ('avif', 'webp', 'png'))
+PREVIEW_AVIF_QUALITY = getattr(settings, 'PREVIEW_AVIF_QUALITY', 50)
+PREVIEW_AVIF_SPEED = getattr(settings, 'PREVIEW_AVIF_SPEED', 8)
+PREVIEW_WEBP_QUALITY = getattr(settings, 'PREVIEW_WEBP_QUALITY', 80)
+PREVIEW_WEBP_METHOD = getattr(settings, 'PREVIEW_WEBP_METHOD', 4)  # 6 は数倍遅い割に小さくならない
+PREVIEW_PNG_OPTIMIZE = getattr(settings, 'PREVIEW_PNG_OPTIMIZE', True)
+PREVIEW_PNG_COMPRESS_LEVEL = getattr(settings, 'PREVIEW_PNG_COMPRESS_LEVEL', 9)
+
+# 印刷シートの出力形式: 形式名 -> Content-Type（印刷にも確認にも無劣化のPNGだけを使う）
+PRINT_IMAGE_FORMATS = {'png': 'image/png'}
+PRINT_FONT_SIZE_CACHE_SIZE = 256
+# 印刷シートの解像度（PDFのページサイズ計算用）
+PRINT_DPI = 300
+
+SMALL_KANA = (
+    'ぁぃぅぇぉっゃゅょゎゕゖゝゞゟ'
+    'ァィゥェォッャュョヮヵヶヽヾヿ'
+)
+
+
+TSHIRT_IMAGE_DIR = os.path.join(settings.BASE_DIR, 'static', 'images')
+TSHIRT_IMAGE_TMPL = 'fashion_tshirt1_{color}.png'
+
+
+class BackgroundCache:
+    """ボディカラーごとのTシャツ画像をデコード・リサイズ済みで保持し、コピーを渡す
+
+    fashion_tshirt1_<色>.png があればそれを、なければ白の画像をその色で着色して使う。
+    元画像の更新日時が変わっていれば次の取得時に読み直す（reload() で明示的に破棄も可）。
+    """
+
+    def __init__(self, size, directory=TSHIRT_IMAGE_DIR):
+        self.size = size
+        self.directory = directory
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def source_path(self, color):
+        path = os.path.join(self.directory, TSHIRT_IMAGE_TMPL.format(color=color))
+        if color != 'white' and not os.path.exists(path):
+            path = os.path.join(self.directory, TSHIRT_IMAGE_TMPL.format(color='white'))
+        return path
+
+    def _load(self, color, path):
+        img = Image.open(path).convert("RGBA").resize(self.size)
+        if color != 'white' and not path.endswith(TSHIRT_IMAGE_TMPL.format(color=color)):
+            try:
+                rgb = ImageColor.getrgb(color)[:3]
+            except ValueError:  # 色名として解釈できなければ白のまま
+                rgb = None
+            if rgb:
+                # 白い生地は指定色に、グレーの線は暗くなるよう乗算で着色（透明度はそのまま）
+                tint = Image.new("RGBA", self.size, rgb + (255,))
+                alpha = img.getchannel("A")
+                img = ImageChops.multiply(img, tint)
+                img.putalpha(alpha)
+        return img
+
+    def get_image(self, color='white'):
+        # 共有の画像（描き込み禁止）。描画先には get() のコピーを使う
+        path = self.source_path(color)
+        mtime = os.stat(path).st_mtime
+        cached = self._images.get(color)
+        if cached is None or cached[0] != mtime:
+            with self._lock:
+                cached = self._images.get(color)
+                if cached is None or cached[0] != mtime:
+                    cached = self._images[color] = (mtime, self._load(color, path))
+        return cached[1]
+
+    def get(self, color='white'):
+        return self.get_image(color).copy()
+
+    def preload(self, colors):
+        for color in colors:
+            self.get_image(color)
+
+    def reload(self):
+        with self._lock:
+            self._images.clear()
+
+
+def normalize_color(color, default):
+    color = (color or '').strip().lower()
+    try:
+        ImageColor.getrgb(color)
+    except ValueError:
+        return default
+    return color
+
+
+def normalize_preview_params(mode, font_code, body_color='white', text_color='black'):
+    # 描画結果が同じになる入力は同じ値にそろえる（キャッシュキー用）
+    mode = 'tate' if mode == 'tate' else 'yoko'
+    font_code = font_code if font_code in FONT_CHOICES else "ZenOldMincho"
+    return mode, font_code, normalize_color(body_color, 'white'), normalize_color(text_color, 'black')
+
+
+preview_backgrounds = BackgroundCache(PREVIEW_SIZE)
+
+
+@lru_cache(maxsize=PREVIEW_MASK_CACHE_SIZE)
+def render_kanji_mask(kanji, mode, font_code):
+    # 文字部分だけを不透明度(L)のマスクとして描く。色替えはこのマスクで合成するだけ
+    # （キャッシュ共有なので呼び出し側で書き換えないこと）
+    width, height = PREVIEW_SIZE
+    font_path = font_path_for(font_code)
+
+    is_tate = mode == 'tate'
+    chars = list(kanji)
+
+    font_size = get_font_size_for_text(kanji, font_path, width-190, height-190, 24, 120, vertical=is_tate)
+
+    mask = Image.new("L", (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    font = get_font(font_path, font_size)
+
+    if not is_tate:
+        # 横書き
+        bbox = draw.textbbox((0, 0), kanji, font=font)
+        text_width, text_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        x = (width - text_width) // 2
+        y = (height - text_height) // 3
+        draw.text((x, y), kanji, font=font, fill=255)
+    else:
+        # 縦書き
+        ws, hs, bboxes, small_indexes = [], [], [], []
+        for ch in chars:
+            # 1文字ごとの寸法はグリフ寸法テーブルから（ラスタライズしない）
+            bbox = glyph_bbox(font_path, ch, font_size)
+            w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+            # 長音符は事前に幅・高さを工夫（回転するため）
+            if ch in ['ー', 'ｰ', '-']:
+                ws.append(h)
+                hs.append(w)
+                small_indexes.append(False)
+            else:
+                ws.append(w)
+                hs.append(h)
+                small_indexes.append(ch in SMALL_KANA)
+            bboxes.append(bbox)
+
+        max_w = max(ws)
+        total_h = sum(hs) + 10*(len(chars)-1)
+        x = (width - max_w) // 2
+        y = (height - total_h) // 3
+
+        cursor_y = y
+        for i, ch in enumerate(chars):
+            w, h = ws[i], hs[i]
+            bbox = bboxes[i]
+            if ch in ['ー', 'ｰ', '-']:
+                # 長音符は90度回転描画で中央
+                base_w, base_h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+                char_img = Image.new('L', (base_w, base_h), 0)
+                char_draw = ImageDraw.Draw(char_img)
+                char_draw.text((-bbox[0], -bbox[1]), ch, font=font, fill=255)
+                rotated_char_img = char_img.rotate(90, expand=True)
+                rw, rh = rotated_char_img.size
+                adjust_ratio = 1.95  # ここを1.5等で微調整可能
+                rx = int((width - rw) / adjust_ratio)
+                ry = cursor_y + int(hs[i] * 0.4)
+                mask.paste(255, (rx, ry, rx + rw, ry + rh), rotated_char_img)
+            elif small_indexes[i]:
+                # 小書き文字: 右下寄せ
+                sx = x + int(ws[i] * 0.2)
+                sy = cursor_y - int(hs[i] * 0.4)
+                draw.text((sx, sy), ch, font=font, fill=255)
+            else:
+                draw.text((x, cursor_y), ch, font=font, fill=255)
+            cursor_y += h + 10
+
+    return mask
+
+
+def render_kanji_image(kanji, mode, font_code, body_color='white', text_color='black'):
+    bg = preview_backgrounds.get(body_color)
+    bg.paste(ImageColor.getrgb(text_color)[:3] + (255,), (0, 0) + PREVIEW_SIZE, render_kanji_mask(kanji, mode, font_code))
+    return bg
+
+
+def supported_image_formats():
+    return [f for f in PREVIEW_IMAGE_FORMATS if f == 'png' or (f in IMAGE_FORMATS and features.check(f))]
+
+
+def encode_image(img, image_format='png'):
+    if image_format == 'avif':
+        options = {'quality': PREVIEW_AVIF_QUALITY, 'speed': PREVIEW_AVIF_SPEED}
+    elif image_format == 'webp':
+        options = {'quality': PREVIEW_WEBP_QUALITY, 'method': PREVIEW_WEBP_METHOD}
+    else:
+        options = {'optimize': PREVIEW_PNG_OPTIMIZE, 'compress_level': PREVIEW_PNG_COMPRESS_LEVEL}
+    buf = BytesIO()
+    img.save(buf, IMAGE_FORMATS[image_format][0], **options)
+    return buf.getvalue()
+
+
+def render_kanji_bytes(kanji, mode, font_code, body_color='white', text_color='black', image_format='png'):
+    return encode_image(render_kanji_image(kanji, mode, font_code, body_color, text_color), image_format)
+
+
+def render_kanji_sprite(kanji_list, mode, font_code, body_color='white', text_color='black'):
+    # 候補をPREVIEW_SIZEのタイルとして縦に並べた1枚の画像（i番目は y = i * 高さ）
+    width, height = PREVIEW_SIZE
+    sheet = Image.new("RGBA", (width, height * len(kanji_list)), (0, 0, 0, 0))
+    bg = preview_backgrounds.get_image(body_color)
+    ink = ImageColor.getrgb(text_color)[:3] + (255,)
+    for i, kanji in enumerate(kanji_list):
+        sheet.paste(bg, (0, i * height))
+        sheet.paste(ink, (0, i * height, width, (i + 1) * height), render_kanji_mask(kanji, mode, font_code))
+    return sheet
+
+
+def render_kanji_sprite_bytes(kanji_list, mode, font_code, body_color='white', text_color='black', image_format='png'):
+    return encode_image(render_kanji_sprite(kanji_list, mode, font_code, body_color, text_color), image_format)
+
+
+@lru_cache(maxsize=PRINT_FONT_SIZE_CACHE_SIZE)
+def print_font_size(kanji, font_path, mode):
+    # 同じ名前・フォントの注文はサイズ計算を使い回す（まとめて印刷するときに効く）
+    if mode == "tate":
+        return get_best_font_size_tate(kanji, font_path, 2480, 3508, margin=100)
+    return get_best_font_size(kanji, font_path, 3508, 2480, vertical=False, margin=120)
+
+
+def render_print_sheet(qrdata):
+    # 印刷用A4シート（300dpi）。qrdata は注文内容（order_no, kanji, mode, font, size, body_color, text_color）
+    # 画像サイズと向き
+    mode = qrdata.get("mode", "yoko")
+    kanji = qrdata.get("kanji", "漢字")
+    fontname = qrdata.get("font", "ZenOldMincho")
+    font_path = FONT_PATHS.get(fontname, DEFAULT_FONT_PATH)
+    text_color = qrdata.get("text_color","black")
+
+    if mode == "tate":
+        width, height = 2480, 3508  # 縦A4
+        vertical = True
+        best_font_size = print_font_size(kanji, font_path, mode)
+        font = get_font(font_path, best_font_size)
+        img = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(img)
+        heights, widths, extra_spc, is_small, bboxes = [], [], [], [], []
+        for ch in kanji:
+            bbox = glyph_bbox(font_path, ch, best_font_size)
+            w = bbox[2] - bbox[0]
+            h = bbox[3] - bbox[1]
+            # 長音符は回転するためw,hを逆に記録
+            if ch in ['ー', 'ｰ', '-']:
+                widths.append(h)
+                heights.append(w)
+            else:
+                widths.append(w)
+                heights.append(h)
+            extra_spc.append(math.ceil(h*0.2))
+            is_small.append(ch in SMALL_KANA)
+            bboxes.append(bbox)
+        total_h = sum(h + sp for h,sp in zip(heights, extra_spc))
+
+        # ====== 【ここ】上下マージンを十分設けて中央寄せ ======
+        MARGIN_TOP = 0
+        MARGIN_BOTTOM = 100  # 終端見切れ防止で多め
+        usable_height = height - MARGIN_TOP - MARGIN_BOTTOM
+        if total_h > usable_height:
+            start_y = MARGIN_TOP
+        else:
+            start_y = MARGIN_TOP + int((usable_height - total_h) * 0.2)
+
+        cursor_y = start_y
+        for i, ch in enumerate(kanji):
+            w, h, sp, bbox = widths[i], heights[i], extra_spc[i], bboxes[i]
+            if ch in ['ー', 'ｰ', '-']:
+                # 長音符は90度回転
+                base_w, base_h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+                char_img = Image.new('RGBA', (base_w, base_h), (0, 0, 0, 0))
+                char_draw = ImageDraw.Draw(char_img)
+                char_draw.text((-bbox[0], -bbox[1]), ch, font=font, fill=text_color)
+                rotated_char_img = char_img.rotate(90, expand=True)
+                rw, rh = rotated_char_img.size
+                # 中央に配置（adjust_ratio微調整可）
+                adjust_ratio = 1.85
+                sx = int((width - rw) / adjust_ratio)
+                sy = cursor_y + int(rh * 0.3)
+                img.paste(rotated_char_img, (sx, sy), rotated_char_img)
+            elif is_small[i]:
+                sx = (width - w) // 2 + int(w * 0.2)
+                sy = cursor_y - int(h * 0.4)
+                draw.text((sx, sy), ch, font=font, fill=text_color)
+            else:
+                sx = (width - w) // 2
+                sy = cursor_y
+                draw.text((sx, sy), ch, font=font, fill=text_color)
+            cursor_y += h + sp
+
+        # --- 注文情報（90度回転）---
+        info_font = get_font(font_path, 64)
+        info_lines = [
+            f"Order No: {qrdata.get('order_no','')}",
+            f"Size: {qrdata.get('size','')} / Body: {qrdata.get('body_color','')} / Print: {qrdata.get('text_color','')}",
+            f"Font: {qrdata.get('font','')}",
+            f"Mode: {qrdata.get('mode','')}",
+        ]
+        info_text = "\n".join(info_lines)
+        temp_img = Image.new("RGBA", (height, width), (255,255,255,0))
+        temp_draw = ImageDraw.Draw(temp_img)
+        padding = 50
+        temp_draw.multiline_text((padding, padding), info_text, font=info_font, fill="gray", spacing=12)
+        temp_img_rot = temp_img.rotate(90, expand=1)
+        info_w, info_h = temp_img_rot.size
+        pos_x = width - info_w - 40
+        pos_y = height - info_h - 40
+        img.paste(temp_img_rot, (pos_x, pos_y), temp_img_rot)
+    else:
+        width, height = 3508, 2480  # 横A4
+        vertical = False
+        best_font_size = print_font_size(kanji, font_path, mode)
+        font = get_font(font_path, best_font_size)
+        img = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(img)
+        bbox = draw.textbbox((0, 0), kanji, font=font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+        x = (width - text_width) // 2
+        y = (height - text_height) * 0.3
+        draw.text((x, y), kanji, font=font, fill=text_color)
+
+        # 下部注文情報
+        info_font = get_font(font_path, 64)
+        info_lines = [
+            f"Order No: {qrdata.get('order_no','')}",
+            f"Size: {qrdata.get('size','')} / Body: {qrdata.get('body_color','')} / Print: {qrdata.get('text_color','')}",
+            f"Font: {qrdata.get('font','')}",
+            f"Mode: {qrdata.get('mode','')}",
+        ]
+        y_info = height - 400
+        for line in info_lines:
+            draw.text((160, y_info), line, font=info_font, fill="gray")
+            y_info += 70
+
+    return img
+
+
+def render_print_bytes(qrdata, image_format='png'):
+    # 印刷にはPNG（無劣化）を使う。image_format はキャッシュのキーに入る形式名（PRINT_IMAGE_FORMATS）
+    buf = BytesIO()
+    render_print_sheet(qrdata).save(buf, 'PNG')
+    return buf.getvalue()
@@ -0,0 +1,155 @@
+# generator/singleflight.py
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import LookupLock
+
+# 他プロセスの同じ問い合わせを待つ最長時間（秒）。GPTの応答時間より長めに
+SINGLE_FLIGHT_LOCK_TIMEOUT = getattr(settings, 'SINGLE_FLIGHT_LOCK_TIMEOUT', 30)
+SINGLE_FLIGHT_POLL_INTERVAL = 0.2
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """同じキーの処理が実行中なら、後から来た呼び出しは実行せずにその結果を待って受け取る（プロセス内）"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+def lock_key(key):
+    return hashlib.sha256(json.dumps(key, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def try_lock(name, timeout):
+    # LookupLock の行を作れたら True。持ち主が落ちて残った行は timeout を過ぎたら消す
+    try:
+        with transaction.atomic():  # 失敗しても外側のトランザクションを壊さない
+            LookupLock.objects.create(key=name)
+        return True
+    except IntegrityError:
+        LookupLock.objects.filter(key=name, created_at__lt=timezone.now() - timedelta(seconds=timeout)).delete()
+        return False
+
+
+def release_lock(name):
+    LookupLock.objects.filter(key=name).delete()
+
+
+@contextmanager
+def db_lock(key, timeout=None):
+    """複数プロセス向け: LookupLock の行を作れた1プロセスだけが True を受け取る
+
+    他のプロセスが持っている間は解放（行の削除）を待ち、待ち切れなければ False。
+    """
+    timeout = SINGLE_FLIGHT_LOCK_TIMEOUT if timeout is None else timeout
+    name = lock_key(key)
+    deadline = time.monotonic() + timeout
+    while not (acquired := try_lock(name, timeout)) and time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            release_lock(name)
+
+
+@asynccontextmanager
+async def async_db_lock(key, timeout=None):
+    # db_lock の非同期版（待っている間もイベントループを止めない）
+    timeout = SINGLE_FLIGHT_LOCK_TIMEOUT if timeout is None else timeout
+    name = lock_key(key)
+    deadline = time.monotonic() + timeout
+    while not (acquired := await sync_to_async(try_lock)(name, timeout)) and time.monotonic() < deadline:
+        await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            await sync_to_async(release_lock)(name)
+
+
+_flights = SingleFlight()
+
+
+def single_flight(key, lookup, fetch):
+    """lookup() で保存済みの結果を探し、なければ fetch() で取得する（fetch は結果の保存までを行う）
+
+    同じ key の fetch はプロセス内では1つだけ走らせ、他の呼び出しはその結果を受け取る。
+    プロセスをまたいでは DB のロックで順番にし、後の方は先の方が保存した結果を lookup() で拾う。
+    """
+    result = lookup()
+    if result:
+        return result
+
+    def leader():
+        with db_lock(key):
+            # ロック待ちの間に他のプロセスが保存していればそれを使う
+            # （待ち切れなかったときも、問い合わせが止まらないよう自分で取得する）
+            return lookup() or fetch()
+
+    return _flights.do(json.dumps(key, ensure_ascii=False), leader)
+
+
+# イベントループ -> {キー: 実行中の Task}（Task はループをまたいで待てないのでループごと）
+_async_flights = weakref.WeakKeyDictionary()
+
+
+async def async_single_flight(key, lookup, fetch):
+    """single_flight の非同期版。lookup / fetch はコルーチン関数"""
+    result = await lookup()
+    if result:
+        return result
+    flights = _async_flights.setdefault(asyncio.get_running_loop(), {})
+    flight_key = json.dumps(key, ensure_ascii=False)
+    task = flights.get(flight_key)
+    if task is None:
+        async def leader():
+            try:
+                async with async_db_lock(key):
+                    return await lookup() or await fetch()
+            finally:
+                flights.pop(flight_key, None)
+
+        task = flights[flight_key] = asyncio.ensure_future(leader())
+    # 待っている1人が切断されても、他の人のための問い合わせは止めない
+    return await asyncio.shield(task)
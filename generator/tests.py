@@ -1,3 +1,927 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.http import Http404
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone, translation
+from PIL import Image, ImageDraw, ImageFont
+
+from generator import fonts, rendering
+from generator.render_cache import RenderCache
+from generator.render_service import RenderBusy, RenderService, RenderTimeout
+from generator.rendering import BackgroundCache, render_kanji_image, render_kanji_mask
+from generator import views
+from generator import barcodes, kana, print_batch, print_queue, singleflight
+from generator.json_stream import JsonArrayObjects
+from generator.meaning_cache import MeaningTable, meaning_table
+from generator.models import KanjiAteji, KanjiMeaning, Order, PrintJob, TshirtSetting
+from generator.views import get_font_size_for_text, get_best_font_size, get_best_font_size_tate
+
+TEST_FONT_PATH = os.path.join(settings.BASE_DIR, 'static', 'fonts', 'hkkaing.ttf')
+
+NAME_CORPUS = [
+    'じゃすてぃん', 'ジャスティン', 'まいける', 'マイケル', 'えみりー', 'エミリー',
+    'ソフィア', 'しゃーろっと', 'チャーリー', 'あ', 'ア', 'ーー', 'ぁぃぅ', 'ケイト',
+    'ジェニファー', 'すてふぁにー', 'オリヴィア', 'ヴィクトリア', 'ノア', 'きゃさりん',
+]
+
+
+def binary_search_font_size(text, font_path, max_w, max_h, min_size, max_size, measure):
+    # 置き換え前の二分探索（比較用の基準実装）
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    best = min_size
+    left, right = min_size, max_size
+    while left <= right:
+        mid = (left + right) // 2
+        w, h = measure(draw, text, ImageFont.truetype(font_path, mid))
+        if w <= max_w and h <= max_h:
+            best = mid
+            left = mid + 1
+        else:
+            right = mid - 1
+    return best
+
+
+def measure_yoko(draw, text, font):
+    bbox = draw.textbbox((0, 0), text, font=font)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+
+def measure_tate(rotate_bars, extra_ratio):
+    def measure(draw, text, font):
+        widths, heights = [], []
+        for ch in text:
+            bbox = draw.textbbox((0, 0), ch, font=font)
+            w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+            if rotate_bars and ch in ['ー', 'ｰ', '-']:
+                w, h = h, w
+            widths.append(w)
+            heights.append(h)
+        return max(widths), sum(h + math.ceil(h*extra_ratio) for h in heights)
+    return measure
+
+
+class FontSizeSolverTests(SimpleTestCase):
+
+    def test_preview_size_matches_binary_search(self):
+        for name in NAME_CORPUS:
+            for box in (110, 160, 300):
+                expected = binary_search_font_size(name, TEST_FONT_PATH, box, box, 24, 120, measure_yoko)
+                self.assertEqual(get_font_size_for_text(name, TEST_FONT_PATH, box, box, 24, 120), expected, name)
+                expected = binary_search_font_size(name, TEST_FONT_PATH, box, box, 24, 120, measure_tate(True, 0))
+                self.assertEqual(get_font_size_for_text(name, TEST_FONT_PATH, box, box, 24, 120, vertical=True), expected, name)
+
+    def test_print_size_matches_binary_search(self):
+        for name in NAME_CORPUS:
+            expected = binary_search_font_size(name, TEST_FONT_PATH, 3508 - 240, 2480 - 240, 50, 1000, measure_yoko)
+            self.assertEqual(get_best_font_size(name, TEST_FONT_PATH, 3508, 2480, margin=120), expected, name)
+            expected = binary_search_font_size(name, TEST_FONT_PATH, 2480 - 200, 3508 - 200, 50, 1000, measure_tate(True, 0.2))
+            self.assertEqual(get_best_font_size_tate(name, TEST_FONT_PATH, 2480, 3508, margin=100), expected, name)
+
+    def test_solver_measures_only_near_the_boundary(self):
+        with mock.patch('generator.fonts.measure_layout', wraps=fonts.measure_layout) as measure:
+            get_best_font_size_tate('ジェニファー', TEST_FONT_PATH, 2480, 3508, margin=100)
+        self.assertLessEqual(measure.call_count, 3)
+
+
+class GlyphMetricsTableTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        patcher = mock.patch('generator.fonts.GLYPH_METRICS_DIR', self.tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(fonts.clear_glyph_tables)
+
+    def test_saved_table_is_loaded_after_restart(self):
+        table = fonts.build_glyph_table(TEST_FONT_PATH, fonts.default_glyph_charset())
+        fonts.save_glyph_table(TEST_FONT_PATH, table)
+        fonts.clear_glyph_tables()
+        self.assertEqual(fonts.glyph_table(TEST_FONT_PATH), table)
+
+    def test_scaled_glyph_bbox_is_close_to_real_bbox(self):
+        for size in (30, 110, 700):
+            font = ImageFont.truetype(TEST_FONT_PATH, size)
+            draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+            for ch in 'あーゃヴA-':
+                real = draw.textbbox((0, 0), ch, font=font)
+                scaled = fonts.glyph_bbox(TEST_FONT_PATH, ch, size)
+                for a, b in zip(real, scaled):
+                    self.assertLessEqual(abs(a - b), 1, (ch, size))
+
+    def test_tate_layout_change_bumps_renderer_version(self):
+        def measured_bbox(font_path, ch, size):
+            # テーブルを使う前の縦書きの寸法（最終サイズで実測）
+            draw = ImageDraw.Draw(Image.new("L", (1, 1)))
+            return draw.textbbox((0, 0), ch, font=fonts.get_font(font_path, size))
+
+        render = rendering.render_kanji_mask.__wrapped__
+        with mock.patch('generator.rendering.font_path_for', return_value=TEST_FONT_PATH):
+            table_mask = render('じゃすてぃん', 'tate', 'Kouzan')
+            with mock.patch('generator.rendering.glyph_bbox', measured_bbox):
+                measured_mask = render('じゃすてぃん', 'tate', 'Kouzan')
+        # 文字の位置は数px以内で同じだが、画素は一致しない
+        for a, b in zip(table_mask.getbbox(), measured_mask.getbbox()):
+            self.assertLessEqual(abs(a - b), 2)
+        self.assertNotEqual(table_mask.tobytes(), measured_mask.tobytes())
+        # なので以前の版（2）で保存した画像とはキャッシュのキーを分ける
+        self.assertGreater(rendering.RENDERER_VERSION, 2)
+
+
+class RenderCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.render = mock.Mock(side_effect=lambda kanji, mode, font: (kanji + mode + font).encode() * 30)
+        self.cache = RenderCache(self.tmpdir.name, 1000, self.render)
+
+    def test_repeat_request_is_served_from_disk(self):
+        first = self.cache.get_or_render('樹志天', 'tate', 'Kouzan')
+        second = self.cache.get_or_render('樹志天', 'tate', 'Kouzan')
+        self.assertEqual(first, second)
+        self.assertEqual(self.render.call_count, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_key_depends_on_renderer_version(self):
+        other = RenderCache(self.tmpdir.name, 1000, self.render, version=self.cache.version + 1)
+        self.assertNotEqual(self.cache.key('樹', 'yoko', 'Kouzan'), other.key('樹', 'yoko', 'Kouzan'))
+
+    def test_evict_keeps_total_size_under_limit(self):
+        for kanji in ('あ', 'い', 'う', 'え'):
+            self.cache.get_or_render(kanji, 'yoko', 'Kouzan')
+        self.cache.evict()
+        stats = self.cache.stats()
+        self.assertLessEqual(stats['bytes'], 1000)
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(self.cache.purge(), 2)
+
+
+class KanjiImageConditionalTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        for target, value in (
+            ('generator.rendering.font_path_for', mock.Mock(return_value=TEST_FONT_PATH)),
+            ('generator.render_cache.kanji_image_cache.directory', self.tmpdir.name),
+            ('generator.render_service.render_service.workers', 0),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+        self.url = '/api/kanji_image/?kanji=%E3%81%98%E3%82%83&mode=tate&font=Kouzan'
+
+    def test_response_is_cacheable(self):
+        response = views.kanji_image(self.factory.get(self.url))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_matching_etag_returns_304_without_rendering(self):
+        etag = views.kanji_image(self.factory.get(self.url))['ETag']
+        with mock.patch('generator.render_cache.kanji_image_cache.get_or_render') as get_or_render:
+            response = views.kanji_image(self.factory.get(self.url, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+        get_or_render.assert_not_called()
+
+    def test_format_is_negotiated_from_accept_header(self):
+        for accept, content_type in (
+            ('image/avif,image/webp,*/*;q=0.8', 'image/avif'),
+            ('image/webp,*/*', 'image/webp'),
+            ('image/avif;q=0,image/webp', 'image/webp'),
+            ('*/*', 'image/png'),
+        ):
+            response = views.kanji_image(self.factory.get(self.url, HTTP_ACCEPT=accept))
+            self.assertEqual(response['Content-Type'], content_type, accept)
+            self.assertIn('Accept', response['Vary'])
+            self.assertEqual(Image.open(BytesIO(response.content)).size, (300, 300))
+
+    def test_etag_differs_per_format(self):
+        png = views.kanji_image(self.factory.get(self.url))
+        webp = views.kanji_image(self.factory.get(self.url, HTTP_ACCEPT='image/webp'))
+        self.assertNotEqual(png['ETag'], webp['ETag'])
+        self.assertLess(len(webp.content), len(png.content))
+
+
+class BackgroundCacheTests(SimpleTestCase):
+
+    def test_backgrounds_are_decoded_once_and_handed_out_as_copies(self):
+        cache = BackgroundCache((300, 300))
+        with mock.patch('generator.rendering.Image.open', wraps=Image.open) as image_open:
+            first = cache.get('white')
+            first.putpixel((150, 150), (255, 0, 0, 255))
+            second = cache.get('white')
+        self.assertEqual(image_open.call_count, 1)
+        self.assertEqual(second.size, (300, 300))
+        self.assertEqual(second.getpixel((150, 150)), (255, 255, 255, 255))
+
+    def test_missing_colour_image_is_tinted_from_white(self):
+        cache = BackgroundCache((300, 300))
+        self.assertEqual(cache.get('black').getpixel((150, 150)), (0, 0, 0, 255))
+
+
+class ColourPreviewTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch('generator.rendering.font_path_for', return_value=TEST_FONT_PATH)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        render_kanji_mask.cache_clear()
+        self.addCleanup(render_kanji_mask.cache_clear)
+
+    def test_colour_variants_reuse_one_text_mask(self):
+        for body_color, text_color in (('white', 'black'), ('black', 'white'), ('navy', 'red')):
+            img = render_kanji_image('じゃすてぃん', 'tate', 'Kouzan', body_color, text_color)
+            self.assertEqual(img.size, (300, 300))
+        info = render_kanji_mask.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 2))
+
+    def test_text_is_drawn_in_text_colour_on_body_colour(self):
+        img = render_kanji_image('ー', 'yoko', 'Kouzan', 'black', 'red')
+        colours = {rgba[:3] for count, rgba in img.getcolors(300 * 300)}
+        self.assertIn((255, 0, 0), colours)
+        self.assertIn((0, 0, 0), colours)
+
+
+class KanjiSpriteTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        for target, value in (
+            ('generator.rendering.font_path_for', mock.Mock(return_value=TEST_FONT_PATH)),
+            ('generator.render_cache.kanji_sprite_cache.directory', self.tmpdir.name),
+            ('generator.render_service.render_service.workers', 0),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_candidates_are_rendered_into_one_sheet(self):
+        url = views.kanji_sprite_url(['じゃすてぃん', 'ジャスティン', 'あ'], 'tate', 'Kouzan')
+        response = views.kanji_sprite(RequestFactory().get(url))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response['X-Sprite-Offsets']), [[0, 0], [0, 300], [0, 600]])
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (300, 900))
+
+    def test_empty_candidates_are_left_out_of_the_sprite(self):
+        candidates = [{'kanji': '樹'}, {'kanji': ''}, {'kanji': '天'}]
+        context = views.ateji_form_context('Justin', 3, 'yoko', 'Kouzan', candidates, True, None)
+        self.assertEqual(resolve(context['sprite_url'].split('?')[0]).url_name, 'kanji_sprite')
+        kanji_list = views.kanji_sprite_params(RequestFactory().get(context['sprite_url']))[0]
+        self.assertEqual(kanji_list, ('樹', '天'))
+        self.assertEqual([c.get('sprite_position') for c in candidates], ['0.0000', None, '100.0000'])
+
+    def test_sprite_requires_candidates(self):
+        response = views.kanji_sprite(RequestFactory().get('/api/kanji_sprite/?mode=tate'))
+        self.assertEqual(response.status_code, 400)
+
+
+class RenderServiceTests(SimpleTestCase):
+
+    def test_inline_when_pool_is_disabled(self):
+        service = RenderService(workers=0, max_pending=1, timeout=1, queue_timeout=0)
+        self.assertEqual(service.run(pow, 2, 10), 1024)
+
+    def test_busy_when_all_slots_are_taken(self):
+        service = RenderService(workers=1, max_pending=1, timeout=1, queue_timeout=0)
+        service._slots.acquire()
+        self.addCleanup(service._slots.release)
+        with self.assertRaises(RenderBusy):
+            service.run(pow, 2, 10)
+
+    def test_slot_is_held_until_an_overrunning_render_finishes(self):
+        service = RenderService(workers=1, max_pending=1, timeout=0.2, queue_timeout=0)
+        self.addCleanup(service.shutdown)
+        first = service._get_executor()
+        with self.assertRaises(RenderTimeout):
+            service.run(time.sleep, 1)
+        with self.assertRaises(RenderBusy):
+            service.run(pow, 2, 10)  # 描画はまだ続いているので枠は空かない
+        self.assertIsNot(service._get_executor(), first)
+        time.sleep(1.5)
+        service.timeout = 30
+        self.assertEqual(service.run(pow, 2, 10), 1024)
+
+    def test_unavailable_render_returns_503(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        with mock.patch('generator.render_cache.kanji_image_cache.directory', tmpdir.name), \
+                mock.patch('generator.render_cache.kanji_image_cache.render', side_effect=RenderBusy()):
+            response = views.kanji_image(RequestFactory().get('/api/kanji_image/?kanji=%E3%81%82'))
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn('max-age', response.get('Cache-Control', ''))
+
+
+class PrintJobQueueTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        for target, value in (
+            ('generator.rendering.FONT_PATHS', {'Kouzan': TEST_FONT_PATH}),
+            ('generator.render_cache.print_sheet_cache.directory', self.tmpdir.name),
+            ('generator.render_service.render_service.workers', 0),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user('staff')
+        self.order = Order.objects.create(kanji='じゃすてぃん', mode='tate', font='Kouzan', size='L')
+
+    def post_preview(self):
+        body = json.dumps({'qr_json': json.dumps({'order_no': str(self.order.id)})})
+        request = self.factory.post(reverse('print_preview'), body, content_type='application/json')
+        request.user = self.user
+        return json.loads(views.print_preview(request).content)
+
+    def call(self, url, method='get'):
+        request = getattr(self.factory, method)(url)
+        request.user = self.user
+        match = resolve(url)
+        return match.func(request, **match.kwargs)
+
+    def test_scan_only_queues_and_worker_renders(self):
+        with mock.patch('generator.render_cache.print_sheet_cache.render') as render:
+            data = self.post_preview()
+        render.assert_not_called()
+        self.assertEqual(data['status'], 'queued')
+        self.assertNotIn('preview_url', data)
+
+        self.assertEqual(print_queue.run_worker(once=True), 1)
+        data = json.loads(self.call(data['status_url']).content)
+        self.assertEqual(data['status'], 'ready')
+        response = self.call(data['preview_url'])
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        content = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertEqual(Image.open(BytesIO(content)).size, (2480, 3508))
+
+    def test_rescan_reuses_rendered_sheet_and_marks_printed(self):
+        self.post_preview()
+        print_queue.run_worker(once=True)
+        data = self.post_preview()
+        self.assertEqual(data['status'], 'ready')
+        data = json.loads(self.call(data['printed_url'], 'post').content)
+        self.assertEqual(data['status'], 'printed')
+        jobs = json.loads(self.call(reverse('print_jobs')).content)['jobs']
+        self.assertEqual([job['status'] for job in jobs], ['printed'])
+
+    def test_failed_render_is_retried_then_marked_failed(self):
+        self.post_preview()
+        with mock.patch('generator.render_cache.print_sheet_cache.render', side_effect=OSError('no font')), \
+                self.assertLogs('generator.print_queue', 'ERROR'):
+            self.assertEqual(print_queue.run_worker(once=True), print_queue.PRINT_JOB_MAX_ATTEMPTS)
+        job = PrintJob.objects.get(order_no=str(self.order.id))
+        self.assertEqual((job.status, job.error), (PrintJob.STATUS_FAILED, 'no font'))
+
+    def test_marking_printed_requires_the_csrf_token(self):
+        self.post_preview()
+        print_queue.run_worker(once=True)
+        job = PrintJob.objects.get()
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        url = reverse('print_job_printed', args=[job.pk])
+        self.assertEqual(client.post(url).status_code, 403)
+        page = client.get(reverse('print_preview'))
+        token = re.search(r'const CSRF_TOKEN = "(\w+)"', page.content.decode()).group(1)
+        self.assertEqual(client.post(url, HTTP_X_CSRFTOKEN=token).json()['status'], 'printed')
+
+    def test_stale_job_is_failed_after_max_attempts(self):
+        self.post_preview()
+        stale = timezone.now() - timedelta(seconds=print_queue.PRINT_JOB_STALE_AFTER + 1)
+        # 描画中にワーカーが落ちた（rendering のまま止まった）
+        PrintJob.objects.update(status=PrintJob.STATUS_RENDERING, attempts=1, updated_at=stale)
+        self.assertEqual(print_queue.requeue_stale_jobs(), 1)
+        self.assertEqual(PrintJob.objects.get().status, PrintJob.STATUS_QUEUED)
+
+        PrintJob.objects.update(
+            status=PrintJob.STATUS_RENDERING, attempts=print_queue.PRINT_JOB_MAX_ATTEMPTS, updated_at=stale,
+        )
+        self.assertEqual(print_queue.requeue_stale_jobs(), 0)
+        job = PrintJob.objects.get()
+        self.assertEqual((job.status, job.error), (PrintJob.STATUS_FAILED, 'worker died'))
+        self.assertEqual(print_queue.run_worker(once=True), 0)
+
+    def test_order_is_prerendered_so_scan_is_a_lookup(self):
+        request = self.factory.post(reverse('tshirt_order'), {
+            'kanji': 'えみりー', 'mode': 'yoko', 'font': 'Kouzan', 'size': 'M',
+            'body_color': 'white', 'text_color': 'black',
+        })
+        request.user = self.user
+        self.assertEqual(views.tshirt_order(request).status_code, 200)
+        order = Order.objects.get(kanji='えみりー')
+        self.assertEqual(PrintJob.objects.get(order_no=str(order.id)).status, PrintJob.STATUS_QUEUED)
+        print_queue.run_worker(once=True)
+
+        self.order = order
+        with mock.patch('generator.render_cache.print_sheet_cache.render') as render:
+            data = self.post_preview()
+        render.assert_not_called()
+        self.assertEqual(data['status'], 'ready')
+        self.assertIn('preview_url', data)
+
+    def test_unknown_preview_id(self):
+        with self.assertRaises(Http404):
+            self.call(reverse('print_preview_image', args=['0' * 64]))
+        # シートはPNGだけ。別の形式のURLはない（PNGの中身を別の Content-Type で返さない）
+        with self.assertRaises(Resolver404):
+            resolve(reverse('print_preview_image', args=['0' * 64]).replace('.png', '.jpeg'))
+
+
+class PrintBatchTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        for target, value in (
+            ('generator.rendering.FONT_PATHS', {'Kouzan': TEST_FONT_PATH}),
+            ('generator.render_cache.print_sheet_cache.directory', self.tmpdir.name),
+            ('generator.render_service.render_service.workers', 0),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('staff')
+        self.orders = [
+            Order.objects.create(kanji=kanji, mode=mode, font='Kouzan', size='M')
+            for kanji, mode in (('じゃすてぃん', 'tate'), ('じゃすてぃん', 'tate'), ('えみりー', 'yoko'))
+        ]
+
+    def post_batch(self, **data):
+        request = RequestFactory().post(reverse('print_batch'), data)
+        request.user = self.user
+        return views.print_batch(request)
+
+    def test_pdf_has_one_lossless_page_per_order(self):
+        from generator.rendering import print_font_size
+        print_font_size.cache_clear()
+        with mock.patch('generator.print_batch.PRINT_BATCH_THREADS', 1):  # 同時に描くと両方ミスになるので直列で
+            response = self.post_batch(day=timezone.localdate().isoformat(), format='pdf', mark_printed='1')
+        pdf = b''.join(response.streaming_content)
+        self.assertTrue(pdf.startswith(b'%PDF-'))
+        self.assertEqual(pdf.count(b'/Type /Page '), 3)
+        # 同じ名前・フォントの注文はサイズ計算を使い回す
+        self.assertEqual(print_font_size.cache_info().misses, 2)
+        # xref の位置が各オブジェクトの先頭を指している
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split()[0])
+        offsets = [int(line[:10]) for line in pdf[xref:].split(b'\n')[3:] if line.endswith(b' n ')]
+        for number, offset in enumerate(offsets, 1):
+            self.assertTrue(pdf[offset:].startswith(b'%d 0 obj' % number))
+        # 画像は描画済みPNGのIDATをそのまま埋め込む（再圧縮しない）
+        job = PrintJob.objects.get(order_no=str(self.orders[2].id))
+        width, height, colors, params, stream = print_batch._png_image_stream(
+            print_batch.print_sheet_cache.path_for(job.preview_id))
+        self.assertEqual((width, height), (3508, 2480))
+        self.assertIn(b'/Length %d >>\nstream\n' % len(stream) + stream, pdf)
+        self.assertEqual(job.status, PrintJob.STATUS_PRINTED)
+        self.assertEqual(print_batch.unprinted_orders(timezone.localdate()).count(), 0)
+
+    def test_zip_contains_a_sheet_per_order(self):
+        ids = '\n'.join(str(order.id) for order in self.orders[:2])
+        response = self.post_batch(order_ids=ids, format='zip')
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as zf:
+            names = zf.namelist()
+            self.assertEqual(len(names), 2)
+            self.assertEqual(Image.open(BytesIO(zf.read(names[0]))).size, (2480, 3508))
+        self.assertEqual(self.post_batch(format='zip').status_code, 400)
+
+    def test_batch_over_the_limit_is_rejected(self):
+        with mock.patch('generator.print_batch.PRINT_BATCH_MAX', 2):
+            response = self.post_batch(day=timezone.localdate().isoformat(), format='zip')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(b'3 orders', response.content)
+            with self.assertRaisesMessage(CommandError, 'at most 2'):
+                call_command('print_batch', os.path.join(self.tmpdir.name, 'out.zip'), '--day', timezone.localdate().isoformat())
+        self.assertFalse(PrintJob.objects.exists())
+        with self.assertRaisesMessage(CommandError, 'UUID'):
+            call_command('print_batch', os.path.join(self.tmpdir.name, 'out.zip'), '--order', 'ORDER-1')
+
+    def test_batch_leaves_jobs_claimed_by_the_worker(self):
+        job = print_queue.enqueue_print_job(self.orders[0])
+        self.assertEqual(print_queue.claim_next_job().pk, job.pk)
+        print_batch.render_batch(self.orders[:1])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.preview_id), (PrintJob.STATUS_RENDERING, ''))
+
+
+class BarcodeCacheTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        patcher = mock.patch('generator.barcodes.barcode_cache.directory', self.tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        barcodes._memory.clear()
+        self.addCleanup(barcodes._memory.clear)
+
+    def test_barcode_is_rendered_once_and_served_by_url(self):
+        url = views.barcode_url('4901234567894')
+        with mock.patch('generator.barcodes.barcode_cache.render', wraps=barcodes.render_barcode) as render:
+            for _ in range(2):
+                response = views.barcode_image(RequestFactory().get(url), '4901234567894', 'svg')
+            barcodes._memory.clear()
+            views.barcode_image(RequestFactory().get(url), '4901234567894', 'svg')  # ディスクから
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn(b'<svg', response.content)
+        png = views.barcode_image(RequestFactory().get(url), '4901234567894', 'png')
+        self.assertEqual(Image.open(BytesIO(png.content)).format, 'PNG')
+        with self.assertRaises(Http404):
+            views.barcode_image(RequestFactory().get(url), '12345', 'svg')
+
+    def test_qr_svg_matches_qr_modules(self):
+        import qrcode
+        svg = barcodes.qr_svg('{"order_no": "4393588c-1a32-4716-b83d-15a991382448"}')
+        qr = qrcode.QRCode(border=4)
+        qr.add_data('{"order_no": "4393588c-1a32-4716-b83d-15a991382448"}')
+        dark = sum(map(sum, qr.get_matrix()))
+        # 横に続く黒モジュールは h<幅> の1本にまとめている
+        widths = [int(w) for w in re.findall(r'h(\d+)v', svg)]
+        self.assertEqual(sum(widths), dark)
+        self.assertTrue(svg.startswith('<svg '))
+
+    def test_changing_jan_code_drops_old_image(self):
+        TshirtSetting.objects.create(id=1, jan_code_const='4901234567894')
+        old_path = barcodes.barcode_cache.path_for(barcodes.barcode_key('4901234567894', image_format='svg'))
+        barcodes.barcode_image('4901234567894', image_format='svg')
+        self.assertTrue(os.path.exists(old_path))
+        request = RequestFactory().post(reverse('admin_tshirt_settings'), {'price': '5000', 'jan_code_const': '4512345678901'})
+        request.user = User.objects.create_user('staff')
+        views.admin_tshirt_settings(request)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertNotIn(barcodes.barcode_key('4901234567894', image_format='svg'), barcodes._memory)
+
+
+def gpt_response(content):
+    return {'choices': [{'message': {'content': content}}]}
+
+
+class SingleFlightTests(TestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = singleflight.SingleFlight()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'じゃすてぃん'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('justin', fetch))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['じゃすてぃん'] * 5)
+
+    def test_db_lock_is_exclusive(self):
+        with singleflight.db_lock(('meaning', '樹', 'en')) as first:
+            with singleflight.db_lock(('meaning', '樹', 'en'), timeout=0) as second:
+                self.assertEqual((first, second), (True, False))
+        with singleflight.db_lock(('meaning', '樹', 'en'), timeout=0) as again:
+            self.assertTrue(again)
+
+    def test_repeated_names_reuse_stored_results(self):
+        replies = [
+            gpt_response('ぶらんどん'),
+            gpt_response('[{"kanji": "武蘭丼", "reading": "ぶらんどん", "parts": ["武", "蘭", "丼"]}]'),
+            gpt_response('たいらー'),
+            gpt_response('[{"kanji": "泰良", "reading": "たいらー"}]'),
+        ]
+        with mock.patch('openai.ChatCompletion.create', side_effect=replies) as create:
+            self.assertEqual(views.get_kanji_candidates('Brandon', 3)[1], False)
+            candidates, cached = views.get_kanji_candidates('brandon', 3)
+            self.assertEqual((candidates[0]['kanji'], cached), ('武蘭丼', True))
+            candidates, cached = views.get_kanji_candidates('Tyler', 3)
+            self.assertEqual(candidates[0]['parts'], ['泰', '良'])
+        self.assertEqual(create.call_count, 4)
+
+
+class MeaningPrefetchTests(TestCase):
+    def setUp(self):
+        # テストごとにDBが巻き戻るので、前のテストで読み込んだ辞書を捨てる
+        meaning_table.invalidate()
+
+    def test_page_meanings_are_fetched_in_one_request(self):
+        from generator.templatetags.kanji_meaning_lookup import meaning_from_parts
+        KanjiMeaning.objects.create(char='志', meaning_en='will')
+        candidates = [
+            {'kanji': '樹志天', 'parts': ['樹', '志', '天']},
+            {'kanji': '寿天', 'parts': ['寿', '天']},
+            {'kanji': 'ジャスティン', 'parts': ['ジャスティン']},
+        ]
+        reply = gpt_response(
+            '```json\n{"樹": {"en": "tree", "ja": "木"}, "天": {"en": "heaven", "ja": "空"}, '
+            '"寿": {"en": "longevity", "ja": "長寿"}, "猫": {"en": "cat"}}\n```'
+        )
+        with mock.patch('openai.ChatCompletion.create', return_value=reply) as create:
+            missing = views.prefetch_kanji_meanings([p for c in candidates for p in c['parts']], 'en')
+            with translation.override('en'):
+                strings = [meaning_from_parts(c['parts']) for c in candidates]
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(missing, ['樹', '天', '寿'])
+        self.assertEqual(strings[0], "'樹':tree, '志':will, '天':heaven")
+        self.assertEqual(strings[2], "'ジャスティン':KATAKANA")
+        self.assertFalse(KanjiMeaning.objects.filter(char='猫').exists())
+        self.assertEqual(KanjiMeaning.objects.get(char='樹').meaning_ja, '木')
+
+    def test_large_page_is_split_under_the_token_cap(self):
+        chars = list('樹志天寿恵美里愛優花咲桜空海星')
+        langs = ['en', 'ja', 'zh-hans', 'zh-hant', 'ko', 'fr', 'de', 'es', 'it', 'ru', 'sv', 'th', 'nl']
+
+        def reply(model, messages, max_tokens, temperature):
+            asked = json.loads(re.search(r'\[.*?\]', messages[1]['content']).group(0))
+            return gpt_response(json.dumps({c: {code: c for code in langs} for c in asked}))
+
+        with mock.patch('openai.ChatCompletion.create', side_effect=reply) as create:
+            meanings = views.ask_gpt_meanings(chars, langs)
+        self.assertEqual(create.call_count, 2)
+        for call in create.call_args_list:
+            self.assertLessEqual(call.kwargs['max_tokens'], views.GPT_MAX_COMPLETION_TOKENS)
+        self.assertEqual(sorted(meanings), sorted(chars))
+        self.assertEqual(meanings['星']['nl'], '星')
+
+    def test_first_miss_stores_every_language(self):
+        reply = gpt_response('{"樹": {"en": "tree", "ja": "木"}}')
+        with mock.patch('openai.ChatCompletion.create', return_value=reply) as create:
+            self.assertEqual(views.get_or_create_kanji_meaning('樹', 'en'), 'tree')
+            self.assertEqual(views.get_or_create_kanji_meaning('樹', 'ja'), '木')
+        self.assertEqual(create.call_count, 1)
+
+    def test_failed_batch_falls_back_to_single_lookups(self):
+        replies = [RuntimeError('timeout'), gpt_response('{"樹": {"en": "tree"}}'), gpt_response('木')]
+        with mock.patch('openai.ChatCompletion.create', side_effect=replies):
+            views.prefetch_kanji_meanings(['樹'], 'en')
+            self.assertEqual(views.get_or_create_kanji_meaning('樹', 'en'), 'tree')
+            self.assertEqual(views.get_or_create_kanji_meaning('樹', 'ja'), '木')
+
+    def test_meaning_string_query_count_does_not_grow_with_parts(self):
+        from generator.templatetags.kanji_meaning_lookup import meaning_from_parts
+        chars = '樹志天寿恵美里'
+        KanjiMeaning.objects.bulk_create([KanjiMeaning(char=c, meaning_en=f"m{i}") for i, c in enumerate(chars)])
+        with self.assertNumQueries(1):
+            views.get_meaning_string(['樹'], 'en')  # 辞書の読み込み
+        for parts in (['樹', 'ジャ'], list(chars) + ['じゃ']):
+            with self.assertNumQueries(0):
+                text = views.get_meaning_string(parts, 'en')
+                self.assertEqual(views.get_or_create_kanji_meaning('志', 'en'), 'm1')
+            self.assertTrue(text.startswith("'樹':m0, "))
+            with self.assertNumQueries(0), translation.override('en'):
+                meaning_from_parts(parts)
+        self.assertEqual(views.get_meaning_string(['ジャ', '樹'], 'en'), "'ジャ':KATAKANA, '樹':m0")
+
+    def test_meaning_table_follows_saves_and_other_processes(self):
+        m = KanjiMeaning.objects.create(char='樹', meaning_en='tree')
+        self.assertEqual(views.get_meaning_string(['樹'], 'en'), "'樹':tree")
+        m.meaning_en = 'wood'
+        m.save()
+        self.assertEqual(views.get_meaning_string(['樹'], 'en'), "'樹':wood")
+        m.delete()
+        self.assertEqual(views.get_meaning_string(['樹'], 'en'), '')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            other = MeaningTable(os.path.join(tmp, 'version'), check_interval=0)
+            self.assertIsNone(other.get('樹', 'en'))
+            # 別プロセスが行を足して版数を上げた
+            KanjiMeaning.objects.bulk_create([KanjiMeaning(char='樹', meaning_en='tree')])
+            self.assertIsNone(other.get('樹', 'en'))
+            other.bump_version()
+            self.assertEqual(other.get('樹', 'en'), 'tree')
+
+
+KANJIDIC_SAMPLE = """<?xml version="1.0" encoding="UTF-8"?>
+<kanjidic2>
+<character><literal>樹</literal><misc><grade>6</grade></misc>
+<reading_meaning><rmgroup><reading r_type="ja_kun">き</reading>
+<meaning>timber</meaning><meaning>trees</meaning><meaning>wood</meaning><meaning>establish</meaning>
+<meaning m_lang="fr">arbre</meaning></rmgroup></reading_meaning></character>
+<character><literal>志</literal><misc><grade>5</grade></misc>
+<reading_meaning><rmgroup><meaning>intention</meaning></rmgroup></reading_meaning></character>
+<character><literal>鬱</literal><misc></misc>
+<reading_meaning><rmgroup><meaning>gloom</meaning></rmgroup></reading_meaning></character>
+</kanjidic2>
+"""
+
+
+class KanjiDictionaryImportTests(TestCase):
+    def setUp(self):
+        meaning_table.invalidate()
+
+    def write(self, name, text):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_kanjidic_import_keeps_existing_meanings(self):
+        KanjiMeaning.objects.create(char='志', meaning_en='will')
+        out = StringIO()
+        call_command('load_kanji_dictionary', self.write('kanjidic2.xml', KANJIDIC_SAMPLE), '--batch-size', '1', stdout=out)
+        self.assertIn('created 1, updated 0, skipped 1', out.getvalue())
+        self.assertEqual(KanjiMeaning.objects.get(char='樹').meaning_en, 'timber, trees, wood')
+        self.assertFalse(KanjiMeaning.objects.filter(char='鬱').exists())
+        with mock.patch('openai.ChatCompletion.create') as create:
+            self.assertEqual(views.get_meaning_string(['樹', '志'], 'en'), "'樹':timber, trees, wood, '志':will")
+            self.assertEqual(views.get_or_create_kanji_meaning('樹', 'en'), 'timber, trees, wood')
+        create.assert_not_called()
+
+    def test_json_import_fills_every_language(self):
+        KanjiMeaning.objects.create(char='樹', meaning_en='tree')
+        path = self.write('kanji.json', json.dumps({'樹': {'en': 'wood', 'ja': '木'}, '天': {'en': ['heaven', 'sky']}}))
+        call_command('load_kanji_dictionary', path, '--overwrite', stdout=StringIO())
+        m = KanjiMeaning.objects.get(char='樹')
+        self.assertEqual((m.meaning_en, m.meaning_ja), ('wood', '木'))
+        self.assertEqual(views.get_meaning_string(['天'], 'en'), "'天':heaven, sky")
+
+
+class LocalKanaTests(TestCase):
+    def test_phonetic_spellings_are_read_locally(self):
+        cases = [
+            ('Giovanni', 'it', 'じょばんに'), ('Matteo', 'it', 'まってお'), ('Алексей', 'ru', 'あれくせい'),
+            ('タロウ', 'ja', 'たろう'), ('Mary Lisa', 'en', 'めありーりさ'),
+        ]
+        for name, lang, reading in cases:
+            self.assertEqual(kana.confident_reading(name, lang), reading, name)
+
+    def test_german_and_spanish_spellings(self):
+        cases = [
+            ('Alejandro', 'es', 'あれはんどろ'), ('Lucía', 'es', 'るしあ'), ('García', 'es', 'がるしあ'),
+            ('Wolfgang', 'de', 'ぼるふがんぐ'), ('Müller', 'de', 'みゅらー'), ('Christian', 'de', 'くりすてぃあん'),
+            ('Charlotte', 'de', 'しゃるろって'),
+        ]
+        for name, lang, reading in cases:
+            self.assertEqual(kana.local_reading(name, lang)[0], reading, name)
+            # 規則を名前の一覧で確かめるまではGPTに任せる
+            self.assertIsNone(kana.confident_reading(name, lang), name)
+        self.assertIsNone(kana.confident_reading('Michelle', 'de'))
+
+    def test_unsure_readings_are_left_to_gpt(self):
+        self.assertIsNone(kana.confident_reading('Brandon', 'en'))  # 英語の綴りは規則だけでは読めない
+        self.assertIsNone(kana.confident_reading('Taro', 'ja'))     # 長音が分からない
+        self.assertEqual(kana.local_reading('太郎', 'ja'), (None, 0.0))
+        self.assertEqual(kana.local_reading('민수', 'ko'), (None, 0.0))
+
+    def test_candidates_skip_the_reading_request(self):
+        reply = gpt_response('[{"kanji": "樹志天", "reading": "じゃすてぃん", "parts": ["樹", "志", "天"]}]')
+        with mock.patch('openai.ChatCompletion.create', return_value=reply) as create, translation.override('en'):
+            candidates, cached = views.get_kanji_candidates('Justin', 3)
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(candidates[0]['kanji'], '樹志天')
+
+
+class AsyncPipelineTests(TestCase):
+    def test_ng_check_and_reading_overlap(self):
+        running, overlap = [], []
+        replies = {
+            'bad-word': 'no',
+            'ateji': '[{"kanji": "武蘭丼", "reading": "ぶらんどん", "parts": ["武", "蘭", "丼"]}]',
+            'Hiragana': 'ぶらんどん',
+        }
+
+        async def fake_achat(request):
+            prompt = request[0][0]['content'] + request[0][1]['content']
+            running.append(prompt)
+            overlap.append(len(running))
+            await asyncio.sleep(0.05)
+            running.remove(prompt)
+            return next(reply for word, reply in replies.items() if word in prompt)
+
+        meaning_table.invalidate()
+        KanjiMeaning.objects.bulk_create([KanjiMeaning(char=c, meaning_en=c) for c in '武蘭丼'])
+        request = RequestFactory().get('/ateji/', {'name': 'Brandon', 'num_candidates': 1, 'stream': 0})
+        with mock.patch('generator.views.achat', fake_achat), translation.override('en'):
+            response = async_to_sync(views.ateji_form_async)(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(max(overlap), 2)  # NGチェックと読みが同時に走った
+        self.assertEqual(len(overlap), 3)
+        self.assertContains(response, 'ぶらんどん')
+        self.assertEqual(views.lookup_reading('brandon', 'en'), 'ぶらんどん')
+
+
+class CandidateStreamTests(TestCase):
+    def setUp(self):
+        meaning_table.invalidate()
+
+    def test_objects_are_read_from_split_chunks(self):
+        text = 'Sure:\n```json\n[{"kanji": "樹{志", "reading": "\\"}"}, {"kanji": "寿天", "parts": ["寿", "天"]}]\n```'
+        for size in (1, 3, 7, len(text)):
+            parser, found = JsonArrayObjects(), []
+            for i in range(0, len(text), size):
+                found += parser.feed(text[i:i + size])
+            self.assertEqual(found, [{'kanji': '樹{志', 'reading': '"}'}, {'kanji': '寿天', 'parts': ['寿', '天']}])
+
+    def test_first_candidate_is_sent_before_the_reply_ends(self):
+        reply = '[{"kanji": "樹志天", "reading": "じゃすてぃん", "parts": ["樹", "志", "天"]}, {"kanji": "寿天", "reading": "じゃすてぃん"}]'
+        sent = []
+
+        def chunks():
+            for i in range(0, len(reply), 10):
+                sent.append(i)
+                delta = SimpleNamespace(content=reply[i:i + 10])
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+        KanjiMeaning.objects.bulk_create([KanjiMeaning(char=c, meaning_en=c) for c in '樹志天寿'])
+        request = RequestFactory().get('/ateji/stream/', {'name': 'Justin', 'num_candidates': 2, 'mode': 'tate'})
+        client = mock.Mock()
+        client.chat.completions.create.return_value = chunks()
+        with mock.patch('openai.ChatCompletion.create', return_value=gpt_response('no')), \
+                mock.patch('generator.gpt_async.client', return_value=client), translation.override('en'):
+            response = views.ateji_stream(request)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            events = iter(response.streaming_content)
+            first = next(events).decode()
+            self.assertLess(len(sent), len(reply) // 10)  # 応答の途中で1件目を送った
+            rest = b''.join(events).decode()
+        self.assertTrue(client.chat.completions.create.call_args.kwargs['stream'])
+        self.assertTrue(first.startswith('event: candidate\n'))
+        data = json.loads(first.split('data: ', 1)[1])
+        self.assertEqual((data['index'], data['kanji'], data['meaning']), (0, '樹志天', "'樹':樹, '志':志, '天':天"))
+        self.assertIn('kanji=%E6%A8%B9%E5%BF%97%E5%A4%A9&mode=tate', data['image_url'])
+        self.assertIn('"parts": ["寿", "天"]', rest)
+        self.assertTrue(rest.endswith('event: done\ndata: {"cached": false}\n\n'))
+        candidates, cached = views.get_kanji_candidates('Justin', 2)
+        self.assertEqual([c['kanji'] for c in candidates], ['樹志天', '寿天'])
+
+    def test_empty_generation_is_not_stored(self):
+        client = mock.Mock()
+        client.chat.completions.create.return_value = iter([
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="Sorry, I can't help."))]),
+        ])
+        request = RequestFactory().get('/ateji/stream/', {'name': 'Justin'})
+        with mock.patch('openai.ChatCompletion.create', return_value=gpt_response('no')), \
+                mock.patch('generator.gpt_async.client', return_value=client), translation.override('en'):
+            events = b''.join(views.ateji_stream(request).streaming_content).decode()
+        self.assertTrue(events.startswith('event: error\n'))
+        self.assertNotIn('event: done', events)
+        self.assertFalse(KanjiAteji.objects.filter(name='Justin').exists())
+
+    def test_form_returns_the_page_without_waiting_for_gpt(self):
+        request = RequestFactory().get('/ateji/', {'name': 'Justin'})
+        with mock.patch('openai.ChatCompletion.create') as create, translation.override('en'):
+            response = views.ateji_form(request)
+        create.assert_not_called()
+        self.assertContains(response, 'data-stream-url="/en/ateji/stream/?name=Justin&amp;num_candidates=3')
+
+    def test_stored_names_are_rendered_with_the_sprite(self):
+        KanjiMeaning.objects.bulk_create([KanjiMeaning(char=c, meaning_en=c) for c in '樹志天'])
+        KanjiAteji.objects.create(name='Justin', kanji_candidates_json=json.dumps(
+            [{'kanji': '樹志天', 'reading': 'じゃすてぃん', 'parts': ['樹', '志', '天']}], ensure_ascii=False,
+        ))
+        request = RequestFactory().get('/ateji/', {'name': 'Justin'})
+        with mock.patch('openai.ChatCompletion.create', return_value=gpt_response('no')), translation.override('en'):
+            response = views.ateji_form(request)
+        self.assertNotContains(response, 'data-stream-url')
+        self.assertContains(response, reverse('kanji_sprite'))
+        self.assertContains(response, '(Loaded from database)')
+
+    def test_async_stream_sends_the_same_events(self):
+        reply = '[{"kanji": "武蘭丼", "reading": "ぶらんどん", "parts": ["武", "蘭", "丼"]}]'
+
+        async def fake_achat(request):
+            return 'ぶらんどん' if 'Hiragana' in request[0][1]['content'] else 'no'
+
+        async def fake_stream(request):
+            for i in range(0, len(reply), 5):
+                yield reply[i:i + 5]
+
+        async def read(response):
+            return [event async for event in response.streaming_content]
+
+        KanjiMeaning.objects.bulk_create([KanjiMeaning(char=c, meaning_en=c) for c in '武蘭丼'])
+        request = RequestFactory().get('/ateji/stream/', {'name': 'Brandon'})
+        with mock.patch('generator.views.achat', fake_achat), mock.patch('generator.views.achat_stream', fake_stream), \
+                translation.override('en'):
+            response = async_to_sync(views.ateji_stream_async)(request)
+            events = [e.decode().split('\n', 1)[0] for e in async_to_sync(read)(response)]
+        self.assertEqual(events, ['event: candidate', 'event: meanings', 'event: done'])
+        self.assertEqual(views.get_meaning_string(['武'], 'en'), "'武':武")
+        self.assertTrue(KanjiAteji.objects.filter(name='Brandon').exists())
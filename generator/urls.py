@@ -4,11 +4,19 @@ from . import views
 
 urlpatterns = [
     path('', views.home, name='home'),  # トップ
-    path('ateji/', views.ateji_form, name='ateji_form'),
-    path('kanji_image/', views.kanji_image, name='kanji_image'),
+    path('ateji/', views.ateji_page, name='ateji_form'),
+    path('ateji/stream/', views.ateji_stream_page, name='ateji_stream'),
+    path('kanji_image/', views.kanji_image, name='kanji_image_api'),  # 言語プレフィックスなし（言語切替でも同じURL→ブラウザキャッシュが効く）
+    path('kanji_sprite/', views.kanji_sprite, name='kanji_sprite'),
+    path('barcode/<slug:code>.<slug:image_format>', views.barcode_image, name='barcode_image'),
     path('confirm_tshirt/', views.confirm_tshirt, name='confirm_tshirt'),
     path('tshirt_order/', views.tshirt_order, name='tshirt_order'),
     path('store/', views.store_dashboard, name='store_dashboard'),
     path('store/admin_tshirt_settings/', views.admin_tshirt_settings, name='admin_tshirt_settings'),
     path('store/print_preview/', views.print_preview, name='print_preview'),
+    path('store/print_preview/<slug:preview_id>.png', views.print_preview_image, name='print_preview_image'),
+    path('store/print_jobs/', views.print_jobs, name='print_jobs'),
+    path('store/print_batch/', views.print_batch, name='print_batch'),
+    path('store/print_jobs/<int:job_id>/', views.print_job_status, name='print_job_status'),
+    path('store/print_jobs/<int:job_id>/printed/', views.print_job_printed, name='print_job_printed'),
     ]
@@ -1,28 +1,53 @@
 from django.shortcuts import render, redirect
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from .models import PronounceName, KanjiAteji, KanjiMeaning, Order, TshirtSetting, BadWord
 from PIL import Image, ImageFont, ImageDraw
-from django.http import HttpResponse
-from urllib.parse import unquote
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from urllib.parse import unquote, urlencode
 from io import BytesIO
 import os
 import openai
 import json
 import re
-import qrcode
-import base64
-import barcode
-import math
-from barcode.writer import ImageWriter
+import tempfile
+import asyncio
+from asgiref.sync import sync_to_async
+from barcode.errors import BarcodeError
 from django.http import JsonResponse
 from .models import PrintJob
+from django.utils import translation
 from django.utils.translation import get_language, gettext as _
 import ast
 from django.contrib.auth.decorators import login_required
 from kanji_name.settings import OPENAI_API_KEY
 from django.utils.decorators import method_decorator
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_http_methods, condition
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils import timezone
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from django.core.exceptions import ValidationError
+from functools import wraps
 from kanji_name import settings
+from .fonts import (
+    FONT_CHOICES, FONT_PATHS, DEFAULT_FONT_PATH, get_font, glyph_bbox,
+    get_font_size_for_text, get_best_font_size, get_best_font_size_tate,
+)
+from .rendering import (
+    IMAGE_FORMATS, PREVIEW_SIZE, PRINT_IMAGE_FORMATS, SMALL_KANA, normalize_preview_params,
+    supported_image_formats,
+)
+from .render_cache import kanji_image_cache, kanji_sprite_cache, print_sheet_cache
+from .render_service import RenderUnavailable
+from .print_queue import enqueue_print_job
+from .singleflight import async_single_flight, single_flight
+from .gpt_async import achat, achat_stream, chat_stream
+from .json_stream import JsonArrayObjects
+from .kana import confident_reading
+from .meaning_cache import meaning_table
+from .barcodes import BARCODE_FORMATS, barcode_image as render_barcode_image, barcode_key, invalidate_barcode, qr_svg
+from .print_batch import BATCH_WRITERS, BatchTooLarge, mark_printed, render_batch, unprinted_orders
 
 
 
@@ -38,40 +63,47 @@ For each ateji, provide:
 Format your response as the following JSON array:
 
 [
-  {"kanji": "kanji string", "reading": "hiragana reading", "parts": ["kanji1", "kanji2", ...]},
+  {{"kanji": "kanji string", "reading": "hiragana reading", "parts": ["kanji1", "kanji2", ...]}},
   ...
 ]
 
 Example (for the name 'justin'):
 [
-  {"kanji": "じゃすてぃん", "reading": "じゃすてぃん", "parts": ["じゃすてぃん"]},
-  {"kanji": "ジャスティン", "reading": "じゃすてぃん", "parts": ["ジャスティン"]},
-  {"kanji": "樹志天", "reading": "じゃすてぃん", "parts": ["樹", "志", "天"]},
+  {{"kanji": "じゃすてぃん", "reading": "じゃすてぃん", "parts": ["じゃすてぃん"]}},
+  {{"kanji": "ジャスティン", "reading": "じゃすてぃん", "parts": ["ジャスティン"]}},
+  {{"kanji": "樹志天", "reading": "じゃすてぃん", "parts": ["樹", "志", "天"]}},
   ...
 ]
 """
 
-FONT_CHOICES = {
-    "ZenOldMincho": "ZenOldMincho-Black.ttf",                 # Google Fonts例
-    "Kouzan": "衡山毛筆フォント.ttf",                          # 例：Kouzan font
-    "YujiMai": "YujiMai-Regular.ttf",                    # Google Fonts例
-}
-
 FONT_DISPLAY_NAMES = {
     "ZenOldMincho": "1",
     "Kouzan": "2",
     "YujiMai": "3",
 }
 
-FONT_PATHS = {
-    "Kouzan": "static/fonts/Kouzan.ttf",
-    "ZenOldMincho": "static/fonts/ZenOldMincho-Black.ttf",
-    "YujiMai": "static/fonts/YujiMai-Regular.ttf",
-}
+DEFAULT_PRICE = 5500
 
-DEFAULT_FONT_PATH = "static/fonts/ZenOldMincho-Black.ttf"
+# 候補カードのプレビュー画像はブラウザ/プロキシに長期キャッシュさせる（期限後もETagで再検証）
+KANJI_IMAGE_MAX_AGE = getattr(settings, 'KANJI_IMAGE_MAX_AGE', 60 * 60 * 24 * 30)
 
-DEFAULT_PRICE = 5500
+# 漢字の意味を初めて取得するとき、settings.LANGUAGES の全言語分をまとめて取得・保存する
+KANJI_MEANING_ALL_LANGUAGES = getattr(settings, 'KANJI_MEANING_ALL_LANGUAGES', True)
+# 意味のまとめての問い合わせ：1文字・1言語あたりの応答トークン数と、1回の応答の上限（gpt-3.5-turbo）
+MEANING_TOKENS_PER_ANSWER = 24
+GPT_MAX_COMPLETION_TOKENS = 4096
+
+# 名前入力ページでGPTへの問い合わせを非同期（同時実行）で行うか。ASGIで動かすときに有効にする
+ASYNC_GPT_PIPELINE = getattr(settings, 'ASYNC_GPT_PIPELINE', False)
+
+# 名前入力ページは先に枠だけ返し、候補はGPTが1件書き終えるごとにSSEで送る（?stream=0 で従来どおり）
+ATEJI_STREAM_CANDIDATES = getattr(settings, 'ATEJI_STREAM_CANDIDATES', True)
+
+# 1枚のスプライトにまとめる候補数の上限
+KANJI_SPRITE_MAX = 10
+
+# 店舗ダッシュボードに出す印刷ジョブの件数
+PRINT_JOBS_LIMIT = 50
 
 DEFAULT_JAN_CODE = "4901234567894"
 
@@ -120,46 +152,65 @@ kana_type_dict = {
     }
 }
 
-def is_ng_word_ai_gpt(name):
+# GPTへの問い合わせは (messages, max_tokens, temperature) を組み立てる関数と、応答を読む関数に分け、
+# 同期版（WSGI）と非同期版（ASGI）で共有する
+def ng_check_request(name):
     prompt = (
         f"Is the word/term '{name}' an inappropriate or offensive word in any language? "
         "Answer only yes or no. If yes, specify language and type (e.g., profanity, slur, insult, sexual, etc)."
     )
+    messages = [
+        {"role": "system", "content": "You are an AI bad-word/profanity filter and language expert."},
+        {"role": "user", "content": prompt},
+    ]
+    return messages, 20, 0
+
+def parse_ng_answer(answer):
+    answer = answer.lower()
+    if "yes" in answer:
+        return True, answer
+    else:
+        return False, ""
+
+def is_ng_word_ai_gpt(name):
+    messages, max_tokens, temperature = ng_check_request(name)
     try:
         response = openai.ChatCompletion.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an AI bad-word/profanity filter and language expert."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=20,
-            temperature=0
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
         )
-        answer = response['choices'][0]['message']['content'].lower()
-        if "yes" in answer:
-            return True, answer
-        else:
-            return False, ""
+        return parse_ng_answer(response['choices'][0]['message']['content'])
     except Exception as e:
         return False, ""
 
+def record_ng_word(name, reason):
+    BadWord.objects.create(word=name.lower(), source=f"gpt:{reason[:30]}")
+
 def smart_ng_check(name):
     if BadWord.objects.filter(word=name.lower()).exists():
         return True, "local"
     # AI・externalチェック
     is_bad, reason = is_ng_word_ai_gpt(name)
     if is_bad:
-        BadWord.objects.create(word=name.lower(), source=f"gpt:{reason[:30]}")
+        record_ng_word(name, reason)
         return True, "ai"
     # ローカル/外部リストの組み合わせで学習的に純化できる
     return False, ""
 
 def validate_name(name):
+    return name_error(name, smart_ng_check(name)[0])
+
+def name_rule_error(name):
+    # NGワード以外（文字数・文字種）のチェック。GPTを使わない
+    return name_error(name, False)
+
+def name_error(name, is_ng):
     lang = get_language().replace('_','-').lower()
     lang = lang if lang in LANG_CHAR_RULES else 'en'
 
     # 1. NGワードチェック
-    is_ng = smart_ng_check(name)[0]
     if is_ng:
         return True, _("The entered name contains an inappropriate word and cannot be used.")
 
@@ -205,78 +256,128 @@ LANG2LABEL = {
     'th': 'Thai',
 }
 
-def get_kana_from_name_by_gpt(name, lang):
+def kana_request(name, lang):
     lang_label = LANG2LABEL.get(lang, lang)
     prompt = (
         f"Convert the name '{name}' to Japanese Hiragana, focusing on how a native {lang_label} speaker would pronounce it. "
         "Respond ONLY with the Japanese Hiragana (do not add any extra text)."
     )
+    messages = [
+        {"role": "system", "content": "You are a Japanese linguist and name conversion expert."},
+        {"role": "user", "content": prompt},
+    ]
+    return messages, 30, 0
+
+def get_kana_from_name_by_gpt(name, lang):
+    messages, max_tokens, temperature = kana_request(name, lang)
     response = openai.ChatCompletion.create(
         model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a Japanese linguist and name conversion expert."},
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=30,
-        temperature=0
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature
     )
     kana = response['choices'][0]['message']['content']
     kana = kana.strip().replace(' ', '')
     return kana
 
+def reading_field(lang):
+    return f'reading_{lang.replace("-","_")}'
+
+def lookup_reading(name, lang):
+    pron = PronounceName.objects.filter(name__iexact=name).first()
+    return getattr(pron, reading_field(lang), None) if pron else None
+
+def store_reading(name, lang, reading_kana):
+    field = reading_field(lang)
+    pron, created = PronounceName.objects.get_or_create(name__iexact=name, defaults={'name': name})
+    setattr(pron, field, reading_kana)
+    pron.save(update_fields=[field])
+    return reading_kana
+
+def candidates_request(name, num_candidates):
+    messages = [
+        {"role": "system", "content": "You are a naming assistant with extensive knowledge of the Japanese language."},
+        {"role": "user", "content": PROMPT_TMPL.format(name=name, count=num_candidates)},
+    ]
+    return messages, 1024, 0.7
+
+def parse_candidates(gpt_text):
+    try:
+        candidates = json.loads(gpt_text)
+    except Exception:
+        import re
+        match = re.search(r'\[.*\]', gpt_text, re.DOTALL)
+        if match:
+            candidates = json.loads(match.group(0))
+        else:
+            candidates = []
+    # ---- ここから補正処理 ----
+    for c in candidates:
+        complete_candidate(c)
+    return candidates
+
+def complete_candidate(c):
+    if "parts" not in c:
+        if all('\u3040' <= ch <= '\u309f' or ch in 'ー' for ch in c.get("kanji", "")):
+            # ひらがなonlyの場合
+            c["parts"] = [c.get("kanji", "")]
+        elif all('\u30a0' <= ch <= '\u30ff' or ch in 'ー' for ch in c.get("kanji", "")):
+            # カタカナonlyの場合
+            c["parts"] = [c.get("kanji", "")]
+        else:
+            # 漢字（やそれ以外）なら1文字ずつ分割
+            c["parts"] = list(c.get("kanji", ""))
+    return c
+
+def lookup_candidates(name, reading_kana):
+    return KanjiAteji.objects.filter(Q(name__iexact=reading_kana) | Q(name__iexact=name)).first()
+
+def store_candidates(name, candidates):
+    # 他のプロセスが先に保存していたらそちらを使う（name は unique）
+    db_entry, created = KanjiAteji.objects.get_or_create(
+        name=name,
+        defaults={'kanji_candidates_json': json.dumps(candidates, ensure_ascii=False)},
+    )
+    db_entry.fetched = created
+    return db_entry
+
+def candidates_result(db_entry):
+    candidates = json.loads(db_entry.kanji_candidates_json)
+    cached = not getattr(db_entry, 'fetched', False)
+    return candidates, cached
+
+def get_reading(name, lang):
+    def fetch_reading():
+        # ChatGPTで生成
+        return store_reading(name, lang, get_kana_from_name_by_gpt(name, lang))
+
+    # 保存済みの読み（管理画面で直したものを含む）→ ローカルの変換 → GPT の順
+    # ローカルの変換は速いので保存しない（規則を直せばすぐ反映される）
+    reading_kana = lookup_reading(name, lang) or confident_reading(name, lang)
+    if not reading_kana:
+        # 同じ名前が同時に入力されてもGPTへの問い合わせは1回だけ
+        reading_kana = single_flight(('reading', name.lower(), lang), lambda: lookup_reading(name, lang), fetch_reading)
+    return reading_kana
+
 def get_kanji_candidates(name, num_candidates):
     lang = get_language().replace('_', '-').lower()
-    field = f'reading_{lang.replace("-","_")}'
-    pron, created = PronounceName.objects.get_or_create(name__iexact=name)
-    reading_kana = getattr(pron, field, None)
-    if not reading_kana:
-        # ChatGPTで生成
-        reading_kana = get_kana_from_name_by_gpt(name, lang)
-        setattr(pron, field, reading_kana)
-        pron.save(update_fields=[field])
-    db_entry = KanjiAteji.objects.filter(name__iexact=reading_kana).first()
-    if db_entry:
-        candidates = json.loads(db_entry.kanji_candidates_json)
-        cached = True
-    else:
-        prompt = PROMPT_TMPL.format(name=name, count=num_candidates)
+    reading_kana = get_reading(name, lang)
+
+    def fetch_candidates():
+        messages, max_tokens, temperature = candidates_request(name, num_candidates)
         response = openai.ChatCompletion.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a naming assistant with extensive knowledge of the Japanese language."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=1024,
-            temperature=0.7
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
         )
         gpt_text = response['choices'][0]['message']['content']
-        try:
-            candidates = json.loads(gpt_text)
-        except Exception:
-            import re
-            match = re.search(r'\[.*\]', gpt_text, re.DOTALL)
-            if match:
-                candidates = json.loads(match.group(0))
-            else:
-                candidates = []
-        # ---- ここから補正処理 ----
-        for c in candidates:
-            if "parts" not in c:
-                if all('\u3040' <= ch <= '\u309f' or ch in 'ー' for ch in c.get("kanji", "")):
-                    # ひらがなonlyの場合
-                    c["parts"] = [c.get("kanji", "")]
-                elif all('\u30a0' <= ch <= '\u30ff' or ch in 'ー' for ch in c.get("kanji", "")):
-                    # カタカナonlyの場合
-                    c["parts"] = [c.get("kanji", "")]
-                else:
-                    # 漢字（やそれ以外）なら1文字ずつ分割
-                    c["parts"] = list(c.get("kanji", ""))
-        KanjiAteji.objects.create(
-            name=name,
-            kanji_candidates_json=json.dumps(candidates, ensure_ascii=False)
-        )
-        cached = False
-    return candidates, cached
+        return store_candidates(name, parse_candidates(gpt_text))
+
+    db_entry = single_flight(
+        ('kanji_candidates', name.lower()), lambda: lookup_candidates(name, reading_kana), fetch_candidates,
+    )
+    return candidates_result(db_entry)
 
 
 def kana_type_check(char):
@@ -287,24 +388,47 @@ def kana_type_check(char):
         return "KATAKANA"
     return None
 
+def meaning_languages(lang):
+    # 1回の問い合わせで取得する言語（KANJI_MEANING_ALL_LANGUAGES なら有効な全言語）
+    if not KANJI_MEANING_ALL_LANGUAGES:
+        return [lang]
+    langs = [code for code, label in settings.LANGUAGES]
+    return langs if lang in langs else [lang] + langs
+
 def get_or_create_kanji_meaning(char, lang):
     kana_type = kana_type_check(char)
     if kana_type:
         # ひらがな or カタカナならローカライズラベルを返す
         return kana_type_dict[kana_type].get(lang, kana_type)    # lang→言語コード文字列（例："en"）
+    # 保存済みならメモリ上の辞書から返す（DBにもGPTにも行かない）
+    meaning = meaning_table.get(char, lang)
+    if meaning:
+        return meaning
     field = f"meaning_{lang.replace('-', '_')}"
-    try:
-        m = KanjiMeaning.objects.get(char=char)
-        value = getattr(m, field, "")
-        if value:
-            return value
-    except KanjiMeaning.DoesNotExist:
-        m = KanjiMeaning.objects.create(char=char)
-    # なければChatGPTで取得
-    gpt_meaning = ask_gpt_meaning(char, lang)
-    setattr(m, field, gpt_meaning)
-    m.save()
-    return gpt_meaning
+
+    def lookup():
+        # 他のプロセスが保存した直後は辞書がまだ古いことがあるのでDBを見る
+        m = KanjiMeaning.objects.filter(char=char).first()
+        return getattr(m, field, "") if m else ""
+
+    def fetch():
+        # なければChatGPTで取得（全言語モードなら、まだない他の言語の意味も一緒に取る）
+        m, created = KanjiMeaning.objects.get_or_create(char=char)
+        langs = [
+            code for code in meaning_languages(lang)
+            if code == lang or not getattr(m, f"meaning_{code.replace('-', '_')}", "")
+        ]
+        meanings = ask_gpt_meanings([char], langs).get(char, {}) if len(langs) > 1 else {}
+        if not meanings.get(lang):
+            meanings[lang] = ask_gpt_meaning(char, lang)
+        fields = []
+        for code, meaning in meanings.items():
+            fields.append(f"meaning_{code.replace('-', '_')}")
+            setattr(m, fields[-1], meaning)
+        m.save(update_fields=fields)  # 取得した言語だけ保存し、他の列は上書きしない
+        return meanings[lang]
+
+    return single_flight(('meaning', char, lang), lookup, fetch)
 
 def ask_gpt_meaning(char, lang):
     lang_labels = {
@@ -334,6 +458,102 @@ def ask_gpt_meaning(char, lang):
     answer = response['choices'][0]['message']['content'].strip()
     return answer
 
+def ask_gpt_meanings(chars, langs):
+    # 複数の漢字・言語の意味をまとめて取得 → {漢字: {言語コード: 意味}}
+    # 応答が上限を超えると毎回断られるので、上限に収まる文字数ずつに分けて問い合わせる
+    per_request = max(1, (GPT_MAX_COMPLETION_TOKENS - 16) // (MEANING_TOKENS_PER_ANSWER * len(langs)))
+    meanings = {}
+    for i in range(0, len(chars), per_request):
+        meanings.update(ask_gpt_meanings_batch(chars[i:i + per_request], langs))
+    return meanings
+
+def ask_gpt_meanings_batch(chars, langs):
+    labels = {code: LANG2LABEL.get(code, code) for code in langs}
+    system = "You are a professional Japanese kanji dictionary. Answer only with a JSON object."
+    prompt = (
+        f"Give a short, simple meaning for each of these Japanese characters: {json.dumps(chars, ensure_ascii=False)}, "
+        f"in each of these languages: {json.dumps(labels)}. "
+        "Respond ONLY with a JSON object mapping each character to an object of language code to meaning, "
+        'e.g. {"樹": {"en": "tree", "ja": "木"}}.'
+    )
+    response = openai.ChatCompletion.create(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt},
+        ],
+        max_tokens=min(MEANING_TOKENS_PER_ANSWER * len(chars) * len(langs) + 16, GPT_MAX_COMPLETION_TOKENS),
+        temperature=0
+    )
+    text = response['choices'][0]['message']['content']
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    try:
+        answer = json.loads(match.group(0)) if match else {}
+    except ValueError:
+        answer = {}
+    if not isinstance(answer, dict):
+        return {}
+    # 頼んでいない文字・言語や空の答えは捨てる（足りない分は1文字ずつの問い合わせに回る）
+    meanings = {}
+    for char in chars:
+        values = answer.get(char)
+        if not isinstance(values, dict):
+            continue
+        found = {code: str(values[code]).strip()[:255] for code in langs if values.get(code)}
+        found = {code: meaning for code, meaning in found.items() if meaning}
+        if found:
+            meanings[char] = found
+    return meanings
+
+def save_kanji_meanings(meanings):
+    # {漢字: {言語コード: 意味}} を一括で保存（すでに入っている意味は管理画面での修正かもしれないので上書きしない）
+    KanjiMeaning.objects.bulk_create([KanjiMeaning(char=char) for char in meanings], ignore_conflicts=True)
+    rows = list(KanjiMeaning.objects.filter(char__in=list(meanings)))
+    fields = set()
+    for m in rows:
+        for code, meaning in meanings[m.char].items():
+            field = f"meaning_{code.replace('-', '_')}"
+            if not getattr(m, field, ""):
+                setattr(m, field, meaning)
+                fields.add(field)
+    if fields:
+        KanjiMeaning.objects.bulk_update(rows, sorted(fields))
+    meaning_table.invalidate()  # bulk_* はシグナルを送らないので自分で知らせる
+
+def prefetch_kanji_meanings(parts, lang):
+    """ページに出る漢字のうち、まだ意味がないものを1回の問い合わせで取得して保存する
+
+    テンプレートを描画する前に呼んでおけば、meaning_from_parts は保存済みの意味を読むだけになる。
+    """
+    chars = list(dict.fromkeys(p for p in parts if p and not kana_type_check(p)))
+    if not chars:
+        return []
+
+    def missing_chars():
+        stored = stored_kanji_meanings(chars, lang)
+        return [char for char in chars if not stored.get(char)]
+
+    missing = missing_chars()
+    if not missing:
+        return []
+
+    def fetch():
+        meanings = ask_gpt_meanings(missing, meaning_languages(lang))
+        if meanings:
+            save_kanji_meanings(meanings)
+        return missing
+
+    def lookup():
+        return missing if not missing_chars() else None
+
+    try:
+        # 同じ組み合わせのページが同時に開かれても問い合わせは1回
+        single_flight(('meanings', missing, lang), lookup, fetch)
+    except Exception:
+        # まとめての取得に失敗しても、ページは1文字ずつの取得で表示できる
+        pass
+    return missing
+
 """
 def get_meaning_dict(parts):
     # partsリストから全LANGUAGES分 meaning 辞書を組み立て
@@ -355,207 +575,478 @@ def get_meaning_dict(parts):
     return meaning_dict
 """
 
+def page_meaning_string(parts, lang):
+    # 候補カードに出す「'樹':tree, ...」。保存済みの意味はまとめて読み、ない漢字だけ1文字ずつ取得する
+    stored = stored_kanji_meanings(parts, lang)
+    meaning_list = []
+    for part in parts:
+        value = None if kana_type_check(part) else stored.get(part)
+        value = value or get_or_create_kanji_meaning(part, lang)
+        if value:
+            meaning_list.append(f"'{part}':{value}")
+    return ', '.join(meaning_list)
+
+def stored_kanji_meanings(parts, lang):
+    # parts の保存済みの意味をメモリ上の辞書から取得 → {文字: 意味}（行がない文字は含まない）
+    meanings = {part: meaning_table.get(part, lang) for part in set(parts)}
+    return {part: meaning for part, meaning in meanings.items() if meaning is not None}
+
 def get_meaning_string(parts, lang=None):
     if lang is None:
         lang = get_language().replace('_', '-').lower()
+    stored = stored_kanji_meanings(parts, lang)
     meanings = []
     for part in parts:
-        try:
-            mobj = KanjiMeaning.objects.get(char=part)
-            field = f"meaning_{lang.replace('-', '_')}"
-            meaning = getattr(mobj, field, "")
-            if meaning:
-                meanings.append(f"'{part}':{meaning}")
-        except KanjiMeaning.DoesNotExist:
-            kana_type = kana_type_check(part)
-            if kana_type:
-                meanings.append(f"'{part}':{kana_type}")
+        if part in stored:
+            if stored[part]:
+                meanings.append(f"'{part}':{stored[part]}")
             continue
+        kana_type = kana_type_check(part)
+        if kana_type:
+            meanings.append(f"'{part}':{kana_type}")
     return ', '.join(meanings)
 
-@require_http_methods(["GET", "POST"])
-def ateji_form(request):
+def ateji_form_params(request):
+    # (POSTならリダイレクト先, name, num_candidates, mode, font)
     if request.method == 'POST':
         name = request.POST.get('name', '').strip()
         num_candidates = request.POST.get('num_candidates', '3')
         mode = request.POST.get('mode', 'yoko')
         font = request.POST.get("font", "ZenOldMincho")
-        return redirect(f"{request.path}?name={name}&num_candidates={num_candidates}&mode={mode}&font={font}")
-    else:
-        name = request.GET.get('name', '').strip()
-        num_candidates = request.GET.get('num_candidates', '3')
-        mode = request.GET.get('mode', 'yoko')
-        font = request.GET.get("font", "ZenOldMincho")
+        return f"{request.path}?name={name}&num_candidates={num_candidates}&mode={mode}&font={font}", name, num_candidates, mode, font
+    name = request.GET.get('name', '').strip()
+    num_candidates = request.GET.get('num_candidates', '3')
+    mode = request.GET.get('mode', 'yoko')
+    font = request.GET.get("font", "ZenOldMincho")
     try:
         num_candidates = int(num_candidates) if num_candidates else 3
     except ValueError:
         num_candidates = 3
-    error = None
-    candidates = []
-    cached = False
-    if name:
-        if validate_name(name)[0]:
-            error = validate_name(name)[1]
-        else:
-            try:
-                candidates, cached = get_kanji_candidates(name, num_candidates)
-            except Exception as e:
-                error = f'ERROR: {str(e)}'
-    elif request.method == "POST":
-        error = '名前を入力してください。'
-    context = {
+    return None, name, num_candidates, mode, font
+
+def ateji_form_context(name, num_candidates, mode, font, candidates, cached, error):
+    sprite_url = None
+    if candidates:
+        # 候補画像は1枚のスプライトで取得し、各カードは object-position で自分のタイルを表示
+        # （上限を超えた分は従来どおり1枚ずつ）
+        # kanji が空の候補は kanji_sprite_params と同じく除く（タイルの位置がずれないように）
+        in_sprite = [c for c in candidates if c.get('kanji')][:KANJI_SPRITE_MAX]
+        sprite_url = kanji_sprite_url([c.get('kanji', '') for c in in_sprite], mode, font)
+        for i, c in enumerate(in_sprite):
+            c['sprite_position'] = f"{100 * i / (len(in_sprite) - 1):.4f}" if len(in_sprite) > 1 else "0"
+        # 各候補の部品の意味は描画前にまとめて取得（テンプレートタグからの問い合わせを1回にする）
+        prefetch_kanji_meanings(
+            [part for c in candidates for part in c.get('parts', [])],
+            get_language().replace('_', '-').lower(),
+        )
+    return {
         'name': name,
         'num_candidates': num_candidates,
         'mode': mode,
         'font': font,
         'FONT_DISPLAY_NAMES': FONT_DISPLAY_NAMES,
         'candidates': candidates,
+        'sprite_url': sprite_url,
         'cached': cached,
         'error': error,
         'on_top_page': False,
     }
+
+def streams_candidates(request, name):
+    return bool(name) and ATEJI_STREAM_CANDIDATES and request.GET.get('stream') != '0'
+
+def has_stored_candidates(name, lang):
+    # GPTに聞かずに分かる読みで保存済みの候補を探す。あればストリーミングせず、
+    # ページ全体をスプライト画像付きで返す（カードごとの画像リクエストを増やさない）
+    reading_kana = lookup_reading(name, lang) or confident_reading(name, lang) or name
+    return lookup_candidates(name, reading_kana) is not None
+
+def ateji_stream_context(request, name, num_candidates, mode, font):
+    # GPTを待たずに返す枠だけのページ。候補はページのJSが stream_url から受け取って並べる
+    params = {'name': name, 'num_candidates': num_candidates, 'mode': mode, 'font': font}
+    context = ateji_form_context(name, num_candidates, mode, font, [], False, None)
+    context['stream_url'] = f"{reverse('ateji_stream')}?{urlencode(params)}"
+    # JSが使えないときのリンク（従来どおりページ全体を待って表示）
+    context['no_stream_url'] = f"{request.path}?{urlencode(dict(params, stream=0))}"
+    return context
+
+def render_ateji_form(request, context):
     response = render(request, "generator/ateji_form.html", context)
     response['X-Robots-Tag'] = 'noindex, nofollow'
     return response
 
+@require_http_methods(["GET", "POST"])
+def ateji_form(request):
+    redirect_to, name, num_candidates, mode, font = ateji_form_params(request)
+    if redirect_to:
+        return redirect(redirect_to)
+    lang = get_language().replace('_', '-').lower()
+    if streams_candidates(request, name) and not has_stored_candidates(name, lang):
+        return render_ateji_form(request, ateji_stream_context(request, name, num_candidates, mode, font))
+    error = None
+    candidates = []
+    cached = False
+    if name:
+        invalid, message = validate_name(name)
+        if invalid:
+            error = message
+        else:
+            try:
+                candidates, cached = get_kanji_candidates(name, num_candidates)
+            except Exception as e:
+                error = f'ERROR: {str(e)}'
+    context = ateji_form_context(name, num_candidates, mode, font, candidates, cached, error)
+    return render_ateji_form(request, context)
 
-SMALL_KANA = (
-    'ぁぃぅぇぉっゃゅょゎゕゖゝゞゟ'
-    'ァィゥェォッャュョヮヵヶヽヾヿ'
-)
 
-def get_font_size_for_text(text, font_path, max_width, max_height, min_font_size=16, max_font_size=120, vertical=False):
-    from PIL import Image, ImageDraw, ImageFont
-
-    test_img = Image.new("RGB", (max_width, max_height))
-    draw = ImageDraw.Draw(test_img)
-    best_size = min_font_size
-    left, right = min_font_size, max_font_size
-    while left <= right:
-        mid = (left + right) // 2
-        font = ImageFont.truetype(font_path, mid)
-        if not vertical:
-            try:
-                bbox = draw.textbbox((0, 0), text, font=font)
-                w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
-            except Exception:
-                w, h = draw.textsize(text, font=font)
-        else:
-            ws, hs = [], []
-            for ch in text:
-                if ch in ['ー', 'ｰ', '-']:
-                    tmp_img = Image.new("RGBA", (max_width, max_height), (255,0,0,0))
-                    tmp_draw = ImageDraw.Draw(tmp_img)
-                    tmp_draw.text((0,0), ch, font=font, fill="black")
-                    try:
-                        bbox = tmp_draw.textbbox((0,0), ch, font=font)
-                        w = bbox[3] - bbox[1]
-                        h = bbox[2] - bbox[0]
-                    except Exception:
-                        w, h = draw.textsize(ch, font=font)
-                        w, h = h, w
-                    ws.append(w)
-                    hs.append(h)
-                else:
-                    try:
-                        bbox = draw.textbbox((0,0), ch, font=font)
-                        ws.append(bbox[2] - bbox[0])
-                        hs.append(bbox[3] - bbox[1])
-                    except Exception:
-                        w_, h_ = draw.textsize(ch, font=font)
-                        ws.append(w_)
-                        hs.append(h_)
-            w = max(ws)
-            h = sum(hs)
-        if w <= max_width and h <= max_height:
-            best_size = mid
-            left = mid + 1
-        else:
-            right = mid - 1
-    return best_size
+async def async_smart_ng_check(name):
+    # smart_ng_check の非同期版
+    if await BadWord.objects.filter(word=name.lower()).aexists():
+        return True, "local"
+    try:
+        is_bad, reason = parse_ng_answer(await achat(ng_check_request(name)))
+    except Exception as e:
+        return False, ""
+    if is_bad:
+        await sync_to_async(record_ng_word)(name, reason)
+        return True, "ai"
+    return False, ""
 
-def kanji_image(request):
-    kanji = unquote(request.GET.get('kanji', '漢字'))
-    width, height = 300, 300
-    mode = request.GET.get('mode', 'yoko')
-    font_code = request.GET.get('font', 'ZenOldMincho')
-    bg_path = os.path.join('static', 'images', 'fashion_tshirt1_white.png')
-    font_file = FONT_CHOICES.get(font_code, FONT_CHOICES["ZenOldMincho"])
-    font_path = os.path.join(settings.BASE_DIR, 'static', 'fonts', font_file)
+async def async_get_reading(name, lang):
+    reading_kana = await sync_to_async(lookup_reading)(name, lang) or confident_reading(name, lang)
+    if reading_kana:
+        return reading_kana
+
+    async def lookup():
+        return await sync_to_async(lookup_reading)(name, lang)
+
+    async def fetch():
+        kana = (await achat(kana_request(name, lang))).strip().replace(' ', '')
+        return await sync_to_async(store_reading)(name, lang, kana)
+
+    return await async_single_flight(('reading', name.lower(), lang), lookup, fetch)
+
+async def async_get_kanji_candidates(name, num_candidates, reading_kana):
+    async def lookup():
+        return await sync_to_async(lookup_candidates)(name, reading_kana)
+
+    async def fetch():
+        candidates = parse_candidates(await achat(candidates_request(name, num_candidates)))
+        return await sync_to_async(store_candidates)(name, candidates)
+
+    db_entry = await async_single_flight(('kanji_candidates', name.lower()), lookup, fetch)
+    return candidates_result(db_entry)
+
+async def check_name_and_reading(name, lang):
+    """NGワードチェックと読みの取得を同時に行い (エラーメッセージ, 読み) を返す
+
+    NGワードだった場合の読みの問い合わせは無駄になるが、通常の名前の待ち時間を優先する。
+    名前が使えるのに読みが取れなかったときは、その例外をそのまま送出する。
+    """
+    # 文字数・文字種で弾く名前は読みを取りに行かない
+    checks = [async_smart_ng_check(name)]
+    if not name_rule_error(name)[0]:
+        checks.append(async_get_reading(name, lang))
+    results = await asyncio.gather(*checks, return_exceptions=True)
+    is_ng = results[0][0] if not isinstance(results[0], Exception) else False
+    invalid, message = name_error(name, is_ng)
+    if invalid:
+        return message, None
+    if isinstance(results[1], Exception):
+        raise results[1]
+    return None, results[1]
 
-    is_tate = mode == 'tate'
-    chars = list(kanji)
-    kanji_for_size = kanji
+@require_http_methods(["GET", "POST"])
+async def ateji_form_async(request):
+    """ateji_form の非同期版（ASGI用）
+
+    NGワードチェックと読みの取得は互いに関係ないので同時に問い合わせる（check_name_and_reading）。
+    """
+    redirect_to, name, num_candidates, mode, font = ateji_form_params(request)
+    if redirect_to:
+        return redirect(redirect_to)
+    lang = get_language().replace('_', '-').lower()
+    if streams_candidates(request, name) and not await sync_to_async(has_stored_candidates)(name, lang):
+        context = await sync_to_async(ateji_stream_context)(request, name, num_candidates, mode, font)
+        return await sync_to_async(render_ateji_form)(request, context)
+    error = None
+    candidates = []
+    cached = False
+    if name:
+        try:
+            error, reading_kana = await check_name_and_reading(name, lang)
+            if not error:
+                candidates, cached = await async_get_kanji_candidates(name, num_candidates, reading_kana)
+        except Exception as e:
+            error = f'ERROR: {str(e)}'
+    context = await sync_to_async(ateji_form_context)(name, num_candidates, mode, font, candidates, cached, error)
+    return await sync_to_async(render_ateji_form)(request, context)
+
+# ASGI（kanji_name/asgi.py）で動かすときは非同期版を使う
+ateji_page = ateji_form_async if ASYNC_GPT_PIPELINE else ateji_form
 
-    font_size = get_font_size_for_text(kanji_for_size, font_path, width-190, height-190, 24, 120, vertical=is_tate)
 
-    bg = Image.open(bg_path).convert("RGBA").resize((width, height))
-    draw = ImageDraw.Draw(bg)
-    font = ImageFont.truetype(font_path, font_size)
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx にまとめて送らせない
+    response['X-Robots-Tag'] = 'noindex, nofollow'
+    return response
 
-    if not is_tate:
-        # 横書き
+class CandidateEvents:
+    """候補のSSEイベント（candidate / meanings / done）を組み立てる
+
+    同期版・非同期版のストリームで共通。GPTの応答の断片を feed() に渡すと、閉じた候補の分の
+    candidate を返す。finish() で残り（配列として読めなかった応答の解析、保存、意味、done）を返す。
+    保存済みの候補は cached() でまとめて返す。
+    """
+
+    def __init__(self, name, mode, font, lang):
+        self.name = name
+        self.mode = mode
+        self.font = font
+        self.lang = lang
+        self.parser = JsonArrayObjects()
+        self.gpt_text = ''
+        self.candidates = []
+
+    def add(self, c):
+        # 候補カード1枚分。意味は保存済みのものだけ（足りない分は finish() の meanings で送る）
+        index = len(self.candidates)
+        self.candidates.append(c)
+        parts = c.get('parts', [])
+        image_params = urlencode({'kanji': c.get('kanji', ''), 'mode': self.mode, 'font': self.font})
+        return sse_event('candidate', {
+            'index': index,
+            'kanji': c.get('kanji', ''),
+            'reading': c.get('reading', ''),
+            'parts': parts,
+            'parts_value': str(parts),  # confirm_tshirt に送る値（テンプレートの {{ item.parts }} と同じ形）
+            'image_url': f"{reverse('kanji_image_api')}?{image_params}",
+            'meaning': get_meaning_string(parts, self.lang),
+        })
+
+    def feed(self, text):
+        self.gpt_text += text
+        return [self.add(complete_candidate(c)) for c in self.parser.feed(text)]
+
+    def cached(self, db_entry):
+        candidates, cached = candidates_result(db_entry)
+        return [self.add(c) for c in candidates] + self.finish(cached=True)
+
+    def finish(self, cached=False):
+        events = []
+        if not cached:
+            if not self.candidates:
+                # 配列として読めなかった応答は従来の解析に任せる
+                events += [self.add(c) for c in parse_candidates(self.gpt_text)]
+            if not self.candidates:
+                # 空の結果は保存しない（保存すると、その名前は二度と生成し直されない）
+                events.append(sse_event('error', {'message': _("No candidates could be generated. Please try again.")}))
+                return events
+            store_candidates(self.name, self.candidates)
+        # 全候補が揃ってから、足りない意味をまとめて取得してカードの意味を差し替える
+        prefetch_kanji_meanings([part for c in self.candidates for part in c.get('parts', [])], self.lang)
+        events += [
+            sse_event('meanings', {'index': i, 'meaning': page_meaning_string(c.get('parts', []), self.lang)})
+            for i, c in enumerate(self.candidates) if c.get('parts')
+        ]
+        events.append(sse_event('done', {'cached': cached}))
+        return events
+
+def candidate_events(events, chunks):
+    # GPTの応答の断片（chunks）から、候補が閉じるたびにイベントを返す
+    for text in chunks:
+        yield from events.feed(text)
+    yield from events.finish()
+
+async def async_candidate_events(events, chunks):
+    # candidate_events の非同期版（chunks は非同期イテレータ）
+    async for text in chunks:
+        for event in await sync_to_async(events.feed)(text):
+            yield event
+    for event in await sync_to_async(events.finish)():
+        yield event
+
+def candidate_stream_events(name, num_candidates, mode, font, lang):
+    with translation.override(lang):
+        invalid, message = validate_name(name)
+        if invalid:
+            yield sse_event('error', {'message': message})
+            return
+        events = CandidateEvents(name, mode, font, lang)
         try:
-            bbox = draw.textbbox((0, 0), kanji, font=font)
-            text_width, text_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        except Exception:
-            text_width, text_height = draw.textsize(kanji, font=font)
-        x = (width - text_width) // 2
-        y = (height - text_height) // 3
-        draw.text((x, y), kanji, font=font, fill="black")
-    else:
-        # 縦書き
-        ws, hs, bboxes, small_indexes = [], [], [], []
-        for ch in chars:
-            try:
-                bbox = draw.textbbox((0,0), ch, font=font)
-                w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
-            except Exception:
-                w, h = draw.textsize(ch, font=font)
-                bbox = (0, 0, w, h)
-            # 長音符は事前に幅・高さを工夫（回転するため）
-            if ch in ['ー', 'ｰ', '-']:
-                ws.append(h)
-                hs.append(w)
-                small_indexes.append(False)
+            db_entry = lookup_candidates(name, get_reading(name, lang))
+            if db_entry:
+                yield from events.cached(db_entry)
             else:
-                ws.append(w)
-                hs.append(h)
-                small_indexes.append(ch in SMALL_KANA)
-            bboxes.append(bbox)
-
-        max_w = max(ws)
-        total_h = sum(hs) + 10*(len(chars)-1)
-        x = (width - max_w) // 2
-        y = (height - total_h) // 3
-
-        cursor_y = y
-        for i, ch in enumerate(chars):
-            w, h = ws[i], hs[i]
-            bbox = bboxes[i]
-            if ch in ['ー', 'ｰ', '-']:
-                # 長音符は90度回転描画で中央
-                base_w, base_h = bbox[2] - bbox[0], bbox[3] - bbox[1]
-                char_img = Image.new('RGBA', (base_w, base_h), (0, 0, 0, 0))
-                char_draw = ImageDraw.Draw(char_img)
-                char_draw.text((-bbox[0], -bbox[1]), ch, font=font, fill="black")
-                rotated_char_img = char_img.rotate(90, expand=True)
-                rw, rh = rotated_char_img.size
-                adjust_ratio = 1.95  # ここを1.5等で微調整可能
-                rx = int((width - rw) / adjust_ratio)
-                ry = cursor_y + int(hs[i] * 0.4)
-                bg.paste(rotated_char_img, (rx, ry), rotated_char_img)
-            elif small_indexes[i]:
-                # 小書き文字: 右下寄せ
-                sx = x + int(ws[i] * 0.2)
-                sy = cursor_y - int(hs[i] * 0.4)
-                draw.text((sx, sy), ch, font=font, fill="black")
+                yield from candidate_events(events, chat_stream(candidates_request(name, num_candidates)))
+        except Exception as e:
+            yield sse_event('error', {'message': f'ERROR: {str(e)}'})
+
+@require_http_methods(["GET"])
+def ateji_stream(request):
+    """ateji_form の候補を text/event-stream で1件ずつ送る
+
+    GPTの応答をストリーミングで受け、候補のオブジェクトが閉じるたびに candidate を送る。
+    最後に意味（meanings）と done。失敗は error。
+    同じ名前の同時リクエストはまとめない（single_flight は結果が揃うまで待たせてしまうため）。
+    """
+    redirect_to, name, num_candidates, mode, font = ateji_form_params(request)
+    lang = get_language().replace('_', '-').lower()
+    return stream_response(candidate_stream_events(name, num_candidates, mode, font, lang))
+
+async def async_candidate_stream_events(name, num_candidates, mode, font, lang):
+    with translation.override(lang):
+        events = CandidateEvents(name, mode, font, lang)
+        try:
+            error, reading_kana = await check_name_and_reading(name, lang)
+            if error:
+                yield sse_event('error', {'message': error})
+                return
+            db_entry = await sync_to_async(lookup_candidates)(name, reading_kana)
+            if db_entry:
+                for event in await sync_to_async(events.cached)(db_entry):
+                    yield event
             else:
-                draw.text((x, cursor_y), ch, font=font, fill="black")
-            cursor_y += h + 10
+                async for event in async_candidate_events(events, achat_stream(candidates_request(name, num_candidates))):
+                    yield event
+        except Exception as e:
+            yield sse_event('error', {'message': f'ERROR: {str(e)}'})
+
+@require_http_methods(["GET"])
+async def ateji_stream_async(request):
+    # ateji_stream の非同期版（ASGI用）
+    redirect_to, name, num_candidates, mode, font = ateji_form_params(request)
+    lang = get_language().replace('_', '-').lower()
+    return stream_response(async_candidate_stream_events(name, num_candidates, mode, font, lang))
 
-    response = HttpResponse(content_type="image/png")
-    bg.save(response, "PNG")
+# ateji_page と同じく、ASGIでは非同期版
+ateji_stream_page = ateji_stream_async if ASYNC_GPT_PIPELINE else ateji_stream
+
+
+def cache_preview(view):
+    # 正常な画像(200)と304だけ長期キャッシュさせる（503などはキャッシュさせない）
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            patch_cache_control(response, public=True, max_age=KANJI_IMAGE_MAX_AGE)
+            patch_vary_headers(response, ('Accept',))  # 形式をAcceptで切り替えるため
+        return response
+    return wrapper
+
+
+def render_unavailable_response(error):
+    response = HttpResponse(str(error), status=503, content_type="text/plain")
+    response['Retry-After'] = '1'
+    return response
+
+
+def preview_image_format(request):
+    # Accept に image/avif や image/webp があればPNGより小さい形式で返す（q=0 は不可扱い）
+    accepted = set()
+    for item in request.headers.get('Accept', '').split(','):
+        media_type, _, params = item.partition(';')
+        q = re.search(r'q\s*=\s*([0-9.]+)', params)
+        try:
+            if q and float(q.group(1)) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(media_type.strip().lower())
+    for image_format in supported_image_formats():
+        if IMAGE_FORMATS[image_format][1] in accepted:
+            return image_format
+    return 'png'
+
+
+def preview_image_response(data, image_format):
+    return HttpResponse(data, content_type=IMAGE_FORMATS[image_format][1])
+
+
+def kanji_image_params(request):
+    kanji = unquote(request.GET.get('kanji', '漢字'))
+    mode, font_code, body_color, text_color = normalize_preview_params(
+        request.GET.get('mode', 'yoko'), request.GET.get('font', 'ZenOldMincho'),
+        request.GET.get('body_color', 'white'), request.GET.get('text_color', 'black'),
+    )
+    return kanji, mode, font_code, body_color, text_color, preview_image_format(request)
+
+
+def kanji_image_etag(request):
+    # 画像は入力と描画バージョンだけで決まるので、キャッシュキーをそのままETagにする
+    return kanji_image_cache.key(*kanji_image_params(request))
+
+
+@cache_preview
+@condition(etag_func=kanji_image_etag)
+def kanji_image(request):
+    # If-None-Match が一致すれば condition() が描画せずに304を返す
+    params = kanji_image_params(request)
+    try:
+        data = kanji_image_cache.get_or_render(*params)
+    except RenderUnavailable as e:
+        return render_unavailable_response(e)
+    return preview_image_response(data, params[-1])
+
+
+def kanji_sprite_params(request):
+    kanji_list = tuple(unquote(k) for k in request.GET.getlist('kanji') if k)[:KANJI_SPRITE_MAX]
+    mode, font_code, body_color, text_color = normalize_preview_params(
+        request.GET.get('mode', 'yoko'), request.GET.get('font', 'ZenOldMincho'),
+        request.GET.get('body_color', 'white'), request.GET.get('text_color', 'black'),
+    )
+    return kanji_list, mode, font_code, body_color, text_color, preview_image_format(request)
+
+
+def kanji_sprite_etag(request):
+    return kanji_sprite_cache.key(*kanji_sprite_params(request))
+
+
+def kanji_sprite_url(kanji_list, mode, font):
+    query = urlencode([('kanji', k) for k in kanji_list] + [('mode', mode), ('font', font)])
+    return f"{reverse('kanji_sprite')}?{query}"
+
+
+@cache_preview
+@condition(etag_func=kanji_sprite_etag)
+def kanji_sprite(request):
+    # 候補一覧のプレビューを1リクエストで返す（?kanji=A&kanji=B...&mode=&font=）
+    params = kanji_sprite_params(request)
+    kanji_list = params[0]
+    if not kanji_list:
+        return HttpResponseBadRequest("kanji is required")
+    try:
+        data = kanji_sprite_cache.get_or_render(*params)
+    except RenderUnavailable as e:
+        return render_unavailable_response(e)
+    response = preview_image_response(data, params[-1])
+    width, height = PREVIEW_SIZE
+    response['X-Sprite-Tile'] = f"{width}x{height}"
+    response['X-Sprite-Offsets'] = json.dumps([[0, i * height] for i in range(len(kanji_list))])
+    return response
+
+
+def barcode_url(code, image_format='svg'):
+    # 描画オプションが変わったらURLも変わるので、ブラウザには無期限にキャッシュさせられる
+    key = barcode_key(code, image_format=image_format)
+    return f"{reverse('barcode_image', args=[code, image_format])}?v={key[:12]}"
+
+
+@require_http_methods(["GET"])
+def barcode_image(request, code, image_format):
+    if not re.fullmatch(r'\d{12,13}', code) or image_format not in BARCODE_FORMATS:
+        raise Http404
+    try:
+        data = render_barcode_image(code, image_format=image_format)
+    except BarcodeError:
+        raise Http404
+    response = HttpResponse(data, content_type=BARCODE_FORMATS[image_format][1])
+    patch_cache_control(response, public=True, max_age=KANJI_IMAGE_MAX_AGE, immutable=True)
     return response
 
 
@@ -657,7 +1148,9 @@ def tshirt_order(request):
             setting = TshirtSetting.objects.first()
             price = int(getattr(setting, "price", 5000))
         except:
+            setting = None
             price = 5000
+        jan_code = getattr(setting, "jan_code_const", "") or DEFAULT_JAN_CODE
 
         lang = get_language().replace('_', '-').lower()  # ←現在の言語
         meaning_str = get_meaning_string(parts, lang)
@@ -672,42 +1165,27 @@ def tshirt_order(request):
             body_color=body_color,
             text_color=text_color,
             price=price,
-            jan_code=DEFAULT_JAN_CODE
+            jan_code=jan_code
         )
+        # 印刷シートを先に描いておく（店舗でQRを読んだときは描画済みのものを返すだけになる）
+        enqueue_print_job(order)
 
         order_url = f"{order.id}"
 
-        # バーコード生成
-        CODE = barcode.get('ean13', DEFAULT_JAN_CODE, writer=ImageWriter())
-        barcode_buffer = BytesIO()
-        CODE.write(
-            barcode_buffer,
-            options={
-                'module_height': 15.0,
-                'font_size': 10,
-                'text_distance': 1,
-                'module_width': 1.5,
-                'write_text': False
-            }
-        )
-        barcode_image_base64 = base64.b64encode(barcode_buffer.getvalue()).decode('utf-8')
 
         # QRコード内容にもmeaning_strを格納
         qr_content = {
             "order_no": order_url,
         }
         qr_json = json.dumps(qr_content, ensure_ascii=False)
-        buf = BytesIO()
-        qrcode.make(qr_json).save(buf, format='PNG')
-        img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
 
         response = render(request, "generator/order_detail.html", {
             'order': order,
             'order_url': order_url,
-            'qr_base64': img_base64,
+            'qr_svg': qr_svg(qr_json),  # Pillowで画像にせずSVGをそのまま埋め込む
             'qr_json': qr_json,
-            'jan_code': DEFAULT_JAN_CODE,
-            'barcode_base64': barcode_image_base64,
+            'jan_code': jan_code,
+            'barcode_url': barcode_url(jan_code),  # JANコードは全注文共通なので画像はキャッシュしてURLで返す
             'meaning_str': meaning_str,  # 表示用
             'parts': parts,              # テンプレで表示や確認用
             "on_top_page": False
@@ -734,6 +1212,8 @@ def admin_tshirt_settings(request):
         text_colors = [t.strip() for t in request.POST.get('text_colors', '').split(',') if t.strip()]
         price = int(request.POST.get('price', DEFAULT_PRICE))
         jan_code_const = request.POST.get('jan_code_const', DEFAULT_JAN_CODE)
+        if setting.jan_code_const != jan_code_const:
+            invalidate_barcode(setting.jan_code_const)
         setting.size_choices = sizes
         setting.body_color_choices = body_colors
         setting.text_color_choices = text_colors
@@ -757,85 +1237,6 @@ def admin_tshirt_settings(request):
     return response
 
 
-def get_best_font_size(text, font_path, img_w, img_h, vertical=False, margin=120, min_size=50, max_size=1000):
-    # 二分探索で最大フォントサイズを求める
-    left = min_size
-    right = max_size
-    best = min_size
-    temp_img = Image.new("RGB", (img_w, img_h))
-    draw = ImageDraw.Draw(temp_img)
-    while left <= right:
-        mid = (left + right) // 2
-        font = ImageFont.truetype(font_path, mid)
-        if not vertical:
-            try:
-                bbox = draw.textbbox((0, 0), text, font=font)
-            except AttributeError:
-                bbox = (0, 0) + draw.textsize(text, font=font)
-            width = bbox[2] - bbox[0]
-            height = bbox[3] - bbox[1]
-        else:
-            widths = []
-            heights = []
-            for ch in text:
-                try:
-                    bbox = draw.textbbox((0, 0), ch, font=font)
-                    w = bbox[2] - bbox[0]
-                    h = bbox[3] - bbox[1]
-                except AttributeError:
-                    w, h = draw.textsize(ch, font=font)
-                widths.append(w)
-                heights.append(h)
-            width = max(widths)
-            height = sum(heights)
-        # 上下左右margin px空ける
-        if width <= img_w - 2*margin and height <= img_h - 2*margin:
-            best = mid
-            left = mid + 1
-        else:
-            right = mid - 1
-    return best
-
-
-SMALL_KANA = (
-    'ぁぃぅぇぉっゃゅょゎゕゖゝゞゟ'
-    'ァィゥェォッャュョヮヵヶヽヾヿ'
-)
-
-def get_best_font_size_tate(
-    text, font_path, img_w, img_h, margin=120, min_size=50, max_size=1000, extra_ratio=0.2
-):
-    left = min_size
-    right = max_size
-    best = min_size
-    temp_img = Image.new("RGB", (img_w, img_h))
-    draw = ImageDraw.Draw(temp_img)
-    while left <= right:
-        mid = (left + right) // 2
-        font = ImageFont.truetype(font_path, mid)
-        heights = []
-        max_width = 0
-        for ch in text:
-            try:
-                bbox = draw.textbbox((0, 0), ch, font=font)
-            except AttributeError:
-                bbox = (0, 0) + draw.textsize(ch, font=font)
-            if ch in ['ー', 'ｰ', '-']:
-                h = bbox[2] - bbox[0]
-                w = bbox[3] - bbox[1]
-            else:
-                w = bbox[2] - bbox[0]
-                h = bbox[3] - bbox[1]
-            heights.append(h)
-            if w > max_width:
-                max_width = w
-        total_h = int(sum(h + math.ceil(h*extra_ratio) for h in heights))
-        if max_width <= img_w - 2*margin and total_h <= img_h - 2*margin:
-            best = mid
-            left = mid + 1
-        else:
-            right = mid - 1
-    return best
 
 from io import BytesIO
 
@@ -862,160 +1263,118 @@ def print_preview(request):
         except Order.DoesNotExist:
             return JsonResponse({"error": "Order data not found for the given QR code."})
 
-        # 各値をorderから振り分けてqrdataへ
-        qrdata = {
-            "order_no": order_no,
-            "kanji": order.kanji,
-            "reading": order.reading,
-            "meaning": order.meaning,
-            "mode": order.mode,
-            "font": order.font,
-            "size": order.size,
-            "body_color": order.body_color,
-            "text_color": order.text_color,
-            # partsや他フィールドも必要なら追加
-        }
+        # 描画はワーカー（print_worker）に任せ、ここでは PrintJob を queued にして即返す
+        job = enqueue_print_job(order)
+        return JsonResponse(print_job_json(job))
+    else:
+        return JsonResponse({"error": "Method not allowed."})
 
-        # DB保存
-        job, created = PrintJob.objects.update_or_create(
-            order_no=qrdata["order_no"],
-            defaults=dict(
-                kanji=qrdata["kanji"],
-                reading=qrdata["reading"],
-                meaning=qrdata["meaning"],
-                mode=qrdata["mode"],
-                font=qrdata["font"],
-                size=qrdata["size"],
-                body_color=qrdata["body_color"],
-                text_color=qrdata["text_color"],
-            )
-        )
 
-        # 画像サイズと向き
-        mode = qrdata.get("mode", "yoko")
-        kanji = qrdata.get("kanji", "漢字")
-        fontname = qrdata.get("font", "ZenOldMincho")
-        font_path = FONT_PATHS.get(fontname, DEFAULT_FONT_PATH)
-        text_color = qrdata.get("text_color","black")
-
-        if mode == "tate":
-            width, height = 2480, 3508  # 縦A4
-            vertical = True
-            best_font_size = get_best_font_size_tate(
-                kanji, font_path, width, height, margin=100
-            )
-            font = ImageFont.truetype(font_path, best_font_size)
-            img = Image.new("RGB", (width, height), "white")
-            draw = ImageDraw.Draw(img)
-            heights, widths, extra_spc, is_small, bboxes = [], [], [], [], []
-            for ch in kanji:
-                try:
-                    bbox = draw.textbbox((0, 0), ch, font=font)
-                except AttributeError:
-                    bbox = (0, 0) + draw.textsize(ch, font=font)
-                w = bbox[2] - bbox[0]
-                h = bbox[3] - bbox[1]
-                # 長音符は回転するためw,hを逆に記録
-                if ch in ['ー', 'ｰ', '-']:
-                    widths.append(h)
-                    heights.append(w)
-                else:
-                    widths.append(w)
-                    heights.append(h)
-                extra_spc.append(math.ceil(h*0.2))
-                is_small.append(ch in SMALL_KANA)
-                bboxes.append(bbox)
-            total_h = sum(h + sp for h,sp in zip(heights, extra_spc))
-
-            # ====== 【ここ】上下マージンを十分設けて中央寄せ ======
-            MARGIN_TOP = 0
-            MARGIN_BOTTOM = 100  # 終端見切れ防止で多め
-            usable_height = height - MARGIN_TOP - MARGIN_BOTTOM
-            if total_h > usable_height:
-                start_y = MARGIN_TOP
-            else:
-                start_y = MARGIN_TOP + int((usable_height - total_h) * 0.2)
-
-            cursor_y = start_y
-            for i, ch in enumerate(kanji):
-                w, h, sp, bbox = widths[i], heights[i], extra_spc[i], bboxes[i]
-                if ch in ['ー', 'ｰ', '-']:
-                    # 長音符は90度回転
-                    base_w, base_h = bbox[2] - bbox[0], bbox[3] - bbox[1]
-                    char_img = Image.new('RGBA', (base_w, base_h), (0, 0, 0, 0))
-                    char_draw = ImageDraw.Draw(char_img)
-                    char_draw.text((-bbox[0], -bbox[1]), ch, font=font, fill=text_color)
-                    rotated_char_img = char_img.rotate(90, expand=True)
-                    rw, rh = rotated_char_img.size
-                    # 中央に配置（adjust_ratio微調整可）
-                    adjust_ratio = 1.85
-                    sx = int((width - rw) / adjust_ratio)
-                    sy = cursor_y + int(rh * 0.3)
-                    img.paste(rotated_char_img, (sx, sy), rotated_char_img)
-                elif is_small[i]:
-                    sx = (width - w) // 2 + int(w * 0.2)
-                    sy = cursor_y - int(h * 0.4)
-                    draw.text((sx, sy), ch, font=font, fill=text_color)
-                else:
-                    sx = (width - w) // 2
-                    sy = cursor_y
-                    draw.text((sx, sy), ch, font=font, fill=text_color)
-                cursor_y += h + sp
-
-            # --- 注文情報（90度回転）---
-            info_font = ImageFont.truetype(font_path, 64)
-            info_lines = [
-                f"Order No: {qrdata.get('order_no','')}",
-                f"Size: {qrdata.get('size','')} / Body: {qrdata.get('body_color','')} / Print: {qrdata.get('text_color','')}",
-                f"Font: {qrdata.get('font','')}",
-                f"Mode: {qrdata.get('mode','')}",
-            ]
-            info_text = "\n".join(info_lines)
-            temp_img = Image.new("RGBA", (height, width), (255,255,255,0))
-            temp_draw = ImageDraw.Draw(temp_img)
-            padding = 50
-            temp_draw.multiline_text((padding, padding), info_text, font=info_font, fill="gray", spacing=12)
-            temp_img_rot = temp_img.rotate(90, expand=1)
-            info_w, info_h = temp_img_rot.size
-            pos_x = width - info_w - 40
-            pos_y = height - info_h - 40
-            img.paste(temp_img_rot, (pos_x, pos_y), temp_img_rot)
-        else:
-            width, height = 3508, 2480  # 横A4
-            vertical = False
-            best_font_size = get_best_font_size(kanji, font_path, width, height, vertical=vertical, margin=120)
-            font = ImageFont.truetype(font_path, best_font_size)
-            img = Image.new("RGB", (width, height), "white")
-            draw = ImageDraw.Draw(img)
-            try:
-                bbox = draw.textbbox((0, 0), kanji, font=font)
-            except AttributeError:
-                bbox = (0, 0) + draw.textsize(kanji, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            x = (width - text_width) // 2
-            y = (height - text_height) * 0.3
-            draw.text((x, y), kanji, font=font, fill=text_color)
-
-            # 下部注文情報
-            info_font = ImageFont.truetype(font_path, 64)
-            info_lines = [
-                f"Order No: {qrdata.get('order_no','')}",
-                f"Size: {qrdata.get('size','')} / Body: {qrdata.get('body_color','')} / Print: {qrdata.get('text_color','')}",
-                f"Font: {qrdata.get('font','')}",
-                f"Mode: {qrdata.get('mode','')}",
-            ]
-            y_info = height - 400
-            for line in info_lines:
-                draw.text((160, y_info), line, font=info_font, fill="gray")
-                y_info += 70
-
-        buf = BytesIO()
-        img.save(buf, format='PNG')
-        preview_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-        return JsonResponse({"preview_base64": preview_base64})
+PREVIEW_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+@require_http_methods(["GET"])
+@login_required
+def print_preview_image(request, preview_id):
+    # シートは PNG だけを保存している（print_queue.render_job）
+    if not PREVIEW_ID_RE.match(preview_id):
+        raise Http404
+    try:
+        f = open(print_sheet_cache.path_for(preview_id), 'rb')
+    except OSError:
+        raise Http404
+    # FileResponse がチャンクごとに送る（Content-Length 付き）。中身はidで決まるので再検証不要
+    response = FileResponse(f, content_type=PRINT_IMAGE_FORMATS['png'])
+    patch_cache_control(response, private=True, max_age=KANJI_IMAGE_MAX_AGE, immutable=True)
+    return response
+
+
+def print_job_json(job):
+    data = {
+        "job_id": job.pk,
+        "order_no": job.order_no,
+        "kanji": job.kanji,
+        "size": job.size,
+        "status": job.status,
+        "error": job.error,
+        "updated_at": job.updated_at.isoformat(),
+        "status_url": reverse('print_job_status', args=[job.pk]),
+        "printed_url": reverse('print_job_printed', args=[job.pk]),
+    }
+    if job.status in (PrintJob.STATUS_READY, PrintJob.STATUS_PRINTED) and job.preview_id:
+        data["preview_url"] = reverse('print_preview_image', args=[job.preview_id])
+    return data
+
+
+@require_http_methods(["GET"])
+@login_required
+def print_job_status(request, job_id):
+    try:
+        job = PrintJob.objects.get(pk=job_id)
+    except PrintJob.DoesNotExist:
+        raise Http404
+    return JsonResponse(print_job_json(job))
+
+
+@require_http_methods(["GET"])
+@login_required
+def print_jobs(request):
+    # ダッシュボードのポーリング用（新しい順）
+    status = request.GET.get('status')
+    jobs = PrintJob.objects.order_by('-updated_at')
+    if status:
+        jobs = jobs.filter(status=status)
+    return JsonResponse({"jobs": [print_job_json(job) for job in jobs[:PRINT_JOBS_LIMIT]]})
+
+
+@require_http_methods(["POST"])
+@login_required
+def print_job_printed(request, job_id):
+    updated = PrintJob.objects.filter(pk=job_id, status=PrintJob.STATUS_READY).update(status=PrintJob.STATUS_PRINTED)
+    if not updated and not PrintJob.objects.filter(pk=job_id).exists():
+        raise Http404
+    return JsonResponse(print_job_json(PrintJob.objects.get(pk=job_id)))
+
+@require_http_methods(["POST"])
+@login_required
+def print_batch(request):
+    # まとめ印刷: 注文ID（改行・カンマ区切り）か日付（その日の未印刷分すべて）を受けて PDF / ZIP を返す
+    image_format = request.POST.get("format", "pdf")
+    if image_format not in BATCH_WRITERS:
+        return HttpResponseBadRequest("format must be pdf or zip")
+    order_ids = [i for i in re.split(r'[\s,]+', request.POST.get("order_ids", "")) if i]
+    try:
+        day = parse_date(request.POST.get("day", ""))
+    except ValueError:
+        day = None
+    if order_ids:
+        try:
+            orders = list(Order.objects.filter(id__in=order_ids).order_by('created_at'))
+        except ValidationError:
+            return HttpResponseBadRequest("invalid order id")
+        label = timezone.localdate().isoformat()
+    elif day:
+        orders = list(unprinted_orders(day))
+        label = day.isoformat()
     else:
-        return JsonResponse({"error": "Method not allowed."})
+        return HttpResponseBadRequest("order_ids or day is required")
+    if not orders:
+        raise Http404("No orders to print.")
+
+    try:
+        sheets = render_batch(orders)
+    except BatchTooLarge as e:
+        return HttpResponseBadRequest(str(e))
+    except RenderUnavailable as e:
+        return render_unavailable_response(e)
+    write, content_type = BATCH_WRITERS[image_format]
+    out = tempfile.TemporaryFile()
+    write(sheets, out)
+    out.seek(0)
+    if request.POST.get("mark_printed"):
+        mark_printed([job for job, path in sheets])
+    return FileResponse(out, as_attachment=True, filename=f"print_{label}.{image_format}", content_type=content_type)
+
 
 @require_http_methods(["GET", "POST"])
 @login_required
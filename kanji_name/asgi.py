@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kanji_name.settings')
+# ASGIではGPTへの問い合わせを非同期で同時に行う（generator.views.ateji_form_async）
+os.environ.setdefault('ASYNC_GPT_PIPELINE', '1')
 
 application = get_asgi_application()
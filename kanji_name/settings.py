@@ -156,3 +156,57 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/store/'
+
+# Pillowのフォントオブジェクトキャッシュ上限（フォントパス×サイズの組み合わせ数）
+FONT_CACHE_SIZE = int(os.environ.get('FONT_CACHE_SIZE', 256))
+
+# グリフ寸法テーブルの保存先（python manage.py build_glyph_metrics で作成）
+GLYPH_METRICS_DIR = os.path.join(BASE_DIR, 'cache', 'glyph_metrics')
+
+# /kanji_image/ の描画結果キャッシュ（入力のハッシュをファイル名にして保存、容量超過で古いものから削除）
+KANJI_IMAGE_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'kanji_image')
+KANJI_IMAGE_CACHE_MAX_BYTES = int(os.environ.get('KANJI_IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# /kanji_image/ の Cache-Control max-age（秒）
+KANJI_IMAGE_MAX_AGE = int(os.environ.get('KANJI_IMAGE_MAX_AGE', 60 * 60 * 24 * 30))
+# プレビュー用の文字マスク（色替え合成用）をメモリに保持する数
+PREVIEW_MASK_CACHE_SIZE = int(os.environ.get('PREVIEW_MASK_CACHE_SIZE', 128))
+# 候補一覧のスプライト画像キャッシュ（容量上限は KANJI_IMAGE_CACHE_MAX_BYTES と同じ）
+KANJI_SPRITE_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'kanji_sprite')
+
+# 画像描画用プロセスプール（0 にするとリクエストスレッド内で描画）
+RENDER_POOL_WORKERS = int(os.environ.get('RENDER_POOL_WORKERS', 2))
+RENDER_POOL_MAX_PENDING = int(os.environ.get('RENDER_POOL_MAX_PENDING', 16))  # 同時に受け付ける描画数
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 30))                   # 1件あたりの待ち時間（秒）
+RENDER_QUEUE_TIMEOUT = float(os.environ.get('RENDER_QUEUE_TIMEOUT', 2))        # 満杯時に空きを待つ時間（秒）
+
+# プレビュー画像の形式（Acceptヘッダーで左から順に選び、非対応ならPNG）と画質
+PREVIEW_IMAGE_FORMATS = ('avif', 'webp', 'png')
+PREVIEW_AVIF_QUALITY = int(os.environ.get('PREVIEW_AVIF_QUALITY', 50))
+PREVIEW_WEBP_QUALITY = int(os.environ.get('PREVIEW_WEBP_QUALITY', 80))
+PREVIEW_PNG_OPTIMIZE = True
+PREVIEW_PNG_COMPRESS_LEVEL = int(os.environ.get('PREVIEW_PNG_COMPRESS_LEVEL', 9))
+
+# 印刷用A4シート（PNG）の保存先と容量上限
+PRINT_SHEET_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'print_sheet')
+PRINT_SHEET_CACHE_MAX_BYTES = int(os.environ.get('PRINT_SHEET_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# 印刷ジョブのワーカー（manage.py print_worker）
+PRINT_JOB_STALE_AFTER = int(os.environ.get('PRINT_JOB_STALE_AFTER', 120))  # rendering のまま止まったジョブを戻すまでの秒数
+PRINT_JOB_MAX_ATTEMPTS = int(os.environ.get('PRINT_JOB_MAX_ATTEMPTS', 3))
+PRINT_BATCH_MAX = int(os.environ.get('PRINT_BATCH_MAX', 200))  # まとめ印刷1回あたりの注文数の上限
+# 注文完了ページのJANコード画像のキャッシュ
+BARCODE_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'barcode')
+# 同じ名前・漢字のGPT問い合わせを1回にまとめるとき、他プロセスの結果を待つ最長時間（秒）
+SINGLE_FLIGHT_LOCK_TIMEOUT = int(os.environ.get('SINGLE_FLIGHT_LOCK_TIMEOUT', 30))
+# 漢字の意味は初回に全言語（LANGUAGES）分をまとめてGPTから取得する
+KANJI_MEANING_ALL_LANGUAGES = os.environ.get('KANJI_MEANING_ALL_LANGUAGES', '1') == '1'
+# 漢字の意味のプロセス内辞書：他プロセスでの変更を確認する間隔（秒）と、共有する版数ファイル
+KANJI_MEANING_CHECK_INTERVAL = float(os.environ.get('KANJI_MEANING_CHECK_INTERVAL', 1))
+KANJI_MEANING_VERSION_FILE = os.path.join(BASE_DIR, 'cache', 'kanji_meaning_version')
+# 名前の読みはローカルの変換の確からしさがこれ以上ならGPTに聞かない（1.0 にすると登録済みの名前とかな入力だけ）
+KANA_ENGINE_MIN_CONFIDENCE = float(os.environ.get('KANA_ENGINE_MIN_CONFIDENCE', 0.8))
+# 名前入力ページのGPT問い合わせを非同期で同時に行う（kanji_name/asgi.py で起動したときに有効）
+ASYNC_GPT_PIPELINE = os.environ.get('ASYNC_GPT_PIPELINE', '0') == '1'
+GPT_ASYNC_TIMEOUT = float(os.environ.get('GPT_ASYNC_TIMEOUT', 30))
+# 名前入力ページの候補をGPTの生成に合わせて1件ずつ表示する（SSE）
+ATEJI_STREAM_CANDIDATES = os.environ.get('ATEJI_STREAM_CANDIDATES', '1') == '1'
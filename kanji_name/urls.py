@@ -33,7 +33,8 @@ urlpatterns = [
 
 urlpatterns += i18n_patterns(
     path('', views.home, name='home'),  # トップ
-    path('ateji/', views.ateji_form, name='ateji_form'),
+    path('ateji/', views.ateji_page, name='ateji_form'),
+    path('ateji/stream/', views.ateji_stream_page, name='ateji_stream'),
     path('kanji_image/', views.kanji_image, name='kanji_image'),
     path('confirm_tshirt/', views.confirm_tshirt, name='confirm_tshirt'),
     path('tshirt_order/', views.tshirt_order, name='tshirt_order'),